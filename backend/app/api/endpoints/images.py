@@ -0,0 +1,61 @@
+from typing import Optional
+
+from fastapi import APIRouter, UploadFile, File, HTTPException
+
+from ...core.metrics import stage
+from ...services.image_io import run_codec
+from ...services.image_store import ImageSource, get_image_store
+
+router = APIRouter(prefix="/images", tags=["images"])
+
+
+async def read_image(
+    upload: Optional[UploadFile],
+    image_id: Optional[str],
+    field: str = "image",
+    required: bool = True,
+) -> Optional[ImageSource]:
+    """Resolve a form's ``<field>`` upload or ``<field>_id`` handle (from ``POST /images``)."""
+    if image_id:
+        stored = await run_codec(get_image_store().get, image_id)  # a disk-tier hit re-decodes
+        if stored is None:
+            raise HTTPException(status_code=404, detail=f"Unknown or expired {field}_id; upload the image again")
+        return stored
+    if upload is not None:
+        with stage("upload_read"):
+            return await upload.read()
+    if required:
+        raise HTTPException(status_code=400, detail=f"Provide {field} or {field}_id")
+    return None
+
+
+@router.post("", status_code=201)
+async def store_image(image: UploadFile = File(...)):
+    """Upload a document once; pass the returned ``image_id`` instead of the file afterwards."""
+    with stage("upload_read"):
+        data = await image.read()
+    try:
+        with stage("decode"):
+            stored = await run_codec(get_image_store().put, data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return dict(stored.describe(), expires_in=get_image_store().ttl_seconds)
+
+
+@router.get("/stats")
+async def image_store_stats():
+    return get_image_store().stats()
+
+
+@router.get("/{image_id}")
+async def describe_image(image_id: str):
+    stored = await run_codec(get_image_store().get, image_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired image_id")
+    return dict(stored.describe(), expires_in=get_image_store().ttl_seconds)
+
+
+@router.delete("/{image_id}", status_code=204)
+async def delete_image(image_id: str):
+    if not await run_codec(get_image_store().delete, image_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired image_id")
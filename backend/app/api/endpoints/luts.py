@@ -1,12 +1,32 @@
-from fastapi import APIRouter, UploadFile, File, Form
-from fastapi.responses import StreamingResponse, JSONResponse
-from typing import Optional
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool
+from typing import List, Optional, Tuple
 import io
+import asyncio
+import re
+import json
+import uuid
+from urllib.parse import quote
 
+from PIL import Image
+
+from ...core.config import settings
+from ...core.metrics import stage
+from ...services.admission import INTERACTIVE, get_admission_controller
+from ...services.image_io import run_codec
+from ...services.image_store import ImageSource, StoredImage
 from ...services.lut_service import LUTService
+from .images import read_image
 
 router = APIRouter(prefix="/luts", tags=["luts"])
-service = LUTService()
+# LUT files are parsed and compiled once, at import/startup
+service = LUTService(
+    lut_dir=settings.LUT_DIR,
+    workers=settings.LUT_WORKERS or None,
+    memory_budget_bytes=settings.LUT_MEMORY_BUDGET_MB * 1024 * 1024,
+)
 
 
 @router.get("/health")
@@ -14,18 +34,223 @@ async def health():
     return {"status": "ok", "service": "luts"}
 
 
+def _decode(src: ImageSource) -> Image.Image:
+    if isinstance(src, StoredImage):
+        return src.image  # decoded once at upload; read-only
+    try:
+        return Image.open(io.BytesIO(src))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+
+
+def _load_pixels(img: Image.Image) -> None:
+    with stage("decode"):
+        img.load()  # uploads are opened lazily; keep decode out of the lut_apply stage
+
+
+def _graded_png(img: Image.Image, flt, compress_level: int) -> bytes:
+    _load_pixels(img)
+    out_image = service.apply_filter(img, flt)
+    with stage("encode"):
+        buf = io.BytesIO()
+        out_image.save(buf, format="PNG", compress_level=compress_level)
+    return buf.getvalue()
+
+
+def _tiled_png(img: Image.Image, flt, compress_level: int):
+    _load_pixels(img)
+    with stage("decode"):
+        return service.iter_filter_png(img, flt, compress_level=compress_level)  # RGB convert happens here
+
+
+async def _graded_stream(chunks, held):
+    """Send ``chunks`` while a producer grades strips ahead of the client.
+
+    The admission slot is released as soon as the last strip is graded, not
+    when the client has read the body: a slow download must not block other
+    CPU work. The price is that deflated strips may queue up ahead of a slow
+    client, at most the encoded PNG (what the untiled path holds anyway).
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce() -> None:
+        try:
+            async for chunk in iterate_in_threadpool(chunks):
+                queue.put_nowait(chunk)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            await held.aclose()
+            queue.put_nowait(None)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        if not producer.done():
+            producer.cancel()
+        await held.aclose()
+
+
+async def _render_png(img: Image.Image, flt, tiled: Optional[bool], compress_level: int) -> Response:
+    if not 0 <= compress_level <= 9:
+        raise HTTPException(status_code=400, detail="compress_level must be between 0 and 9")
+    # LUT work is interactive CPU work: admitted ahead of queued diffusion on the same device
+    admission = get_admission_controller()
+    if tiled is None:
+        tiled = img.width * img.height >= settings.LUT_TILED_MIN_MP * 1_000_000
+    if tiled:
+        # Strip-parallel grading, PNG streamed out as strips complete
+        held = await admission.hold("cpu", INTERACTIVE)
+        try:
+            chunks = await asyncio.to_thread(_tiled_png, img, flt, compress_level)
+        except BaseException:
+            await held.aclose()
+            raise
+        return StreamingResponse(
+            _graded_stream(chunks, held),
+            media_type="image/png",
+            background=BackgroundTask(held.aclose),  # also runs when the client disconnects
+        )
+    data = await admission.run("cpu", INTERACTIVE, _graded_png, img, flt, compress_level)
+    # Not StreamingResponse(buf): iterating a BytesIO yields newline-split chunks
+    return Response(content=data, media_type="image/png")
+
+
+def _png(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+def _content_disposition(name: str) -> str:
+    """RFC 6266 header value: an ASCII-safe quoted fallback plus the exact name as ``filename*``."""
+    safe = re.sub(r'[^A-Za-z0-9 ._()+-]', "_", name)
+    return f'inline; name="{safe}"; filename="{safe}.png"; filename*=UTF-8\'\'{quote(name + ".png", safe="")}'
+
+
+def _multipart_pngs(previews: List[Image.Image], names: List[str], boundary: str) -> bytes:
+    parts = []
+    for name, preview in zip(names, previews):
+        parts.append(
+            f"--{boundary}\r\n"
+            f"Content-Type: image/png\r\n"
+            f"Content-Disposition: {_content_disposition(name)}\r\n\r\n".encode("ascii")
+            + _png(preview) + b"\r\n"
+        )
+    return b"".join(parts) + f"--{boundary}--\r\n".encode("utf-8")
+
+
+def _atlas_png(previews: List[Image.Image], names: List[str], columns: Optional[int]) -> Tuple[bytes, List[dict]]:
+    atlas, offsets = service.build_atlas(previews, names, columns=columns)
+    return _png(atlas), offsets
+
+
+def _parse_stack(stack: str) -> List[Tuple[str, float]]:
+    """Accepts [{"name": ..., "intensity": ...}, ...] or [[name, intensity], ...]."""
+    try:
+        items = json.loads(stack or "[]")
+        steps = []
+        for item in items:
+            if isinstance(item, dict):
+                steps.append((str(item["name"]), float(item.get("intensity", 1.0))))
+            elif isinstance(item, str):
+                steps.append((item, 1.0))
+            else:
+                steps.append((str(item[0]), float(item[1]) if len(item) > 1 else 1.0))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid LUT stack: {e}")
+    if not steps:
+        raise HTTPException(status_code=400, detail="Empty LUT stack")
+    return steps
+
+
 @router.post("/apply")
 async def apply_lut(
-    image: UploadFile = File(...),
+    image: Optional[UploadFile] = File(None),
+    image_id: Optional[str] = Form(None),  # handle from POST /images, instead of the file
     lut_name: str = Form(...),
-    intensity: float = Form(1.0)
+    intensity: float = Form(1.0),
+    tiled: Optional[bool] = Form(None),  # None = auto by image size
+    compress_level: int = Form(6),
 ):
-    data = await image.read()
-    out_image = await service.apply_lut_bytes(data, lut_name, intensity)
-    buf = io.BytesIO()
-    out_image.save(buf, format="PNG")
-    buf.seek(0)
-    return StreamingResponse(buf, media_type="image/png")
+    img = _decode(await read_image(image, image_id))
+    try:
+        flt = service.get_filter(lut_name, intensity)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return await _render_png(img, flt, tiled, compress_level)
+
+
+@router.post("/apply-stack")
+async def apply_lut_stack(
+    image: Optional[UploadFile] = File(None),
+    image_id: Optional[str] = Form(None),  # handle from POST /images, instead of the file
+    stack: str = Form(...),  # JSON: [{"name": "tech", "intensity": 1.0}, {"name": "look", "intensity": 0.6}]
+    tiled: Optional[bool] = Form(None),
+    compress_level: int = Form(6),
+):
+    """Apply an ordered LUT stack, baked into one 3D table, in a single pass."""
+    steps = _parse_stack(stack)
+    img = _decode(await read_image(image, image_id))
+    try:
+        flt = service.get_stack_filter(steps)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return await _render_png(img, flt, tiled, compress_level)
+
+
+@router.post("/preview")
+async def preview_luts(
+    image: Optional[UploadFile] = File(None),
+    image_id: Optional[str] = Form(None),  # handle from POST /images, instead of the file
+    lut_names: str = Form(""),  # JSON list; empty = all loaded LUTs
+    preview_size: int = Form(256),
+    intensity: float = Form(1.0),
+    layout: str = Form("atlas"),  # atlas | multipart
+    columns: Optional[int] = Form(None),
+):
+    """Render every requested LUT on one downsampled decode of ``image``.
+
+    ``atlas`` returns a single PNG contact sheet with per-LUT offsets in the
+    ``X-LUT-Atlas`` header; ``multipart`` returns one PNG part per LUT.
+    """
+    try:
+        names = json.loads(lut_names) if lut_names else service.list_luts()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid lut_names: {e}")
+    if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+        raise HTTPException(status_code=400, detail="lut_names must be a JSON list of LUT names")
+    if columns is not None and not 1 <= columns <= max(1, len(names)):
+        raise HTTPException(status_code=400, detail=f"columns must be between 1 and {len(names)}")
+    img = _decode(await read_image(image, image_id))
+    preview_size = min(max(int(preview_size), 16), 1024)
+    try:
+        previews = await get_admission_controller().run(
+            "cpu", INTERACTIVE, service.render_previews, img, names, preview_size, intensity,
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+    if layout == "multipart":
+        boundary = uuid.uuid4().hex
+        with stage("encode"):
+            body = await run_codec(_multipart_pngs, previews, names, boundary)
+        return Response(content=body, media_type=f"multipart/mixed; boundary={boundary}")
+
+    with stage("encode"):
+        data, offsets = await run_codec(_atlas_png, previews, names, columns)
+    return Response(
+        content=data,
+        media_type="image/png",
+        headers={"X-LUT-Atlas": json.dumps(offsets, separators=(",", ":"))},
+    )
 
 
 @router.get("/list")
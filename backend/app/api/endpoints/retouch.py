@@ -1,14 +1,85 @@
+import json
 import base64
-from typing import Optional
+import asyncio
+from typing import Any, Dict, Optional, Tuple
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 
+from ...core.metrics import stage
+from ...services.admission import AdmissionRejected
 from ...services.ai_service import get_ai_service
+from ...services.image_io import negotiate_output, run_codec
+from ...services.image_store import ImageSource, source_bytes
+from ...services.png_stream import iter_png_image
+from ...services.progress import ProgressReporter, sse_event
+from ...services.job_queue import get_job_queue, JOB_SUCCEEDED, JOB_FAILED
+from .images import read_image
 
 router = APIRouter(prefix="/retouch", tags=["retouch"])
 
 
+class RetouchForm:
+    """Form fields shared by ``/process``, ``/process/stream`` and ``/jobs`` (use via ``Depends()``)."""
+
+    def __init__(
+        self,
+        prompt: str = Form(...),
+        operation: str = Form("img2img"),
+        image: Optional[UploadFile] = File(None),
+        mask: Optional[UploadFile] = File(None),
+        image_id: Optional[str] = Form(None),  # handles from POST /images, instead of the files
+        mask_id: Optional[str] = Form(None),
+        strength: float = Form(0.7),
+        guidance_scale: float = Form(7.5),
+        steps: int = Form(30),
+        seed: Optional[int] = Form(None),
+        enhance_faces: bool = Form(False),
+        upscale: bool = Form(False),
+        upscale_scale: int = Form(2),
+        crop_to_mask: Optional[bool] = Form(None),
+        mask_padding: Optional[int] = Form(None),
+        feather: Optional[int] = Form(None),
+        tiled: Optional[bool] = Form(None),
+        tile_size: Optional[int] = Form(None),
+        tile_overlap: Optional[int] = Form(None),
+    ) -> None:
+        if tile_size is not None or tile_overlap is not None:
+            try:
+                get_ai_service().tiling(tile_size, tile_overlap)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        self.prompt = prompt
+        self.image, self.mask = image, mask
+        self.image_id, self.mask_id = image_id, mask_id
+        self._params: Dict[str, Any] = dict(
+            operation=operation,
+            strength=strength,
+            guidance_scale=guidance_scale,
+            num_inference_steps=steps,
+            seed=seed,
+            enhance_faces=enhance_faces,
+            upscale=upscale,
+            upscale_scale=upscale_scale,
+            crop_to_mask=crop_to_mask,
+            mask_padding=mask_padding,
+            feather=feather,
+            tiled=tiled,
+            tile_size=tile_size,
+            tile_overlap=tile_overlap,
+        )
+
+    def params(self) -> Dict[str, Any]:
+        """Keyword arguments for ``AIService.process_image`` / ``generate`` besides the inputs."""
+        return dict(self._params)
+
+    async def read_inputs(self) -> Tuple[Optional[ImageSource], Optional[ImageSource]]:
+        """The init image and mask, each from its upload or ``*_id`` handle."""
+        init = await read_image(self.image, self.image_id, required=False)
+        mask = await read_image(self.mask, self.mask_id, field="mask", required=False)
+        return init, mask
+
+
 @router.get("/capabilities")
 async def capabilities():
     ai = get_ai_service()
@@ -18,48 +89,164 @@ async def capabilities():
         "device": health.get("device", "cpu"),
         "capabilities": health.get("capabilities", [
             "txt2img", "img2img", "inpaint", "enhance_faces", "upscale"
-        ])
+        ]),
+        "memory": health.get("memory", {}),
     })
 
 
+@router.get("/cache-stats")
+async def cache_stats():
+    return get_ai_service().cache_stats()
+
+
 @router.post("/process")
 async def process_image(
-    prompt: str = Form(...),
-    operation: str = Form("img2img"),
-    image: Optional[UploadFile] = File(None),
-    mask: Optional[UploadFile] = File(None),
-    strength: float = Form(0.7),
-    guidance_scale: float = Form(7.5),
-    steps: int = Form(30),
-    seed: Optional[int] = Form(None),
-    enhance_faces: bool = Form(False),
-    upscale: bool = Form(False),
-    upscale_scale: int = Form(2),
+    request: Request,
+    form: RetouchForm = Depends(),
+    response_format: Optional[str] = Form(None),  # json | binary | png | webp | jpeg
+    image_format: Optional[str] = Form(None),
+    quality: int = Form(90),
+    compress_level: int = Form(6),
 ):
+    """
+    Default response is JSON ``{image_base64, meta}``. Send ``Accept: image/png``
+    (or webp/jpeg), or ``response_format=binary``, to receive the raw encoded image
+    with metadata in the ``X-Retouch-Meta`` header.
+    """
+    try:
+        binary, fmt = negotiate_output(request.headers.get("accept"), response_format, image_format)
+    except ValueError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    if not 1 <= quality <= 100 or not 0 <= compress_level <= 9:
+        raise HTTPException(status_code=400, detail="quality must be 1-100 and compress_level 0-9")
+
     ai = get_ai_service()
-    init_bytes = await image.read() if image is not None else None
-    mask_bytes = await mask.read() if mask is not None else None
+    init_bytes, mask_bytes = await form.read_inputs()
+    prompt = form.prompt
+    params = dict(form.params(), mask_bytes=mask_bytes)
 
     try:
+        if binary and fmt == "png" and params["seed"] is None:
+            # Unseeded (uncacheable) PNG: strips are deflated as they are sent,
+            # so no full encoded copy is held
+            result_img, meta = await ai.generate(init_bytes, prompt, **params)
+            return StreamingResponse(
+                iter_png_image(result_img, compress_level=compress_level),
+                media_type="image/png",
+                headers={"X-Retouch-Meta": json.dumps(meta)},
+            )
+
         result = await ai.process_image(
             init_bytes,
             prompt,
-            operation=operation,
-            strength=strength,
-            guidance_scale=guidance_scale,
-            num_inference_steps=steps,
-            seed=seed,
-            mask_bytes=mask_bytes,
-            enhance_faces=enhance_faces,
-            upscale=upscale,
-            upscale_scale=upscale_scale,
+            output_format=fmt,
+            quality=quality,
+            compress_level=compress_level,
+            **params,
         )
-        img_b64 = base64.b64encode(result["image_png"]).decode("utf-8")
+        if binary:
+            return Response(
+                content=result["image_bytes"],
+                media_type=result["media_type"],
+                headers={"X-Retouch-Meta": json.dumps(result.get("meta", {}))},
+            )
+        with stage("base64"):
+            img_b64 = (await run_codec(base64.b64encode, result["image_bytes"])).decode("utf-8")
         return JSONResponse({
             "image_base64": img_b64,
+            "media_type": result["media_type"],
             "meta": result.get("meta", {}),
         })
-    except HTTPException:
+    except (HTTPException, AdmissionRejected):
         raise
+    except ValueError as e:  # invalid inputs, e.g. a mask whose aspect ratio differs from the image
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/process/stream")
+async def process_image_stream(
+    form: RetouchForm = Depends(),
+    preview_every: int = Form(5),
+    preview_size: int = Form(256),
+):
+    """
+    Same as ``/process`` but answers with Server-Sent Events: ``progress`` after
+    every step, ``preview`` (latent-projection JPEG) every ``preview_every`` steps,
+    ``tiles`` for tiled runs, then ``result`` (``{image_base64, meta}``) or ``error``.
+    """
+    ai = get_ai_service()
+    init_bytes, mask_bytes = await form.read_inputs()
+    reporter = ProgressReporter(preview_every=preview_every, preview_size=preview_size)
+
+    async def events():
+        task = asyncio.ensure_future(ai.process_image(
+            init_bytes, form.prompt, mask_bytes=mask_bytes, progress=reporter, **form.params(),
+        ))
+        task.add_done_callback(lambda _: reporter.close())
+        try:
+            async for event, data in reporter.events():
+                yield sse_event(event, data)
+            try:
+                result = await task
+            except AdmissionRejected as e:
+                yield sse_event("error", {"detail": str(e), "status": 429, "retry_after": e.retry_after})
+                return
+            except Exception as e:
+                yield sse_event("error", {"detail": str(e)})
+                return
+            meta = dict(result.get("meta", {}), preview=reporter.stats())
+            yield sse_event("result", {
+                "image_base64": (await run_codec(base64.b64encode, result["image_bytes"])).decode("utf-8"),
+                "media_type": result["media_type"],
+                "meta": meta,
+            })
+        finally:
+            if not task.done():
+                task.cancel()  # client went away
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/jobs", status_code=202)
+async def submit_job(form: RetouchForm = Depends()):
+    """Queue a retouch run; poll ``/jobs/{id}`` and fetch ``/jobs/{id}/result``."""
+    # Jobs persist their inputs, so stored images are queued by their encoded bytes
+    init, mask = await form.read_inputs()
+    job = await get_job_queue().submit(
+        dict(form.params(), prompt=form.prompt),
+        image_bytes=source_bytes(init),
+        mask_bytes=source_bytes(mask),
+    )
+    return {"job_id": job.id, "status": job.status}
+
+
+@router.get("/queue")
+async def queue_stats():
+    return await get_job_queue().stats()
+
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    queue = get_job_queue()
+    job = await queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == JOB_FAILED:
+        raise HTTPException(status_code=500, detail=job.error or "Job failed")
+    if job.status != JOB_SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return FileResponse(queue.result_path(job_id), media_type="image/png")
@@ -1,98 +1,130 @@
-import io
-import os
+import re
 import json
-import base64
-from typing import Optional
+import uuid
+import asyncio
+from typing import List, Optional
 
 import numpy as np
-from PIL import Image
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 
 from ...core.config import settings
+from ...core.metrics import stage
+from ...services.admission import INTERACTIVE, AdmissionRejected, get_admission_controller
+from ...services.image_io import run_codec
+from ...services.mask_codec import MASK_FORMATS, encode_mask
+from ...services.sam_service import SAMPrompt, get_sam_service
+from .images import read_image
 
 router = APIRouter(prefix="/segmentation", tags=["segmentation"])
 
-_sam_predictor = None
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
 
 
-def _get_sam_checkpoint() -> str:
-    # Default to container path
-    return os.getenv("SAM_MODEL_PATH", getattr(settings, "SAM_MODEL_PATH", "/app/models/sam/sam_vit_b_01ec64.pth"))
+def _check_format(mask_format: str) -> str:
+    if mask_format not in MASK_FORMATS:
+        raise HTTPException(status_code=400, detail=f"mask_format must be one of {', '.join(MASK_FORMATS)}")
+    return mask_format
 
 
-def _ensure_sam_loaded():
-    global _sam_predictor
-    if _sam_predictor is not None:
-        return
+def _session(session_id: Optional[str]) -> Optional[str]:
+    """``new`` starts a refinement session; any other value continues one."""
+    if not session_id:
+        return None
+    if session_id == "new":
+        return uuid.uuid4().hex
+    if not _SESSION_ID.match(session_id):
+        raise HTTPException(status_code=400, detail="Invalid session_id")
+    return session_id
+
+
+async def _loaded_sam():
+    """The SAM service and the device its loaded predictor runs on (the admission key)."""
+    sam = get_sam_service()
     try:
-        from segment_anything import sam_model_registry, SamPredictor  # type: ignore
-        import torch  # noqa: F401
-
-        model_type = os.getenv("SAM_MODEL_TYPE", "vit_b")
-        ckpt = _get_sam_checkpoint()
-        if not os.path.exists(ckpt):
-            raise RuntimeError(f"SAM checkpoint not found at {ckpt}")
-
-        sam = sam_model_registry[model_type](checkpoint=ckpt)
-        # Move to device if CUDA available
-        try:
-            import torch
-            if torch.cuda.is_available():
-                sam.to("cuda")
-        except Exception:
-            pass
-
-        _sam_predictor = SamPredictor(sam)
+        device = await asyncio.to_thread(sam.ensure_loaded)  # a cold load must not block the event loop
     except Exception as e:
-        raise RuntimeError(f"Failed to load SAM: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return sam, device
+
+
+def _encode_candidates(masks: np.ndarray, scores: np.ndarray, order: List[int], mask_format: str, crop: bool) -> List[dict]:
+    return [dict(encode_mask(masks[i], mask_format, crop), score=float(scores[i])) for i in order]
+
+
+async def _best_mask(
+    masks: np.ndarray,
+    scores: np.ndarray,
+    mask_format: str = "png",
+    crop_to_bbox: bool = False,
+    all_masks: bool = False,
+) -> dict:
+    """The best-scoring mask as ``{mask, score, format, size, bbox, cropped}``; with
+    ``all_masks`` also every candidate, best first, under ``candidates``."""
+    order = [int(i) for i in np.argsort(-np.asarray(scores), kind="stable")]
+    with stage("encode"):
+        encoded = await run_codec(
+            _encode_candidates, masks, scores, order if all_masks else order[:1], mask_format, bool(crop_to_bbox),
+        )
+    result = dict(encoded[0])
+    if all_masks:
+        result["candidates"] = encoded
+    return result
+
+
+def _parse_prompt(item: dict) -> SAMPrompt:
+    points = [[float(x), float(y)] for x, y in (item.get("points") or [])]
+    labels = [int(v) for v in (item.get("labels") or [])]
+    box = item.get("box")
+    if box is not None:
+        box = [float(v) for v in box]
+        if len(box) != 4:
+            raise ValueError("box must be [x1, y1, x2, y2]")
+    if not points and box is None:
+        raise ValueError("each prompt needs points or a box")
+    return SAMPrompt(points=points, labels=labels, box=box)
 
 
 @router.post("/segment-from-points")
 async def segment_from_points(
-    image: UploadFile = File(...),
+    image: Optional[UploadFile] = File(None),
+    image_id: Optional[str] = Form(None),  # handle from POST /images, instead of the file
     points: str = Form("[]"),  # JSON: [[x,y], ...]
     labels: str = Form("[]"),  # JSON: [1,0,...]
     multimask_output: bool = Form(True),
+    mask_format: str = Form("png"),  # png | rle (COCO) | bits (np.packbits)
+    crop_to_bbox: bool = Form(False),
+    all_masks: bool = Form(False),  # also return every multimask candidate
+    session_id: Optional[str] = Form(None),  # "new" to start refining, then the returned id
 ):
-    """Segment using point prompts via SAM. Returns base64 PNG mask and score."""
-    try:
-        _ensure_sam_loaded()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    """
+    Segment using point prompts via SAM. Returns the best mask and its score.
+
+    In a session, send all clicks so far on every request: the previous
+    result's low-res logits are fed back as SAM's ``mask_input``, so each
+    click refines the current mask.
+    """
+    _check_format(mask_format)
+    session = _session(session_id)
+    sam, device = await _loaded_sam()
 
     try:
-        data = await image.read()
-        pil = Image.open(io.BytesIO(data)).convert("RGB")
-        np_img = np.array(pil)
+        data = await read_image(image, image_id)
 
         pts = json.loads(points or "[]")
         lbs = json.loads(labels or "[]")
         if len(pts) == 0:
             raise HTTPException(status_code=400, detail="No points provided")
 
-        import numpy as np  # local import to ensure availability
-        input_points = np.array(pts)
-        input_labels = np.array(lbs if len(lbs) == len(pts) else [1] * len(pts))
-
-        _sam_predictor.set_image(np_img)
-        masks, scores, logits = _sam_predictor.predict(
-            point_coords=input_points,
-            point_labels=input_labels,
-            multimask_output=bool(multimask_output),
+        # Interactive lane: clicks overtake queued diffusion work on the same device
+        masks, scores, _ = await get_admission_controller().run(
+            device, INTERACTIVE, sam.segment_points, data, pts, lbs, bool(multimask_output), session,
         )
 
-        best_idx = int(np.argmax(scores))
-        best_mask = masks[best_idx]
-        score = float(scores[best_idx])
-
-        mask_pil = Image.fromarray((best_mask * 255).astype(np.uint8))
-        buf = io.BytesIO()
-        mask_pil.save(buf, format="PNG")
-        buf.seek(0)
-        mask_b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-
-        return {"mask": mask_b64, "score": score}
-    except HTTPException:
+        result = await _best_mask(masks, scores, mask_format, crop_to_bbox, all_masks)
+        if session:
+            result["session_id"] = session
+        return result
+    except (HTTPException, AdmissionRejected):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"SAM segmentation failed: {e}")
@@ -100,9 +132,94 @@ async def segment_from_points(
 
 @router.post("/segment-from-box")
 async def segment_from_box(
-    image: UploadFile = File(...),
+    image: Optional[UploadFile] = File(None),
+    image_id: Optional[str] = Form(None),
     box: str = Form("[]"),  # JSON: [x1, y1, x2, y2]
+    points: str = Form("[]"),  # optional refinement points inside the box
+    labels: str = Form("[]"),
+    multimask_output: bool = Form(False),
+    mask_format: str = Form("png"),
+    crop_to_bbox: bool = Form(False),
+    all_masks: bool = Form(False),
+    session_id: Optional[str] = Form(None),
+):
+    """Segment the object inside a box via SAM. Returns the best mask and its score."""
+    _check_format(mask_format)
+    session = _session(session_id)
+    try:
+        prompt = _parse_prompt({
+            "box": json.loads(box or "null") or None,
+            "points": json.loads(points or "[]"),
+            "labels": json.loads(labels or "[]"),
+        })
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid box prompt: {e}")
+    if prompt.box is None:
+        raise HTTPException(status_code=400, detail="No box provided")
+    sam, device = await _loaded_sam()
+    data = await read_image(image, image_id)
+    try:
+        masks, scores, _ = await get_admission_controller().run(
+            device, INTERACTIVE, sam.segment, data, prompt, bool(multimask_output), session,
+        )
+        result = await _best_mask(masks, scores, mask_format, crop_to_bbox, all_masks)
+        if session:
+            result["session_id"] = session
+        return result
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"SAM segmentation failed: {e}")
+
+
+@router.post("/segment-batch")
+async def segment_batch(
+    image: Optional[UploadFile] = File(None),
+    image_id: Optional[str] = Form(None),
+    prompts: str = Form("[]"),  # JSON: [{"box": [x1,y1,x2,y2]}, {"points": [[x,y]], "labels": [1]}, ...]
+    multimask_output: bool = Form(False),
+    mask_format: str = Form("png"),
+    crop_to_bbox: bool = Form(False),
+    all_masks: bool = Form(False),
 ):
-    # TODO: Implement box-based SAM segmentation
-    _ = await image.read()
-    return {"note": "box-based segmentation not implemented yet", "box": box}
+    """
+    Many prompts (e.g. every face in a group shot) on one image: one SAM
+    encoder run and one batched mask-decoder pass. Returns one
+    ``{mask, score}`` per prompt, in order.
+    """
+    _check_format(mask_format)
+    try:
+        parsed = [_parse_prompt(item) for item in json.loads(prompts or "[]")]
+    except (ValueError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid prompts: {e}")
+    if not parsed:
+        raise HTTPException(status_code=400, detail="No prompts provided")
+    if len(parsed) > settings.SAM_MAX_BATCH_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.SAM_MAX_BATCH_PROMPTS} prompts per request")
+    sam, device = await _loaded_sam()
+    data = await read_image(image, image_id)
+    try:
+        results = await get_admission_controller().run(
+            device, INTERACTIVE, sam.segment_batch, data, parsed, bool(multimask_output),
+        )
+        encoded = await asyncio.gather(*(
+            _best_mask(masks, scores, mask_format, crop_to_bbox, all_masks) for masks, scores, _ in results
+        ))
+        return {"results": list(encoded)}
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"SAM segmentation failed: {e}")
+
+
+@router.delete("/sessions/{session_id}", status_code=204)
+async def end_session(session_id: str):
+    """Drop a refinement session's stored logits (they also age out of an LRU)."""
+    if not get_sam_service().end_session(session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired session_id")
+
+
+@router.get("/cache-stats")
+async def cache_stats():
+    """Embedding cache counters (hits skip the SAM image encoder)."""
+    return get_sam_service().cache_stats()
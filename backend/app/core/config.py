@@ -8,9 +8,50 @@ class Settings(BaseSettings):
     QWEN_IMAGE_MODEL: str = os.getenv("QWEN_IMAGE_MODEL", "Qwen/Qwen2-VL-2B-Instruct")
     AI_DEVICE: str = os.getenv("AI_DEVICE", "")
     SAM_MODEL_PATH: str = os.getenv("SAM_MODEL_PATH", "/app/models/sam/sam_vit_b_01ec64.pth")
+    SAM_MODEL_TYPE: str = os.getenv("SAM_MODEL_TYPE", "vit_b")
+    SAM_EMBEDDING_CACHE_MB: int = int(os.getenv("SAM_EMBEDDING_CACHE_MB", "256"))
+    SAM_MAX_BATCH_PROMPTS: int = int(os.getenv("SAM_MAX_BATCH_PROMPTS", "64"))
+    # Float mask pixels (millions) upsampled per chunk of a batched SAM decode
+    SAM_UPSAMPLE_BUDGET_MP: float = float(os.getenv("SAM_UPSAMPLE_BUDGET_MP", "64"))
+    SAM_MAX_SESSIONS: int = int(os.getenv("SAM_MAX_SESSIONS", "256"))  # refinement sessions (256 KB of logits each)
+    LUT_DIR: str = os.getenv("LUT_DIR", "/app/models/luts")
+    LUT_WORKERS: int = int(os.getenv("LUT_WORKERS", "0"))  # 0 = one per CPU
+    LUT_MEMORY_BUDGET_MB: int = int(os.getenv("LUT_MEMORY_BUDGET_MB", "256"))
+    LUT_TILED_MIN_MP: float = float(os.getenv("LUT_TILED_MIN_MP", "16"))
+    CODEC_WORKERS: int = int(os.getenv("CODEC_WORKERS", "0"))  # image decode/encode threads; 0 = min(4, CPUs)
 
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://redis:6379/0")
     POSTGRES_DSN: str = os.getenv("POSTGRES_DSN", "postgresql://postgres:postgres@db:5432/retouch")
+    STORAGE_DIR: str = os.getenv("STORAGE_DIR", "/app/storage")
+
+    # Results of seeded (deterministic) retouch requests
+    RESULT_CACHE_MB: int = int(os.getenv("RESULT_CACHE_MB", "256"))
+    RESULT_CACHE_DISK_MB: int = int(os.getenv("RESULT_CACHE_DISK_MB", "2048"))  # 0 = memory only
+
+    # Upload-once image handles (POST /images)
+    IMAGE_STORE_MB: int = int(os.getenv("IMAGE_STORE_MB", "1024"))
+    IMAGE_STORE_DISK_MB: int = int(os.getenv("IMAGE_STORE_DISK_MB", "4096"))  # 0 = memory only
+    IMAGE_STORE_TTL_SECONDS: float = float(os.getenv("IMAGE_STORE_TTL_SECONDS", "3600"))
+
+    # Admission control: concurrent work per device, and requests accepted per lane (0 = unbounded)
+    DEVICE_CONCURRENCY: str = os.getenv("DEVICE_CONCURRENCY", "cuda=1,mps=1,cpu=1")
+    INTERACTIVE_BURST: int = int(os.getenv("INTERACTIVE_BURST", "1"))
+    QUEUE_LIMIT_INTERACTIVE: int = int(os.getenv("QUEUE_LIMIT_INTERACTIVE", "64"))
+    QUEUE_LIMIT_BATCH: int = int(os.getenv("QUEUE_LIMIT_BATCH", "16"))
+    QUEUE_LIMIT_BACKGROUND: int = int(os.getenv("QUEUE_LIMIT_BACKGROUND", "0"))
+
+    # Models loaded in the background at startup (txt2img, img2img, inpaint, sam); readiness waits for all
+    PRELOAD_MODELS: str = os.getenv("PRELOAD_MODELS", "img2img,inpaint")
+    PRELOAD_CONCURRENCY: int = int(os.getenv("PRELOAD_CONCURRENCY", "0"))  # 0 = all at once
+    # Failed preloads are retried, backing off from RETRY to RETRY_MAX seconds (0 = never)
+    PRELOAD_RETRY_SECONDS: float = float(os.getenv("PRELOAD_RETRY_SECONDS", "5"))
+    PRELOAD_RETRY_MAX_SECONDS: float = float(os.getenv("PRELOAD_RETRY_MAX_SECONDS", "300"))
+    SD_USE_SAFETENSORS: str = os.getenv("SD_USE_SAFETENSORS", "auto")  # auto | true | false
+
+    # Retouch job queue
+    JOB_BROKER: str = os.getenv("JOB_BROKER", "memory")  # memory | redis
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "1"))
+    JOB_PERSIST_POSTGRES: bool = os.getenv("JOB_PERSIST_POSTGRES", "false").lower() in ("1", "true", "yes")
 
 
 settings = Settings()
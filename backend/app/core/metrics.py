@@ -0,0 +1,345 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+
+Prometheus-compatible metrics and per-request stage timings.
+
+- ``Counter``/``Gauge``/``Histogram`` with labels, rendered in the Prometheus
+  text exposition format by ``render()`` (served on ``/metrics``).
+- ``stage(name)`` times a block of the request hot path: the duration goes
+  into the ``retouch_stage_seconds`` histogram and, when called on behalf of
+  an HTTP request, into that request's ``Server-Timing`` header. The request
+  is tracked with a context variable, so stages inside ``asyncio.to_thread``
+  calls are attributed as well.
+"""
+
+import os
+import sys
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        # Unlabelled series exist (at 0) from the start, as Prometheus clients expect
+        self._values: Dict[LabelValues, float] = {} if self.labelnames else {(): 0.0}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        # label values -> [bucket counts..., sum, count]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        row = self._values.get(self._key(labels))
+        return int(row[-1]) if row else 0
+
+    def sum(self, **labels: str) -> float:
+        row = self._values.get(self._key(labels))
+        return row[-2] if row else 0.0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = []
+        for key, row in items:
+            for bound, n in zip(self.buckets + (float("inf"),), row[:len(self.buckets)] + [row[-1]]):
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(n)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(row[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(row[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics (created once, reused on later lookups) plus scrape-time collectors."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def add_collector(self, collect: Callable[[], None]) -> None:
+        """``collect()`` runs before every ``render`` to refresh gauges from live state."""
+        with self._lock:
+            if collect not in self._collectors:
+                self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in list(self._collectors):
+            try:
+                collect()
+            except Exception:
+                pass  # a broken collector must not take the scrape down
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _get(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already registered with a different type or labels")
+            return metric
+
+
+metrics = MetricsRegistry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = metrics.histogram(
+    "retouch_stage_seconds", "Wall time of request hot-path stages.", ["stage"],
+)
+REQUEST_SECONDS = metrics.histogram(
+    "retouch_http_request_seconds", "HTTP request latency (until response headers).", ["method", "route", "status"],
+)
+MODEL_LOAD_SECONDS = metrics.histogram(
+    "retouch_model_load_seconds", "Model load time.", ["model"],
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+PROCESS_MEMORY = metrics.gauge(
+    "retouch_process_resident_memory_bytes", "Resident set size of the API process.",
+)
+GPU_MEMORY = metrics.gauge(
+    "retouch_gpu_memory_bytes", "CUDA memory held by the torch allocator.", ["kind"],
+)
+
+
+# -----------------------------
+# Per-request stage timings
+# -----------------------------
+_request_stages: "contextvars.ContextVar[Optional[List[Tuple[str, float]]]]" = contextvars.ContextVar(
+    "request_stages", default=None,
+)
+
+
+def start_request() -> Tuple[List[Tuple[str, float]], contextvars.Token]:
+    """Begin collecting stages for the current request; pass the token to ``end_request``."""
+    stages: List[Tuple[str, float]] = []
+    return stages, _request_stages.set(stages)
+
+
+def end_request(token: contextvars.Token) -> None:
+    _request_stages.reset(token)
+
+
+def detach_request() -> None:
+    """
+    Stop attributing stages in the current context to a request. For shared
+    work (e.g. a micro-batch serving several requests) that is started from
+    one request's context but should only feed the histograms.
+    """
+    _request_stages.set(None)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=name)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def server_timing(stages: Sequence[Tuple[str, float]], total: Optional[float] = None) -> str:
+    """``Server-Timing`` value; repeated stages (tiles, batches) are summed in first-seen order."""
+    totals: Dict[str, float] = {}
+    for name, seconds in stages:
+        totals[name] = totals.get(name, 0.0) + seconds
+    if total is not None:
+        totals["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000.0:.1f}" for name, seconds in totals.items())
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware: collects stages per HTTP request, adds them as a
+    ``Server-Timing`` header and records the request latency histogram.
+
+    Headers go out before a streamed body, so work done while streaming
+    (e.g. strip-wise PNG encoding) only reaches the histograms.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stages, token = start_request()
+        start = time.perf_counter()
+
+        async def send_with_timing(message) -> None:
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - start
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(stages, total).encode("latin-1")))
+                headers.append((b"timing-allow-origin", b"*"))
+                message = dict(message, headers=headers)
+                route = scope.get("route")
+                REQUEST_SECONDS.observe(
+                    total,
+                    method=scope.get("method", ""),
+                    route=getattr(route, "path", "unmatched"),
+                    status=str(message["status"]),
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            end_request(token)
+
+
+# -----------------------------
+# Process memory
+# -----------------------------
+def _resident_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # peak, not current
+    except Exception:
+        return None
+
+
+def collect_process_memory() -> None:
+    rss = _resident_bytes()
+    if rss is not None:
+        PROCESS_MEMORY.set(rss)
+    torch = sys.modules.get("torch")  # never import torch just to report on it
+    if torch is not None and torch.cuda.is_available():
+        GPU_MEMORY.set(torch.cuda.memory_allocated(), kind="allocated")
+        GPU_MEMORY.set(torch.cuda.memory_reserved(), kind="reserved")
+
+
+metrics.add_collector(collect_process_memory)
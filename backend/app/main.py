@@ -1,11 +1,18 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 
 from .api.endpoints.retouch import router as retouch_router
 from .api.endpoints.luts import router as luts_router
 from .api.endpoints.segmentation import router as segmentation_router
+from .api.endpoints.images import router as images_router
+from .services.admission import AdmissionRejected, get_admission_controller
 from .services.ai_service import get_ai_service
+from .services.job_queue import get_job_queue
+from .services.model_registry import get_model_registry
+from .services.preload import get_preloader
 from .core.config import settings
+from .core.metrics import CONTENT_TYPE, ServerTimingMiddleware, metrics
 
 app = FastAPI(title="AI Retouch Studio API")
 
@@ -15,18 +22,39 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-LUT-Atlas", "X-Retouch-Meta", "Server-Timing", "Retry-After"],
 )
+# Per-stage timings of every request in a Server-Timing header (+ latency histograms)
+app.add_middleware(ServerTimingMiddleware)
 
 app.include_router(luts_router, prefix=settings.API_PREFIX)
 app.include_router(retouch_router, prefix=settings.API_PREFIX)
 app.include_router(segmentation_router, prefix=settings.API_PREFIX)
+app.include_router(images_router, prefix=settings.API_PREFIX)
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "lane": exc.lane, "device": exc.device},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 
 @app.on_event("startup")
 async def startup_event():
-    # Warm up AI model asynchronously
+    # Cheap setup only; model weights load in the background (see /health/ready)
     ai = get_ai_service()
     await ai.warmup()
+    get_preloader().start()
+    await get_job_queue().start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    get_preloader().stop()
+    await get_job_queue().stop()
 
 
 @app.get("/")
@@ -34,8 +62,43 @@ async def root():
     return {"service": "ai-retouch-studio", "status": "ok"}
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint: stage/request histograms, queue depths, model and memory gauges."""
+    await get_job_queue().collect_metrics()
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+
 @app.get(f"{settings.API_PREFIX}/health")
 async def api_health():
     ai = get_ai_service()
     health = await ai.health()
-    return {"status": "ok", "device": health.get("device", "cpu")}
+    return {
+        "status": "ok",
+        "device": health.get("device", "cpu"),
+        "models": get_model_registry().stats(),
+        "admission": get_admission_controller().stats(),
+        "preload": get_preloader().status(),
+    }
+
+
+@app.get(f"{settings.API_PREFIX}/health/live")
+async def api_live():
+    """Liveness: the process serves requests (models may still be loading)."""
+    return {"status": "ok"}
+
+
+@app.get(f"{settings.API_PREFIX}/health/ready")
+async def api_ready():
+    """Readiness: 200 once every preloaded model is warm, 503 (with per-model states) until then."""
+    status = get_preloader().status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get(f"{settings.API_PREFIX}/health/ready/{{model}}")
+async def api_model_ready(model: str):
+    preloader = get_preloader()
+    if model not in preloader.models:
+        return JSONResponse(status_code=404, content={"detail": f"{model} is not in the preload plan"})
+    state = preloader.models[model].to_dict()
+    return JSONResponse(status_code=200 if preloader.model_ready(model) else 503, content=state)
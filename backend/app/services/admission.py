@@ -0,0 +1,233 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+"""
+
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+
+from ..core.config import settings
+from ..core.metrics import metrics, record_stage
+
+# Lanes in priority order: a free slot always goes to the first lane with waiters
+INTERACTIVE = "interactive"  # SAM clicks, LUT apply/previews
+BATCH = "batch"  # synchronous diffusion requests
+BACKGROUND = "background"  # queued retouch jobs
+LANES = (INTERACTIVE, BATCH, BACKGROUND)
+
+_WAITING = metrics.gauge("retouch_admission_waiting", "Work waiting for a device slot.", ["device", "lane"])
+_ACTIVE = metrics.gauge("retouch_admission_active", "Work holding a device slot.", ["device", "lane"])
+_REJECTED = metrics.counter("retouch_admission_rejected_total", "Requests rejected with 429.", ["device", "lane"])
+
+
+class AdmissionRejected(Exception):
+    """The lane's queue is full; retry after ``retry_after`` seconds (HTTP 429)."""
+
+    def __init__(self, device: str, lane: str, retry_after: int) -> None:
+        super().__init__(f"{lane} queue for {device} is full, retry in {retry_after}s")
+        self.device = device
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """``"cuda=1,cpu=2"`` -> ``{"cuda": 1, "cpu": 2}``."""
+    limits = {}
+    for part in (spec or "").split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            limits[name.strip()] = max(1, int(value))
+    return limits
+
+
+class _DeviceState:
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.active: Dict[str, int] = {lane: 0 for lane in LANES}
+        self.waiters: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self.tickets: Dict[str, int] = {lane: 0 for lane in LANES}
+        self.rejected: Dict[str, int] = {lane: 0 for lane in LANES}
+        # Smoothed slot hold time per lane, for Retry-After estimates
+        self.hold_seconds: Dict[str, float] = {lane: 0.0 for lane in LANES}
+
+
+class AdmissionController:
+    """
+    Admission control in front of the model devices.
+
+    - Each device (``cuda``, ``mps``, ``cpu``) runs at most ``limit`` units of
+      work at once; interactive work may exceed it by ``interactive_burst``, so
+      a SAM click never waits for a long diffusion batch to finish.
+    - Waiters are served strictly by lane priority (interactive, batch,
+      background), FIFO within a lane.
+    - ``ticket`` bounds how many requests per lane a device accepts (running
+      or waiting); beyond that ``AdmissionRejected`` carries a Retry-After
+      estimate from the lane's recent slot hold times.
+
+    Single event loop only: state is touched from coroutines, never threads.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, int]] = None,
+        queue_limits: Optional[Dict[str, int]] = None,
+        interactive_burst: int = 1,
+        default_limit: int = 1,
+    ) -> None:
+        self.limits = dict(limits or {})
+        self.queue_limits = {lane: int((queue_limits or {}).get(lane, 0)) for lane in LANES}  # 0 = unbounded
+        self.interactive_burst = max(0, int(interactive_burst))
+        self.default_limit = max(1, int(default_limit))
+        self._devices: Dict[str, _DeviceState] = {}
+        metrics.add_collector(self._collect)
+
+    # -----------------------------
+    # Public API
+    # -----------------------------
+    @contextmanager
+    def ticket(self, device: str, lane: str) -> Iterator[None]:
+        """Count a request against its lane's bound for the block, or raise ``AdmissionRejected``."""
+        state = self._state(device)
+        bound = self.queue_limits[lane]
+        if bound and state.tickets[lane] >= bound:
+            state.rejected[lane] += 1
+            _REJECTED.inc(device=device, lane=lane)
+            raise AdmissionRejected(device, lane, self._retry_after(state, lane))
+        state.tickets[lane] += 1
+        try:
+            yield
+        finally:
+            state.tickets[lane] -= 1
+
+    @asynccontextmanager
+    async def slot(self, device: str, lane: str) -> AsyncIterator[None]:
+        """Hold one of ``device``'s execution slots for the block, waiting by lane priority."""
+        state = self._state(device)
+        start = time.perf_counter()
+        if self._may_start(state, lane):
+            state.active[lane] += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            state.waiters[lane].append(fut)
+            try:
+                await fut  # resolved by _wake with the slot already counted
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    self._release(state, lane)
+                elif fut in state.waiters[lane]:
+                    state.waiters[lane].remove(fut)
+                raise
+        acquired = time.perf_counter()
+        record_stage("admission_wait", acquired - start)
+        try:
+            yield
+        finally:
+            held = time.perf_counter() - acquired
+            prev = state.hold_seconds[lane]
+            state.hold_seconds[lane] = held if not prev else 0.8 * prev + 0.2 * held
+            self._release(state, lane)
+
+    async def run(self, device: str, lane: str, fn: Callable[..., Any], *args: Any) -> Any:
+        """``ticket`` + ``slot`` + ``asyncio.to_thread(fn, *args)``."""
+        with self.ticket(device, lane):
+            async with self.slot(device, lane):
+                return await asyncio.to_thread(fn, *args)
+
+    async def hold(self, device: str, lane: str) -> AsyncExitStack:
+        """``ticket`` + ``slot``, held until the returned stack is closed.
+
+        For work that outlives the handler, e.g. a response body produced while
+        it is streamed; closing the stack more than once is harmless.
+        """
+        stack = AsyncExitStack()
+        stack.enter_context(self.ticket(device, lane))
+        try:
+            await stack.enter_async_context(self.slot(device, lane))
+        except BaseException:
+            await stack.aclose()
+            raise
+        return stack
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interactive_burst": self.interactive_burst,
+            "queue_limits": dict(self.queue_limits),
+            "devices": {
+                name: {
+                    "limit": state.limit,
+                    "active": dict(state.active),
+                    "waiting": {lane: len(q) for lane, q in state.waiters.items()},
+                    "requests": dict(state.tickets),
+                    "rejected": dict(state.rejected),
+                    "avg_hold_ms": {lane: round(s * 1000.0, 1) for lane, s in state.hold_seconds.items()},
+                }
+                for name, state in self._devices.items()
+            },
+        }
+
+    # -----------------------------
+    # Internal
+    # -----------------------------
+    def _state(self, device: str) -> _DeviceState:
+        state = self._devices.get(device)
+        if state is None:
+            state = self._devices[device] = _DeviceState(self.limits.get(device, self.default_limit))
+        return state
+
+    def _capacity(self, state: _DeviceState, lane: str) -> int:
+        return state.limit + (self.interactive_burst if lane == INTERACTIVE else 0)
+
+    def _may_start(self, state: _DeviceState, lane: str) -> bool:
+        # Nobody of equal or higher priority may be overtaken
+        for other in LANES[:LANES.index(lane) + 1]:
+            if state.waiters[other]:
+                return False
+        return sum(state.active.values()) < self._capacity(state, lane)
+
+    def _release(self, state: _DeviceState, lane: str) -> None:
+        state.active[lane] -= 1
+        self._wake(state)
+
+    def _wake(self, state: _DeviceState) -> None:
+        for lane in LANES:
+            queue = state.waiters[lane]
+            while queue and sum(state.active.values()) < self._capacity(state, lane):
+                fut = queue.popleft()
+                if fut.done():
+                    continue  # cancelled while waiting
+                state.active[lane] += 1
+                fut.set_result(None)
+            if queue:
+                return  # strict priority: lower lanes wait until this one drains
+
+    def _retry_after(self, state: _DeviceState, lane: str) -> int:
+        hold = state.hold_seconds[lane] or 1.0
+        backlog = state.tickets[lane] / float(self._capacity(state, lane))
+        return max(1, int(math.ceil(hold * backlog)))
+
+    def _collect(self) -> None:
+        for name, state in self._devices.items():
+            for lane in LANES:
+                _WAITING.set(len(state.waiters[lane]), device=name, lane=lane)
+                _ACTIVE.set(state.active[lane], device=name, lane=lane)
+
+
+_admission_singleton: Optional[AdmissionController] = None
+
+def get_admission_controller() -> AdmissionController:
+    global _admission_singleton
+    if _admission_singleton is None:
+        _admission_singleton = AdmissionController(
+            limits=parse_limits(settings.DEVICE_CONCURRENCY),
+            queue_limits={
+                INTERACTIVE: settings.QUEUE_LIMIT_INTERACTIVE,
+                BATCH: settings.QUEUE_LIMIT_BATCH,
+                BACKGROUND: settings.QUEUE_LIMIT_BACKGROUND,
+            },
+            interactive_burst=settings.INTERACTIVE_BURST,
+        )
+    return _admission_singleton
@@ -4,14 +4,33 @@ SPDX-License-Identifier: Apache-2.0
 """
 
 import os
-import io
 import asyncio
-from typing import Optional, Dict, Any, List
+import logging
+from typing import Optional, Dict, Any, List, Tuple
 
+import numpy as np
 from PIL import Image
 
+from ..core.config import settings
+from ..core.metrics import stage
+from .admission import BATCH, AdmissionController, get_admission_controller
+from .batch_scheduler import BatchScheduler
 from .diffusion_processor import DiffusionProcessor, DiffusionConfig
 from .enhancement_service import EnhancementService
+from .image_io import codec_executor, encode_image, run_codec
+from .image_store import ImageSource, decode_source
+from .mask_crop import CropPlan, crop_for_inpaint, fit_mask, native_work_size, paste_inpainted, plan_mask_crop
+from .progress import ProgressReporter
+from .result_cache import ResultCache, output_encoding, result_key
+from .stub_models import StubDiffusionProcessor, stub_models_enabled
+from .tiling import TileLayout, blend_tile, check_tiling, plan_tiles
+
+logger = logging.getLogger(__name__)
+
+
+def _log_cache_write(future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Result cache write failed: %s", future.exception())
 
 
 class AIService:
@@ -21,18 +40,49 @@ class AIService:
     - Lazy loads diffusers pipelines (txt2img, img2img, inpaint).
     - Async-safe with an internal lock for first-load.
     - Device-aware (CUDA/MPS/CPU) via DiffusionProcessor.
+    - Micro-batches concurrent, compatible generation requests into a
+      single pipeline call (``BATCH_WINDOW_MS``, ``BATCH_MAX_SIZE``).
+    - Inpaints only the padded mask region (``INPAINT_CROP_TO_MASK``) and
+      blends it back, so cost follows mask area rather than document size.
+    - Runs large img2img inputs as overlapping, batched tiles (``IMG2IMG_TILE_SIZE``,
+      ``IMG2IMG_TILE_OVERLAP``, ``IMG2IMG_TILED_MIN_PX``).
+    - Caches results of seeded (deterministic) requests by content hash, in
+      memory and on the storage volume.
+    - Runs pipeline calls through the admission controller: bounded per lane
+      (``lane``: batch for API requests, background for queued jobs) and
+      limited per device, so concurrent requests queue instead of thrashing.
     - Provides orchestration and capabilities reporting.
     """
 
     def __init__(
         self,
         device_override: Optional[str] = None,
+        admission: Optional[AdmissionController] = None,
     ) -> None:
         self._device_override = device_override or os.getenv("AI_DEVICE")
+        self._admission = admission or get_admission_controller()
         self._diffusion: Optional[DiffusionProcessor] = None
         self._enhance: Optional[EnhancementService] = None
         self._lock = asyncio.Lock()
         self._loaded = False
+        self._batcher = BatchScheduler(
+            self._run_generation_batch,
+            window_ms=float(os.getenv("BATCH_WINDOW_MS", "25")),
+            max_batch=int(os.getenv("BATCH_MAX_SIZE", "4")),
+            executor=self._run_admitted,
+        )
+        self._inpaint_crop = os.getenv("INPAINT_CROP_TO_MASK", "true").lower() in ("1", "true", "yes")
+        self._inpaint_padding = int(os.getenv("INPAINT_CROP_PADDING", "32"))
+        self._inpaint_feather = int(os.getenv("INPAINT_FEATHER_PX", "8"))
+        self._native_resolution = int(os.getenv("SD_NATIVE_RESOLUTION", "512"))
+        self._tile_size = int(os.getenv("IMG2IMG_TILE_SIZE", "512"))
+        self._tile_overlap = int(os.getenv("IMG2IMG_TILE_OVERLAP", "64"))
+        self._tiled_min_px = int(os.getenv("IMG2IMG_TILED_MIN_PX", "1536"))  # 0 = only on request
+        self._results = ResultCache(
+            memory_bytes=settings.RESULT_CACHE_MB * 1024 * 1024,
+            disk_dir=os.path.join(settings.STORAGE_DIR, "result-cache"),
+            disk_bytes=settings.RESULT_CACHE_DISK_MB * 1024 * 1024,
+        )
 
     # -----------------------------
     # Public API
@@ -52,15 +102,33 @@ class AIService:
             "loaded": self._loaded,
             "device": self._diffusion.device if self._diffusion else "cpu",
             "capabilities": self.capabilities(),
+            "batching": self._batcher.stats(),
+            "memory": self._diffusion.memory_report() if self._diffusion else {},
+            "result_cache": self._results.stats(),
+            "prompt_cache": self._diffusion.prompt_cache_stats() if self._diffusion else {},
+            "latent_cache": self._diffusion.latent_cache_stats() if self._diffusion else {},
         }
 
+    def cache_stats(self) -> Dict[str, Any]:
+        return self._results.stats()
+
     async def warmup(self) -> None:
         """Ensure model is loaded (e.g., call at app startup or readiness probe)."""
         await self._ensure_loaded()
 
+    def preload(self, kind: str) -> None:
+        """Load the ``kind`` pipeline's weights (blocking; run in a thread after ``warmup``)."""
+        if self._diffusion is None:
+            raise RuntimeError("AIService.warmup() must complete before preloading pipelines")
+        self._diffusion.preload(kind)
+
+    def is_loaded(self, kind: str) -> bool:
+        """Whether every registry entry the ``kind`` pipeline needs is resident."""
+        return self._diffusion is not None and self._diffusion.is_loaded(kind)
+
     async def process_image(
         self,
-        image_bytes: Optional[bytes],
+        image_bytes: Optional[ImageSource],
         prompt: str,
         *,
         operation: str = "img2img",  # txt2img | img2img | inpaint
@@ -68,62 +136,197 @@ class AIService:
         guidance_scale: float = 7.5,
         num_inference_steps: int = 30,
         seed: Optional[int] = None,
-        mask_bytes: Optional[bytes] = None,
+        mask_bytes: Optional[ImageSource] = None,
         enhance_faces: bool = False,
         upscale: bool = False,
         upscale_scale: int = 2,
+        crop_to_mask: Optional[bool] = None,
+        mask_padding: Optional[int] = None,
+        feather: Optional[int] = None,
+        tiled: Optional[bool] = None,
+        tile_size: Optional[int] = None,
+        tile_overlap: Optional[int] = None,
+        progress: Optional[ProgressReporter] = None,
+        lane: str = BATCH,
+        output_format: str = "png",  # png | webp | jpeg
+        quality: int = 90,
+        compress_level: int = 6,
     ) -> Dict[str, Any]:
         """
         Run a Stable Diffusion operation. Optionally apply enhancement/upscaling.
-        Returns PNG bytes and metadata.
+        Returns encoded image bytes (``image_png`` is kept for PNG output) and metadata.
+        ``image_bytes``/``mask_bytes`` are uploads or images from the image store.
+
+        Seeded runs are deterministic, so their encoded results are cached per
+        output encoding: an identical request is answered with the stored bytes.
         """
         await self._ensure_loaded()
-        init_img: Optional[Image.Image] = None
-        mask_img: Optional[Image.Image] = None
-
-        if image_bytes is not None:
-            init_img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        if mask_bytes is not None:
-            mask_img = Image.open(io.BytesIO(mask_bytes)).convert("L")
-
-        # Run generation in worker thread
-        result_img = await asyncio.to_thread(
-            self._run_generation,
-            operation,
+        cache_key: Optional[str] = None
+        encoding = output_encoding(output_format, quality, compress_level)
+        if seed is not None:
+            with stage("cache_lookup"):
+                cache_key = await asyncio.to_thread(result_key, image_bytes, mask_bytes, prompt, self._cache_params(
+                    operation=operation, strength=strength, guidance_scale=guidance_scale,
+                    steps=num_inference_steps, seed=seed, enhance_faces=enhance_faces, upscale=upscale,
+                    upscale_scale=upscale_scale, crop_to_mask=crop_to_mask, mask_padding=mask_padding,
+                    feather=feather, tiled=tiled, tile_size=tile_size, tile_overlap=tile_overlap,
+                ))
+                hit = await run_codec(self._results.get, cache_key, encoding)  # disk tier may re-encode
+            if hit is not None:
+                return self._encoded(hit.data, hit.media_type, dict(hit.meta, cache=hit.tier))
+
+        result_img, meta = await self.generate(
+            image_bytes,
             prompt,
-            init_img,
-            mask_img,
-            strength,
-            guidance_scale,
-            num_inference_steps,
-            seed,
+            operation=operation,
+            strength=strength,
+            guidance_scale=guidance_scale,
+            num_inference_steps=num_inference_steps,
+            seed=seed,
+            mask_bytes=mask_bytes,
+            enhance_faces=enhance_faces,
+            upscale=upscale,
+            upscale_scale=upscale_scale,
+            crop_to_mask=crop_to_mask,
+            mask_padding=mask_padding,
+            feather=feather,
+            tiled=tiled,
+            tile_size=tile_size,
+            tile_overlap=tile_overlap,
+            progress=progress,
+            lane=lane,
         )
-
-        # Optional enhancement
-        if enhance_faces or upscale:
-            result_img = await asyncio.to_thread(
-                self._enhance_image,
-                result_img,
-                enhance_faces,
-                upscale,
-                upscale_scale,
+        with stage("encode"):
+            data, media_type = await run_codec(
+                encode_image, result_img, output_format, quality, compress_level,
+            )
+        if cache_key is not None:
+            # The disk write (and PNG encode for other formats) happens off the response path
+            future = codec_executor().submit(
+                self._results.put, cache_key, encoding, data, media_type, dict(meta), result_img,
             )
+            future.add_done_callback(_log_cache_write)
+            meta["cache"] = "miss"
+        return self._encoded(data, media_type, meta)
 
-        # Encode PNG
-        out_buf = io.BytesIO()
-        result_img.save(out_buf, format="PNG")
-        out_buf.seek(0)
+    @staticmethod
+    def _encoded(data: bytes, media_type: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+        result = {"image_bytes": data, "media_type": media_type, "meta": meta}
+        if media_type == "image/png":
+            result["image_png"] = data
+        return result
 
-        return {
-            "image_png": out_buf.getvalue(),
-            "meta": {
-                "operation": operation,
-                "strength": strength,
-                "guidance_scale": guidance_scale,
-                "steps": num_inference_steps,
-                "seed": seed,
-            },
-        }
+    async def generate(
+        self,
+        image_bytes: Optional[ImageSource],
+        prompt: str,
+        *,
+        operation: str = "img2img",
+        strength: float = 0.7,
+        guidance_scale: float = 7.5,
+        num_inference_steps: int = 30,
+        seed: Optional[int] = None,
+        mask_bytes: Optional[ImageSource] = None,
+        enhance_faces: bool = False,
+        upscale: bool = False,
+        upscale_scale: int = 2,
+        crop_to_mask: Optional[bool] = None,
+        mask_padding: Optional[int] = None,
+        feather: Optional[int] = None,
+        tiled: Optional[bool] = None,
+        tile_size: Optional[int] = None,
+        tile_overlap: Optional[int] = None,
+        progress: Optional[ProgressReporter] = None,
+        lane: str = BATCH,
+    ) -> Tuple[Image.Image, Dict[str, Any]]:
+        """
+        Like ``process_image`` but returns the PIL result unencoded (for streaming
+        encoders). Results are not cached here: the cache holds encoded bytes.
+
+        Inpainting runs crop-to-mask by default: only the padded mask region is
+        diffused, at native resolution, and feathered back into the original.
+        Full-frame inpainting also diffuses at native resolution (long side
+        ``SD_NATIVE_RESOLUTION``) and is scaled back to the document size.
+        Large img2img inputs run tiled (see ``_tiled_img2img``).
+        """
+        await self._ensure_loaded()
+        # Only requests that need the device count against the lane bound (not cache hits)
+        with self._admission.ticket(self._device(), lane):
+            init_img: Optional[Image.Image] = None
+            mask_img: Optional[Image.Image] = None
+
+            with stage("decode"):
+                if image_bytes is not None:
+                    init_img = (await run_codec(decode_source, image_bytes, "RGB")).image
+                if mask_bytes is not None:
+                    mask_img = (await run_codec(decode_source, mask_bytes, "L")).image
+
+            self._validate_inputs(operation, init_img, mask_img)
+            if operation == "inpaint" and mask_img.size != init_img.size:
+                mask_img = await asyncio.to_thread(fit_mask, mask_img, init_img.size)
+            meta: Dict[str, Any] = {}
+            plan: Optional[CropPlan] = None
+            cropped = self._inpaint_crop if crop_to_mask is None else bool(crop_to_mask)
+            if operation == "inpaint" and cropped:
+                feather = self._inpaint_feather if feather is None else max(0, int(feather))
+                padding = self._inpaint_padding if mask_padding is None else max(0, int(mask_padding))
+                # Pad by at least the feather width so the blended seam stays inside the crop
+                plan = plan_mask_crop(mask_img, max(padding, 2 * feather), self._native_resolution)
+                meta["crop_box"] = list(plan.box) if plan else None
+
+            if operation == "inpaint" and cropped and plan is None:
+                result_img = init_img  # empty mask: nothing to repaint
+            elif plan is not None:
+                meta["work_size"] = list(plan.work_size)
+                with stage("mask_crop"):
+                    crop_img, crop_mask = await asyncio.to_thread(crop_for_inpaint, init_img, mask_img, plan)
+                key = self._batch_key(operation, crop_img, strength, guidance_scale, num_inference_steps, lane)
+                with stage("diffusion"):
+                    generated, timings = await self._batcher.submit(key, (prompt, crop_img, crop_mask, seed, progress))
+                meta.update(timings)
+                with stage("blend"):
+                    result_img = await asyncio.to_thread(paste_inpainted, init_img, mask_img, generated, plan, feather)
+            elif operation not in ("txt2img", "inpaint") and self._use_tiles(init_img, tiled):
+                tile, overlap = self.tiling(tile_size, tile_overlap)
+                with stage("diffusion"):
+                    result_img, layout = await self._tiled_img2img(
+                        prompt, init_img, strength, guidance_scale, num_inference_steps, seed, tile, overlap, progress, lane,
+                    )
+                meta["tiles"] = len(layout)
+                meta["tile_size"] = list(layout.tile_size)
+            elif operation == "inpaint":
+                # Full-frame inpaint: diffuse the whole document at native resolution
+                # (not document resolution) and scale the result back
+                whole = CropPlan(box=(0, 0) + init_img.size, work_size=native_work_size(init_img.size, self._native_resolution))
+                meta["work_size"] = list(whole.work_size)
+                with stage("resize"):
+                    work_img, work_mask = await asyncio.to_thread(crop_for_inpaint, init_img, mask_img, whole)
+                key = self._batch_key(operation, work_img, strength, guidance_scale, num_inference_steps, lane)
+                with stage("diffusion"):
+                    generated, timings = await self._batcher.submit(key, (prompt, work_img, work_mask, seed, progress))
+                meta.update(timings)
+                with stage("resize"):
+                    result_img = await asyncio.to_thread(generated.resize, init_img.size, Image.Resampling.LANCZOS)
+            else:
+                # Run generation in worker thread, batched with compatible concurrent requests
+                key = self._batch_key(operation, init_img, strength, guidance_scale, num_inference_steps, lane)
+                with stage("diffusion"):
+                    result_img, timings = await self._batcher.submit(key, (prompt, init_img, mask_img, seed, progress))
+                meta.update(timings)
+
+            # Optional enhancement
+            if enhance_faces or upscale:
+                with stage("enhance"):
+                    result_img = await asyncio.to_thread(
+                        self._enhance_image,
+                        result_img,
+                        enhance_faces,
+                        upscale,
+                        upscale_scale,
+                    )
+
+        meta = self._meta(operation, strength, guidance_scale, num_inference_steps, seed, **meta)
+        return result_img, meta
 
     # -----------------------------
     # Internal
@@ -143,32 +346,183 @@ class AIService:
             img2img_model=os.getenv("SD_IMG2IMG_MODEL", "runwayml/stable-diffusion-v1-5"),
             inpaint_model=os.getenv("SD_INPAINT_MODEL", "runwayml/stable-diffusion-inpainting"),
             device_override=self._device_override,
+            share_inpaint_components=os.getenv("SD_SHARE_INPAINT_COMPONENTS", "true").lower() in ("1", "true", "yes"),
+            use_safetensors={"true": True, "false": False}.get(settings.SD_USE_SAFETENSORS.lower()),
         )
-        self._diffusion = DiffusionProcessor(cfg)
+        # AI_STUB_MODELS=1 swaps in colour-wash pipelines for offline benchmarks/load tests
+        processor_cls = StubDiffusionProcessor if stub_models_enabled() else DiffusionProcessor
+        self._diffusion = processor_cls(cfg)
         self._enhance = EnhancementService()
 
-    def _run_generation(
+    def _cache_params(self, **params: Any) -> Dict[str, Any]:
+        """Request parameters plus the model IDs and service defaults that also shape the output."""
+        cfg = getattr(self._diffusion, "cfg", None)
+        return dict(
+            params,
+            models=[cfg.base_model, cfg.img2img_model, cfg.inpaint_model] if cfg else None,
+            defaults=[
+                self._inpaint_crop, self._inpaint_padding, self._inpaint_feather, self._native_resolution,
+                self._tile_size, self._tile_overlap, self._tiled_min_px,
+            ],
+        )
+
+    @staticmethod
+    def _meta(operation: str, strength: float, guidance_scale: float, steps: int, seed: Optional[int], **extra: Any) -> Dict[str, Any]:
+        return {
+            "operation": operation,
+            "strength": strength,
+            "guidance_scale": guidance_scale,
+            "steps": steps,
+            "seed": seed,
+            **extra,
+        }
+
+    def _validate_inputs(
         self,
         operation: str,
-        prompt: str,
         init_img: Optional[Image.Image],
         mask_img: Optional[Image.Image],
-        strength: float,
-        guidance_scale: float,
-        steps: int,
-        seed: Optional[int],
-    ) -> Image.Image:
-        assert self._diffusion is not None
+    ) -> None:
         if operation == "txt2img":
-            return self._diffusion.generate_txt2img(prompt, guidance_scale, steps, seed)
+            return
         if operation == "inpaint":
             if init_img is None or mask_img is None:
                 raise ValueError("inpaint requires init image and mask")
-            return self._diffusion.inpaint(prompt, init_img, mask_img, guidance_scale, steps, seed)
-        # default img2img
+            return
         if init_img is None:
             raise ValueError("img2img requires init image")
-        return self._diffusion.img2img(prompt, init_img, strength, guidance_scale, steps, seed)
+
+    def _batch_key(
+        self,
+        operation: str,
+        init_img: Optional[Image.Image],
+        strength: float,
+        guidance_scale: float,
+        steps: int,
+        lane: str = BATCH,
+    ) -> Tuple[Any, ...]:
+        """
+        Requests can share a pipeline call only if every per-call argument
+        matches. The admission lane is part of the key, so queued jobs never
+        ride along in (or delay) an interactive batch.
+        """
+        if operation not in ("txt2img", "inpaint"):
+            operation = "img2img"
+        size = init_img.size if init_img is not None else None
+        # strength only affects img2img; diffusers takes it (and guidance) as a per-call scalar
+        strength_key = float(strength) if operation == "img2img" else None
+        return (operation, size, int(steps), float(guidance_scale), strength_key, lane)
+
+    def tiling(self, tile_size: Optional[int] = None, tile_overlap: Optional[int] = None) -> Tuple[int, int]:
+        """Requested (or default) tile size and overlap; ValueError if out of range."""
+        tile = self._tile_size if tile_size is None else int(tile_size)
+        overlap = self._tile_overlap if tile_overlap is None else int(tile_overlap)
+        check_tiling(tile, overlap, self._native_resolution // 2, 4 * self._native_resolution)
+        return tile, overlap
+
+    def _use_tiles(self, init_img: Optional[Image.Image], tiled: Optional[bool]) -> bool:
+        if init_img is None:
+            return False
+        if tiled is not None:
+            return bool(tiled)
+        return bool(self._tiled_min_px) and max(init_img.size) > self._tiled_min_px
+
+    async def _tiled_img2img(
+        self,
+        prompt: str,
+        init_img: Image.Image,
+        strength: float,
+        guidance_scale: float,
+        steps: int,
+        seed: Optional[int],
+        tile: int,
+        overlap: int,
+        progress: Optional[ProgressReporter] = None,
+        lane: str = BATCH,
+    ) -> Tuple[Image.Image, TileLayout]:
+        """
+        img2img over overlapping fixed-size tiles, ``max_batch`` tiles per
+        pipeline call, blended into the output as each group finishes. Model
+        memory is bounded by the tile size; runtime grows with the tile count.
+        Progress is reported per finished tile group rather than per step.
+        """
+        layout = plan_tiles(init_img.size, tile, overlap)
+        tw, th = layout.tile_size
+        canvas = np.zeros((init_img.height, init_img.width, 3), dtype=np.uint8)
+        key = self._batch_key("img2img", Image.new("RGB", (tw, th)), strength, guidance_scale, steps, lane)
+        tiles = list(layout.tiles())
+        step = self._batcher.max_batch
+        for start in range(0, len(tiles), step):
+            group = tiles[start:start + step]
+            outputs = await asyncio.gather(*(
+                self._batcher.submit(key, (
+                    prompt,
+                    init_img.crop(box),
+                    None,
+                    None if seed is None else int(seed) + start + i,
+                    None,
+                ))
+                for i, (_, _, box) in enumerate(group)
+            ))
+            await asyncio.to_thread(self._blend_tiles, canvas, layout, group, outputs)
+            if progress is not None:
+                progress.emit("tiles", {"done": start + len(group), "total": len(tiles)})
+        return Image.fromarray(canvas), layout
+
+    @staticmethod
+    def _blend_tiles(canvas: np.ndarray, layout: TileLayout, group, outputs: List[Image.Image]) -> None:
+        for (col, row, _box), (out, _timings) in zip(group, outputs):
+            out = out.convert("RGB")
+            if out.size != layout.tile_size:
+                out = out.resize(layout.tile_size, Image.Resampling.LANCZOS)
+            blend_tile(canvas, np.asarray(out), layout, col, row)
+
+    def _device(self) -> str:
+        return getattr(self._diffusion, "device", None) or "cpu"
+
+    async def _run_admitted(self, runner, key: Tuple[Any, ...], items: List[Any]) -> Any:
+        """BatchScheduler executor: one device slot per pipeline call, in the batch's lane."""
+        async with self._admission.slot(self._device(), key[-1]):
+            return await asyncio.to_thread(runner, key, items)
+
+    def _run_generation_batch(
+        self,
+        key: Tuple[Any, ...],
+        items: List[Tuple[str, Optional[Image.Image], Optional[Image.Image], Optional[int], Optional[ProgressReporter]]],
+    ) -> List[Tuple[Image.Image, Dict[str, float]]]:
+        """Returns one ``(image, timings)`` pair per item."""
+        assert self._diffusion is not None
+        operation, _size, steps, guidance_scale, strength, _lane = key
+        prompts = [item[0] for item in items]
+        seeds = [item[3] for item in items]
+        timings: List[Dict[str, float]] = []
+        extra = dict(self._progress_kwargs([item[4] for item in items]), timings=timings)
+        if operation == "txt2img":
+            images = self._diffusion.generate_txt2img_batch(prompts, guidance_scale, steps, seeds, **extra)
+        elif operation == "inpaint":
+            init_imgs = [item[1] for item in items]
+            masks = [item[2] for item in items]
+            images = self._diffusion.inpaint_batch(prompts, init_imgs, masks, guidance_scale, steps, seeds, **extra)
+        else:
+            # default img2img
+            init_imgs = [item[1] for item in items]
+            images = self._diffusion.img2img_batch(prompts, init_imgs, strength, guidance_scale, steps, seeds, **extra)
+        if len(timings) != len(images):
+            timings = [{} for _ in images]
+        return list(zip(images, timings))
+
+    @staticmethod
+    def _progress_kwargs(reporters: List[Optional[ProgressReporter]]) -> Dict[str, Any]:
+        """Fan one pipeline step callback out to each batched request's reporter."""
+        if not any(reporters):
+            return {}
+
+        def on_step(step: int, total: Optional[int], latents: Any) -> None:
+            for i, reporter in enumerate(reporters):
+                if reporter is not None:
+                    reporter.step(step, total, latents[i:i + 1] if latents is not None else None)
+
+        return {"callback": on_step}
 
     def _enhance_image(
         self,
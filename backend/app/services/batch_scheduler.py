@@ -0,0 +1,122 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+"""
+
+import time
+import asyncio
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from ..core.metrics import detach_request, metrics, record_stage
+
+BATCH_QUEUED = metrics.gauge("retouch_batch_queued_items", "Requests waiting for their micro-batch to start.")
+BATCH_RUNNING = metrics.gauge("retouch_batch_running_items", "Requests in micro-batches currently executing.")
+BATCH_SIZE = metrics.histogram(
+    "retouch_batch_size", "Requests per executed micro-batch.", buckets=(1, 2, 3, 4, 6, 8, 12, 16),
+)
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching in front of a blocking batch runner.
+
+    - Requests with the same compatibility key that arrive within
+      ``window_ms`` of the first one are run as a single batch.
+    - A batch is flushed early once it reaches ``max_batch`` items.
+    - ``runner(key, items)`` runs in a worker thread and must return one
+      result per item, in order; its exceptions are raised to every caller.
+    - Queue depth, batch sizes and per-item wait (``batch_wait`` stage) are
+      exported as metrics.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[Hashable, List[Any]], List[Any]],
+        window_ms: float = 25.0,
+        max_batch: int = 4,
+        executor: Optional[Callable[..., Any]] = None,
+    ) -> None:
+        self._runner = runner
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self._executor = executor or asyncio.to_thread
+        self._pending: Dict[Hashable, List[Tuple[Any, asyncio.Future, float]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()  # the loop only holds weak references to tasks
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future = loop.create_future()
+        group = self._pending.setdefault(key, [])
+        group.append((item, fut, time.perf_counter()))
+        BATCH_QUEUED.inc()
+        if len(group) >= self.max_batch or self.window == 0.0:
+            self._flush(key)
+        elif len(group) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        return await fut
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": (self.items / self.batches) if self.batches else 0.0,
+        }
+
+    # -----------------------------
+    # Internal
+    # -----------------------------
+    def _flush(self, key: Hashable) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        group = self._pending.pop(key, [])
+        if group:
+            task = asyncio.ensure_future(self._run(key, group))
+            self._tasks.add(task)
+            task.add_done_callback(lambda t: self._finished(t, group))
+
+    def _finished(self, task: asyncio.Task, group: List[Tuple[Any, asyncio.Future, float]]) -> None:
+        # A batch cancelled (e.g. at shutdown) or killed by a non-Exception error
+        # must not leave its callers waiting forever
+        self._tasks.discard(task)
+        error = None
+        if task.cancelled():
+            error = RuntimeError("Batch was cancelled before it finished")
+        elif task.exception() is not None:
+            error = task.exception()
+        if error is not None:
+            for _, fut, _ in group:
+                if not fut.done():
+                    fut.set_exception(error)
+
+    async def _run(self, key: Hashable, group: List[Tuple[Any, asyncio.Future, float]]) -> None:
+        # The task inherited the flushing request's context; the batch serves all of them
+        detach_request()
+        self.batches += 1
+        self.items += len(group)
+        items = [item for item, _, _ in group]
+        started = time.perf_counter()
+        for _, _, enqueued in group:
+            record_stage("batch_wait", started - enqueued)
+        BATCH_QUEUED.dec(len(group))
+        BATCH_RUNNING.inc(len(group))
+        BATCH_SIZE.observe(len(group))
+        try:
+            results = await self._executor(self._runner, key, items)
+            if len(results) != len(group):
+                raise RuntimeError(f"batch runner returned {len(results)} results for {len(group)} items")
+        except Exception as e:
+            for _, fut, _ in group:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        finally:
+            BATCH_RUNNING.dec(len(group))
+        for (_, fut, _), result in zip(group, results):
+            if not fut.done():
+                fut.set_result(result)
@@ -0,0 +1,276 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+class LRUCache:
+    """
+    Thread-safe LRU mapping bounded by total size in bytes and/or entry count.
+
+    - Entries carry an explicit size (or one computed by ``sizeof``).
+    - Least-recently-used entries are evicted until both bounds hold.
+    - Values larger than the whole byte budget are never stored.
+    - Keeps hit/miss/eviction counters for reporting.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._sizeof = sizeof or (lambda _value: 0)
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Return a value without touching recency or counters."""
+        with self._lock:
+            return self._data.get(key, default)
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None) -> bool:
+        """Store ``value``; returns False if it cannot fit in the budget at all."""
+        nbytes = int(size if size is not None else self._sizeof(value))
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = value
+            self._sizes[key] = nbytes
+            self._bytes += nbytes
+            self._evict()
+        return True
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def keys(self) -> List[Hashable]:
+        """Snapshot of the keys, least recently used first."""
+        with self._lock:
+            return list(self._data)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+    # -----------------------------
+    # Internal (caller holds lock)
+    # -----------------------------
+    def _remove(self, key: Hashable) -> Any:
+        value = self._data.pop(key)
+        self._bytes -= self._sizes.pop(key, 0)
+        return value
+
+    def _evict(self) -> None:
+        while self._data and (
+            (self.max_bytes is not None and self._bytes > self.max_bytes)
+            or (self.max_entries is not None and len(self._data) > self.max_entries)
+        ):
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+
+class DiskCache:
+    """
+    Byte blobs under ``root/<k[:2]>/<k>`` bounded by total size on disk.
+
+    - Writes are atomic (temp file + rename), so readers never see partial blobs.
+    - A hit refreshes the file's mtime; eviction removes the oldest mtimes
+      first, i.e. least recently used.
+    - The size index is built lazily from the directory on first use, so
+      entries survive restarts.
+    - With ``ttl_seconds``, entries not read or written for that long are
+      misses and are deleted (on access, or by ``sweep_expired``).
+    """
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None, ttl_seconds: Optional[float] = None) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes or None
+        self.ttl_seconds = ttl_seconds or None
+        self._lock = threading.Lock()
+        self._sizes: Optional[Dict[str, int]] = None
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            if self.ttl_seconds is not None and time.time() - path.stat().st_mtime > self.ttl_seconds:
+                self.delete(key)
+                raise FileNotFoundError(key)
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> bool:
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            return False
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            sizes = self._index()
+            self._bytes += len(data) - sizes.get(key, 0)
+            sizes[key] = len(data)
+            self._evict()
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def touch(self, key: str) -> None:
+        """Mark an entry as used without reading it."""
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def delete(self, key: str) -> bool:
+        try:
+            self._path(key).unlink()
+            removed = True
+        except OSError:
+            removed = False
+        with self._lock:
+            self._bytes -= self._index().pop(key, 0)
+        return removed
+
+    def sweep_expired(self) -> int:
+        """Delete entries past ``ttl_seconds``; returns how many were removed."""
+        if self.ttl_seconds is None:
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            keys = list(self._index())
+        removed = 0
+        for key in keys:
+            try:
+                expired = self._path(key).stat().st_mtime < cutoff
+            except OSError:
+                expired = True
+            if expired:
+                self.delete(key)
+                removed += 1
+        return removed
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            self._index()
+            return self._bytes
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = len(self._index())
+        return {
+            "entries": entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+    # -----------------------------
+    # Internal (caller holds lock)
+    # -----------------------------
+    def _path(self, key: str) -> Path:
+        if not key.isalnum():
+            raise ValueError(f"Invalid cache key: {key!r}")
+        return self.root / key[:2] / key
+
+    def _index(self) -> Dict[str, int]:
+        if self._sizes is None:
+            self._sizes = {}
+            if self.root.is_dir():
+                for path in self.root.glob("*/*"):
+                    if not path.name.startswith("."):
+                        self._sizes[path.name] = path.stat().st_size
+            self._bytes = sum(self._sizes.values())
+        return self._sizes
+
+    def _evict(self) -> None:
+        if self.max_bytes is None or self._bytes <= self.max_bytes:
+            return
+        by_age = []
+        for key in self._sizes:
+            try:
+                by_age.append((self._path(key).stat().st_mtime, key))
+            except OSError:
+                by_age.append((0.0, key))
+        for _mtime, key in sorted(by_age):
+            if self._bytes <= self.max_bytes:
+                break
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+            self._bytes -= self._sizes.pop(key)
+            self.evictions += 1
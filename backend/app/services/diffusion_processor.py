@@ -4,11 +4,20 @@ SPDX-License-Identifier: Apache-2.0
 """
 
 import os
+import time
+import hashlib
+import functools
+import threading
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 from PIL import Image
 
+from ..core.metrics import record_stage, stage
+from .cache import LRUCache
+from .model_registry import ModelRegistry, get_model_registry, module_bytes
+
 
 @dataclass
 class DiffusionConfig:
@@ -16,57 +25,246 @@ class DiffusionConfig:
     img2img_model: str
     inpaint_model: str
     device_override: Optional[str] = None
+    # Reuse the base model's VAE/text encoder for a separate inpaint checkpoint,
+    # loading only its UNet (valid for SD 1.x inpainting fine-tunes). The base
+    # UNet is then a registry entry of its own, loaded only for txt2img/img2img.
+    share_inpaint_components: bool = True
+    # True: require .safetensors weights (memory-mapped, no pickle); None: prefer them when present
+    use_safetensors: Optional[bool] = None
+
+
+# Rough fp32 footprints for SD 1.x, used until a model is loaded and measured
+_SD_ESTIMATE_MB = 4300
+_SD_UNET_ESTIMATE_MB = 3450
+_PIPELINE_KINDS = ("txt2img", "img2img", "inpaint")
+
+# (step, total_steps, latents) -> None; latents is the (batch, 4, h, w) tensor
+StepCallback = Callable[[int, Optional[int], Any], None]
+
+
+@dataclass
+class PromptEmbedding:
+    """Text-encoder output for one prompt (shape (1, 77, hidden))."""
+
+    embeds: Any  # torch.Tensor, kept on the CPU (outside the device's model budget)
+    encode_seconds: float = 0.0
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.embeds.element_size() * self.embeds.nelement())
+
+
+@dataclass
+class VAELatent:
+    """Scaled VAE latent of an init (or masked) image, shape (1, 4, h/8, w/8)."""
+
+    latent: Any  # torch.Tensor, kept on the CPU and moved to the VAE device on use
+    encode_seconds: float = 0.0
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.latent.element_size() * self.latent.nelement())
+
+
+def image_digest(img: Optional[Image.Image]) -> Optional[str]:
+    """Content hash of decoded pixels (independent of how the upload was encoded)."""
+    if img is None:
+        return None
+    h = hashlib.sha256(f"{img.mode}:{img.size}".encode("ascii"))
+    h.update(img.tobytes())
+    return h.hexdigest()
 
 
 class DiffusionProcessor:
-    def __init__(self, cfg: DiffusionConfig) -> None:
+    def __init__(self, cfg: DiffusionConfig, registry: Optional[ModelRegistry] = None) -> None:
         self.cfg = cfg
         self.device = self._get_device()
         self._txt2img = None
         self._img2img = None
         self._inpaint = None
+        self._load_lock = threading.RLock()
+        # Component sets (per model id) live in the model registry, which may
+        # evict them under memory pressure; pipelines are thin views rebuilt on demand.
+        self._registry = registry or get_model_registry()
+        self._register_models()
+        # CLIP embeddings per (text-encoder entry, prompt); reused across pipelines and requests.
+        # Both caches hold CPU copies: device memory stays with the registry-budgeted weights,
+        # and entries stay valid when an evicted component is reloaded (same weights).
+        self._prompt_embeds = LRUCache(
+            max_bytes=int(os.getenv("PROMPT_CACHE_MB", "64")) * 1024 * 1024,
+            max_entries=int(os.getenv("PROMPT_CACHE_ENTRIES", "256")),
+            sizeof=lambda e: e.nbytes,
+        )
+        self._text_encode_seconds_saved = 0.0
+        # VAE latents per (vae entry, image content, resolution) for repeated runs on one document
+        self._latents = LRUCache(
+            max_bytes=int(os.getenv("LATENT_CACHE_MB", "128")) * 1024 * 1024,
+            sizeof=lambda e: e.nbytes,
+        )
+        self._vae_encode_seconds_saved = 0.0
 
     # -----------------------------
     # Pipelines
     # -----------------------------
-    def _ensure_txt2img(self):
-        if self._txt2img is not None:
-            return
-        from diffusers import StableDiffusionPipeline
+    def _dtype(self):
         import torch
-        dtype = torch.float16 if self.device == "cuda" else torch.float32
-        self._txt2img = StableDiffusionPipeline.from_pretrained(
-            self.cfg.base_model,
-            torch_dtype=dtype,
-            safety_checker=None,
+        return torch.float16 if self.device == "cuda" else torch.float32
+
+    def _shares_inpaint_unet(self) -> bool:
+        return self.cfg.share_inpaint_components and self.cfg.inpaint_model not in (
+            self.cfg.base_model, self.cfg.img2img_model,
         )
-        self._move(self._txt2img)
 
-    def _ensure_img2img(self):
-        if self._img2img is not None:
-            return
-        from diffusers import StableDiffusionImg2ImgPipeline
-        import torch
-        dtype = torch.float16 if self.device == "cuda" else torch.float32
-        self._img2img = StableDiffusionImg2ImgPipeline.from_pretrained(
-            self.cfg.img2img_model,
-            torch_dtype=dtype,
-            safety_checker=None,
+    def _model_deps(self, model_id: str) -> List[str]:
+        if self._shares_inpaint_unet() and model_id == self.cfg.base_model:
+            # Base components and base UNet are separate entries, so inpaint
+            # can borrow the former without loading the latter
+            return [f"sd-shared:{model_id}", f"sd-unet:{model_id}"]
+        return [f"sd:{model_id}"]
+
+    def _deps(self, kind: str) -> List[str]:
+        """Registry entries a pipeline is built from: a component set, optionally plus a UNet."""
+        if kind == "txt2img":
+            return self._model_deps(self.cfg.base_model)
+        if kind == "img2img":
+            return self._model_deps(self.cfg.img2img_model)
+        if self._shares_inpaint_unet():
+            return [f"sd-shared:{self.cfg.base_model}", f"sd-unet:{self.cfg.inpaint_model}"]
+        return [f"sd:{self.cfg.inpaint_model}"]
+
+    def _register_models(self) -> None:
+        scale = 0.5 if self.device == "cuda" else 1.0  # fp16 on CUDA
+        estimate = int(os.getenv("SD_MODEL_ESTIMATE_MB", str(int(_SD_ESTIMATE_MB * scale)))) * 1024 * 1024
+        unet_estimate = int(_SD_UNET_ESTIMATE_MB * scale) * 1024 * 1024
+        shared = self._shares_inpaint_unet()
+        model_ids = {self.cfg.base_model, self.cfg.img2img_model}
+        if shared:
+            model_ids.discard(self.cfg.base_model)
+        else:
+            model_ids.add(self.cfg.inpaint_model)
+        for model_id in model_ids:
+            self._register(
+                f"sd:{model_id}", functools.partial(self._load_components, model_id), estimate,
+                lambda comps: sum(module_bytes(m) for m in comps.values()),
+            )
+        if shared:
+            self._register(
+                f"sd-shared:{self.cfg.base_model}",
+                functools.partial(self._load_components, self.cfg.base_model, with_unet=False),
+                estimate - unet_estimate,
+                lambda comps: sum(module_bytes(m) for m in comps.values()),
+            )
+            for model_id in (self.cfg.base_model, self.cfg.inpaint_model):
+                self._register(f"sd-unet:{model_id}", functools.partial(self._load_unet, model_id), unet_estimate, module_bytes)
+
+    def _register(self, key: str, loader: Callable[[], Any], estimate_bytes: int, sizeof: Callable[[Any], int]) -> None:
+        self._registry.register(
+            key,
+            loader=loader,
+            unloader=functools.partial(self._drop_pipelines, key),
+            estimate_bytes=estimate_bytes,
+            sizeof=sizeof,
         )
-        self._move(self._img2img)
 
-    def _ensure_inpaint(self):
-        if self._inpaint is not None:
-            return
-        from diffusers import StableDiffusionInpaintPipeline
-        import torch
-        dtype = torch.float16 if self.device == "cuda" else torch.float32
-        self._inpaint = StableDiffusionInpaintPipeline.from_pretrained(
-            self.cfg.inpaint_model,
-            torch_dtype=dtype,
+    def _load_components(self, model_id: str, with_unet: bool = True) -> Dict[str, Any]:
+        from diffusers import DiffusionPipeline
+        pipe = DiffusionPipeline.from_pretrained(
+            model_id,
+            torch_dtype=self._dtype(),
             safety_checker=None,
+            **({} if with_unet else {"unet": None}),
+            **self._weights_kwargs(),
+        )
+        self._move(pipe)
+        return {name: module for name, module in pipe.components.items() if module is not None}
+
+    def _load_unet(self, model_id: str):
+        # Base and inpainting fine-tunes differ only in their UNet (4 vs 9 input channels)
+        from diffusers import UNet2DConditionModel
+        unet = UNet2DConditionModel.from_pretrained(
+            model_id, subfolder="unet", torch_dtype=self._dtype(), **self._weights_kwargs(),
+        )
+        return unet.to(self.device)
+
+    def _weights_kwargs(self) -> Dict[str, Any]:
+        # safetensors files are memory-mapped and materialised straight into the
+        # (meta-initialised) modules, skipping the pickle copy of every tensor
+        return {"use_safetensors": self.cfg.use_safetensors, "low_cpu_mem_usage": True}
+
+    def _drop_pipelines(self, key: str, _value: Any = None) -> None:
+        """Registry unloader: forget every pipeline built on the evicted entry."""
+        with self._load_lock:
+            for kind in _PIPELINE_KINDS:
+                if key in self._deps(kind):
+                    setattr(self, f"_{kind}", None)
+
+    def _build(self, pipeline_cls, components: Dict[str, Any]):
+        comps = dict(components)
+        # Schedulers carry per-call state (timesteps), so never share the instance
+        comps["scheduler"] = comps["scheduler"].__class__.from_config(comps["scheduler"].config)
+        comps["safety_checker"] = None
+        pipe = pipeline_cls(**comps, requires_safety_checker=False)
+        self._move(pipe)
+        return pipe
+
+    @contextmanager
+    def _pipeline(self, kind: str) -> Iterator[Any]:
+        """Yield the ``kind`` pipeline with its components loaded and pinned against eviction."""
+        from diffusers import (
+            StableDiffusionPipeline,
+            StableDiffusionImg2ImgPipeline,
+            StableDiffusionInpaintPipeline,
         )
-        self._move(self._inpaint)
+        classes = {
+            "txt2img": StableDiffusionPipeline,
+            "img2img": StableDiffusionImg2ImgPipeline,
+            "inpaint": StableDiffusionInpaintPipeline,
+        }
+        with self._registry.use(*self._deps(kind)) as values:
+            with self._load_lock:
+                pipe = getattr(self, f"_{kind}")
+                if pipe is None:
+                    comps = dict(values[0])
+                    if len(values) > 1:
+                        comps["unet"] = values[1]
+                    with stage("pipeline_build"):
+                        pipe = self._build(classes[kind], comps)
+                    setattr(self, f"_{kind}", pipe)
+            yield pipe
+
+    def preload(self, kind: str) -> None:
+        with self._pipeline(kind):
+            pass
+
+    def is_loaded(self, kind: str) -> bool:
+        return all(self._registry.is_resident(key) for key in self._deps(kind))
+
+    def memory_report(self) -> Dict[str, Any]:
+        """Resident parameter memory per pipeline, counting shared modules once overall."""
+        pipelines = {
+            name: pipe
+            for name, pipe in (("txt2img", self._txt2img), ("img2img", self._img2img), ("inpaint", self._inpaint))
+            if pipe is not None
+        }
+        owners: Dict[int, List[str]] = {}
+        sizes: Dict[int, int] = {}
+        for name, pipe in pipelines.items():
+            for module in pipe.components.values():
+                if module_bytes(module):
+                    owners.setdefault(id(module), []).append(name)
+                    sizes[id(module)] = module_bytes(module)
+        report: Dict[str, Any] = {}
+        for name, pipe in pipelines.items():
+            comps = {k: module_bytes(m) for k, m in pipe.components.items() if module_bytes(m)}
+            report[name] = {
+                "resident_bytes": sum(comps.values()),
+                "unique_bytes": sum(
+                    module_bytes(m) for m in pipe.components.values()
+                    if module_bytes(m) and owners[id(m)] == [name]
+                ),
+                "components": comps,
+            }
+        return {"pipelines": report, "total_resident_bytes": sum(sizes.values())}
 
     def _move(self, pipe):
         if self.device == "cuda":
@@ -83,50 +281,190 @@ class DiffusionProcessor:
     # Operations
     # -----------------------------
     def generate_txt2img(self, prompt: str, guidance_scale: float, steps: int, seed: Optional[int]) -> Image.Image:
-        self._ensure_txt2img()
-        import torch
-        g = torch.Generator(device=self.device)
-        if seed is not None:
-            g = g.manual_seed(int(seed))
-        result = self._txt2img(
-            prompt=prompt,
-            guidance_scale=float(guidance_scale),
-            num_inference_steps=int(steps),
-            generator=g,
-        )
-        return result.images[0]
+        return self.generate_txt2img_batch([prompt], guidance_scale, steps, [seed])[0]
 
     def img2img(self, prompt: str, init_image: Image.Image, strength: float, guidance_scale: float, steps: int, seed: Optional[int]) -> Image.Image:
-        self._ensure_img2img()
-        import torch
-        g = torch.Generator(device=self.device)
-        if seed is not None:
-            g = g.manual_seed(int(seed))
-        result = self._img2img(
-            prompt=prompt,
-            image=init_image,
-            strength=float(strength),
-            guidance_scale=float(guidance_scale),
-            num_inference_steps=int(steps),
-            generator=g,
-        )
-        return result.images[0]
+        return self.img2img_batch([prompt], [init_image], strength, guidance_scale, steps, [seed])[0]
 
     def inpaint(self, prompt: str, init_image: Image.Image, mask_image: Image.Image, guidance_scale: float, steps: int, seed: Optional[int]) -> Image.Image:
-        self._ensure_inpaint()
+        return self.inpaint_batch([prompt], [init_image], [mask_image], guidance_scale, steps, [seed])[0]
+
+    # Batched variants: one pipeline call for N compatible requests. Shared
+    # scalars (steps, guidance, strength) must match; prompts, images and
+    # seeds are per item. If ``timings`` is given it receives one dict per
+    # item with text/VAE encode time spent and saved by the caches.
+    def generate_txt2img_batch(self, prompts: List[str], guidance_scale: float, steps: int, seeds: List[Optional[int]], callback: Optional[StepCallback] = None, timings: Optional[List[Dict[str, float]]] = None) -> List[Image.Image]:
+        item_timings = self._item_timings(timings, len(prompts))
+        with self._pipeline("txt2img") as pipe:
+            result = self._call(pipe,
+                **self._encode_prompts(pipe, "txt2img", prompts, item_timings),
+                guidance_scale=float(guidance_scale),
+                num_inference_steps=int(steps),
+                generator=self._generators(seeds),
+                **self._step_hook(callback),
+            )
+        return result.images
+
+    def img2img_batch(self, prompts: List[str], init_images: List[Image.Image], strength: float, guidance_scale: float, steps: int, seeds: List[Optional[int]], callback: Optional[StepCallback] = None, timings: Optional[List[Dict[str, float]]] = None) -> List[Image.Image]:
+        item_timings = self._item_timings(timings, len(prompts))
+        with self._pipeline("img2img") as pipe:
+            result = self._call(pipe,
+                **self._encode_prompts(pipe, "img2img", prompts, item_timings),
+                # Already-scaled latents: the pipeline skips its own VAE encode
+                image=self._encode_images(pipe, "img2img", init_images, None, item_timings),
+                strength=float(strength),
+                guidance_scale=float(guidance_scale),
+                num_inference_steps=int(steps),
+                generator=self._generators(seeds),
+                **self._step_hook(callback),
+            )
+        return result.images
+
+    def inpaint_batch(self, prompts: List[str], init_images: List[Image.Image], mask_images: List[Image.Image], guidance_scale: float, steps: int, seeds: List[Optional[int]], callback: Optional[StepCallback] = None, timings: Optional[List[Dict[str, float]]] = None) -> List[Image.Image]:
+        item_timings = self._item_timings(timings, len(prompts))
+        # Batched items share one size; without explicit dims the pipeline renders 512x512
+        width, height = (d - d % 8 for d in init_images[0].size)
+        with self._pipeline("inpaint") as pipe:
+            result = self._call(pipe,
+                **self._encode_prompts(pipe, "inpaint", prompts, item_timings),
+                image=list(init_images),
+                mask_image=list(mask_images),
+                masked_image_latents=self._encode_images(pipe, "inpaint", init_images, mask_images, item_timings),
+                height=height,
+                width=width,
+                guidance_scale=float(guidance_scale),
+                num_inference_steps=int(steps),
+                generator=self._generators(seeds),
+                **self._step_hook(callback),
+            )
+        return result.images
+
+    def prompt_cache_stats(self) -> Dict[str, Any]:
+        stats = self._prompt_embeds.stats()
+        stats["text_encode_seconds_saved"] = round(self._text_encode_seconds_saved, 4)
+        return stats
+
+    def latent_cache_stats(self) -> Dict[str, Any]:
+        stats = self._latents.stats()
+        stats["vae_encode_seconds_saved"] = round(self._vae_encode_seconds_saved, 4)
+        return stats
+
+    @staticmethod
+    def _item_timings(timings: Optional[List[Dict[str, float]]], n: int) -> List[Dict[str, float]]:
+        items: List[Dict[str, float]] = [{} for _ in range(n)]
+        if timings is not None:
+            timings.extend(items)
+        return items
+
+    def _encode_prompts(self, pipe, kind: str, prompts: List[str], item_timings: List[Dict[str, float]]) -> Dict[str, Any]:
+        """
+        ``prompt_embeds``/``negative_prompt_embeds`` for a batch, running the
+        text encoder only for prompts not already cached. The negative prompt
+        is always empty, so it is encoded once per text encoder.
+        """
         import torch
-        g = torch.Generator(device=self.device)
-        if seed is not None:
-            g = g.manual_seed(int(seed))
-        result = self._inpaint(
-            prompt=prompt,
-            image=init_image,
-            mask_image=mask_image,
-            guidance_scale=float(guidance_scale),
-            num_inference_steps=int(steps),
-            generator=g,
-        )
-        return result.images[0]
+        # The first dependency provides the text encoder (shared by inpaint when its UNet is split out)
+        encoder = self._deps(kind)[0]
+        positive, negative = [], []
+        for prompt, timing in zip(prompts, item_timings):
+            pos, pos_spent, pos_saved = self._embed(pipe, encoder, prompt)
+            neg, neg_spent, neg_saved = self._embed(pipe, encoder, "")
+            positive.append(pos)
+            negative.append(neg)
+            timing["text_encode_ms"] = round((pos_spent + neg_spent) * 1000.0, 2)
+            timing["text_encode_saved_ms"] = round((pos_saved + neg_saved) * 1000.0, 2)
+        return {"prompt_embeds": torch.cat(positive), "negative_prompt_embeds": torch.cat(negative)}
+
+    def _embed(self, pipe, encoder: str, text: str) -> Tuple[Any, float, float]:
+        """Returns (embeds, seconds spent encoding, seconds saved by the cache)."""
+        key = (encoder, text)
+        cached: Optional[PromptEmbedding] = self._prompt_embeds.get(key)
+        if cached is not None:
+            self._text_encode_seconds_saved += cached.encode_seconds
+            return cached.embeds.to(self.device), 0.0, cached.encode_seconds
+        import torch
+        start = time.perf_counter()
+        with torch.no_grad():
+            embeds, _ = pipe.encode_prompt(text, self.device, 1, False)
+        elapsed = time.perf_counter() - start
+        record_stage("text_encode", elapsed)
+        self._prompt_embeds.put(key, PromptEmbedding(embeds=embeds.to("cpu"), encode_seconds=elapsed))
+        return embeds, elapsed, 0.0
+
+    def _encode_images(
+        self,
+        pipe,
+        kind: str,
+        images: List[Image.Image],
+        masks: Optional[List[Image.Image]],
+        item_timings: List[Dict[str, float]],
+    ):
+        """
+        Scaled VAE latents (B, 4, h/8, w/8) of the init images, or of the
+        masked images for inpainting, reusing cached latents for unchanged inputs.
+        """
+        import torch
+        vae = self._deps(kind)[0]  # the VAE comes from the same component set as the text encoder
+        latents = []
+        for i, (img, timing) in enumerate(zip(images, item_timings)):
+            mask = masks[i] if masks is not None else None
+            lat, spent, saved = self._vae_latent(pipe, vae, img, mask)
+            latents.append(lat)
+            timing["vae_encode_ms"] = round(spent * 1000.0, 2)
+            timing["vae_encode_saved_ms"] = round(saved * 1000.0, 2)
+        return torch.cat(latents)
+
+    def _vae_latent(self, pipe, vae: str, img: Image.Image, mask: Optional[Image.Image]) -> Tuple[Any, float, float]:
+        """Returns (latent, seconds spent encoding, seconds saved by the cache)."""
+        width, height = (d - d % 8 for d in img.size)
+        key = (vae, "masked" if mask is not None else "init", width, height, image_digest(img), image_digest(mask))
+        cached: Optional[VAELatent] = self._latents.get(key)
+        if cached is not None:
+            self._vae_encode_seconds_saved += cached.encode_seconds
+            return cached.latent.to(pipe.vae.device), 0.0, cached.encode_seconds
+        import torch
+        start = time.perf_counter()
+        with torch.no_grad():
+            pixels = pipe.image_processor.preprocess(img, height=height, width=width)
+            if mask is not None:
+                # Same construction as StableDiffusionInpaintPipeline's masked_image
+                mask_t = pipe.mask_processor.preprocess(mask, height=height, width=width)
+                pixels = pixels * (mask_t < 0.5)
+            pixels = pixels.to(device=pipe.vae.device, dtype=pipe.vae.dtype)
+            # Posterior mean rather than a sample, so the latent does not depend on the seed
+            latent = pipe.vae.encode(pixels).latent_dist.mode() * pipe.vae.config.scaling_factor
+        elapsed = time.perf_counter() - start
+        record_stage("vae_encode", elapsed)
+        self._latents.put(key, VAELatent(latent=latent.to("cpu"), encode_seconds=elapsed))
+        return latent, elapsed, 0.0
+
+    @staticmethod
+    def _call(pipe, **kwargs: Any):
+        """Run the pipeline (denoising loop plus VAE decode) as the ``denoise`` stage."""
+        with stage("denoise"):
+            return pipe(**kwargs)
+
+    @staticmethod
+    def _step_hook(callback: Optional[StepCallback]) -> Dict[str, Any]:
+        """Pipeline kwargs that report ``(step, total_steps, latents)`` after every denoising step."""
+        if callback is None:
+            return {}
+
+        def on_step_end(pipe, step, _timestep, callback_kwargs):
+            callback(step + 1, getattr(pipe, "num_timesteps", None), callback_kwargs.get("latents"))
+            return callback_kwargs
+
+        return {"callback_on_step_end": on_step_end, "callback_on_step_end_tensor_inputs": ["latents"]}
+
+    def _generators(self, seeds: List[Optional[int]]):
+        import torch
+        gens = []
+        for seed in seeds:
+            g = torch.Generator(device=self.device)
+            if seed is not None:
+                g = g.manual_seed(int(seed))
+            gens.append(g)
+        return gens
 
     # -----------------------------
     # Device selection
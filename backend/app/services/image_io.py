@@ -0,0 +1,160 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+"""
+
+import io
+import os
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Tuple, TypeVar
+
+from PIL import Image
+
+from ..core.config import settings
+
+T = TypeVar("T")
+
+# format name -> (PIL format, media type)
+OUTPUT_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+_FORMAT_ALIASES = {"jpg": "jpeg", "image/png": "png", "image/webp": "webp", "image/jpeg": "jpeg"}
+
+
+def normalize_format(fmt: Optional[str]) -> str:
+    name = (fmt or "png").strip().lower()
+    name = _FORMAT_ALIASES.get(name, name)
+    if name not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported image format: {fmt}")
+    return name
+
+
+def negotiate_output(
+    accept: Optional[str],
+    response_format: Optional[str] = None,
+    image_format: Optional[str] = None,
+) -> Tuple[bool, str]:
+    """Decide (binary?, format) from an explicit ``response_format`` or the Accept header.
+
+    JSON stays the default so existing clients keep receiving ``image_base64``.
+    """
+    if response_format:
+        mode = response_format.strip().lower()
+        if mode == "json":
+            return False, normalize_format(image_format)
+        if mode in ("binary", "raw"):
+            return True, normalize_format(image_format)
+        fmt = normalize_format(mode)  # e.g. response_format=webp
+        return True, normalize_format(image_format or fmt)
+
+    ranked = []
+    for i, part in enumerate((accept or "").split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        media = fields[0].lower()
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media and q > 0:  # q=0 means "not acceptable"
+            ranked.append((-q, i, media))
+    for _, _, media in sorted(ranked):
+        if media in ("application/json", "*/*"):
+            return False, normalize_format(image_format)
+        if media in _FORMAT_ALIASES:
+            return True, normalize_format(image_format or media)
+        if media == "image/*":
+            return True, normalize_format(image_format)
+    return False, normalize_format(image_format)
+
+
+def encode_image(
+    img: Image.Image,
+    fmt: str = "png",
+    quality: int = 90,
+    compress_level: int = 6,
+) -> Tuple[bytes, str]:
+    """Encode ``img``; returns (bytes, media type)."""
+    name = normalize_format(fmt)
+    pil_format, media_type = OUTPUT_FORMATS[name]
+    buf = io.BytesIO()
+    if name == "png":
+        img.save(buf, format=pil_format, compress_level=int(compress_level))
+    elif name == "jpeg":
+        img.convert("RGB").save(buf, format=pil_format, quality=int(quality), optimize=False)
+    else:
+        img.save(buf, format=pil_format, quality=int(quality), method=4)
+    return buf.getvalue(), media_type
+
+
+# -----------------------------
+# Decoding
+# -----------------------------
+@dataclass
+class DecodedImage:
+    """A decoded upload, possibly reduced on ingest, with the size it was uploaded at."""
+
+    image: Image.Image
+    original_size: Tuple[int, int]  # (width, height)
+
+    @property
+    def scale(self) -> float:
+        """Decoded / original linear size (1.0 when decoded at full resolution)."""
+        return self.image.width / float(self.original_size[0])
+
+
+def decode_image(data: bytes, mode: str = "RGB", max_side: Optional[int] = None) -> DecodedImage:
+    """
+    Decode ``data`` to ``mode``. With ``max_side``, larger images come out with
+    their longest side at ``max_side``: JPEGs are decoded in draft mode (the
+    decoder scales by 1/2..1/8 during IDCT), so full-resolution pixels are never
+    materialised just to be resized; the remainder is a single resample.
+    """
+    img = Image.open(io.BytesIO(data))
+    original = img.size
+    if max_side and max(original) > max_side:
+        ratio = max_side / float(max(original))
+        target = (max(1, round(original[0] * ratio)), max(1, round(original[1] * ratio)))
+        img.draft(mode, target)  # never below target; no-op for non-JPEG
+        img = img.convert(mode)
+        if img.size != target:
+            img = img.resize(target, Image.Resampling.BICUBIC, reducing_gap=2.0)
+    else:
+        img = img.convert(mode)
+    return DecodedImage(img, original)
+
+
+# -----------------------------
+# Codec executor
+# -----------------------------
+_codec_pool: Optional[ThreadPoolExecutor] = None
+_codec_lock = threading.Lock()
+
+
+def codec_executor() -> ThreadPoolExecutor:
+    """Bounded pool for image decode/encode, so large uploads never run on the event loop
+    and cannot fan out over every thread of the default executor (``CODEC_WORKERS``)."""
+    global _codec_pool
+    if _codec_pool is None:
+        with _codec_lock:
+            if _codec_pool is None:
+                workers = settings.CODEC_WORKERS or min(4, os.cpu_count() or 1)
+                _codec_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="codec")
+    return _codec_pool
+
+
+async def run_codec(fn: Callable[..., T], *args: Any) -> T:
+    """``fn(*args)`` on the codec pool; like ``asyncio.to_thread``, stages stay attributed to the request."""
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(codec_executor(), call)
@@ -0,0 +1,213 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+"""
+
+import io
+import os
+import re
+import time
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Union
+
+from PIL import Image
+
+from ..core.config import settings
+from ..core.metrics import metrics
+from .cache import DiskCache, LRUCache
+from .image_io import DecodedImage, decode_image
+
+logger = logging.getLogger(__name__)
+
+_HANDLE = re.compile(r"^[0-9a-f]{64}$")
+_LOOKUPS = metrics.counter("retouch_image_store_lookups_total", "Image handle lookups.", ["tier"])
+
+
+@dataclass
+class StoredImage:
+    """An upload kept by the image store: its encoded bytes plus the image decoded once on ingest.
+
+    ``image`` is shared between requests and must be treated as read-only.
+    """
+
+    handle: str  # sha256 hex of ``data``
+    data: bytes
+    image: Image.Image
+    format: Optional[str] = None
+    last_used: float = 0.0
+
+    @property
+    def digest(self) -> bytes:
+        return bytes.fromhex(self.handle)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + self.image.width * self.image.height * len(self.image.getbands())
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "image_id": self.handle,
+            "width": self.image.width,
+            "height": self.image.height,
+            "mode": self.image.mode,
+            "format": self.format,
+            "bytes": len(self.data),
+        }
+
+
+# Endpoints and services take an upload either as raw bytes or as a stored handle
+ImageSource = Union[bytes, StoredImage]
+
+
+def source_bytes(src: Optional[ImageSource]) -> Optional[bytes]:
+    return src.data if isinstance(src, StoredImage) else src
+
+
+def source_digest(src: ImageSource) -> bytes:
+    """sha256 of the encoded upload (free for stored images)."""
+    return src.digest if isinstance(src, StoredImage) else hashlib.sha256(src).digest()
+
+
+def decode_source(src: ImageSource, mode: str = "RGB", max_side: Optional[int] = None) -> DecodedImage:
+    """``decode_image`` for either kind of source; stored images skip the decode."""
+    if not isinstance(src, StoredImage):
+        return decode_image(src, mode, max_side)
+    img = src.image if src.image.mode == mode else src.image.convert(mode)
+    if max_side and max(img.size) > max_side:
+        ratio = max_side / float(max(img.size))
+        target = (max(1, round(img.width * ratio)), max(1, round(img.height * ratio)))
+        img = img.resize(target, Image.Resampling.BICUBIC, reducing_gap=2.0)
+    return DecodedImage(img, src.image.size)
+
+
+class ImageStore:
+    """
+    Upload-once store of documents, addressed by content hash.
+
+    - ``put`` decodes an upload once and returns its handle (sha256 of the
+      bytes), so the panel can send the handle instead of the document on
+      every SAM click, retouch run or LUT apply.
+    - Memory tier: decoded images in an LRU bounded by bytes; disk tier: the
+      original encoded bytes on the storage volume, re-decoded and promoted
+      on a memory miss.
+    - Entries expire ``ttl_seconds`` after their last use, in both tiers.
+    """
+
+    def __init__(
+        self,
+        memory_bytes: int,
+        disk_dir: Optional[str] = None,
+        disk_bytes: Optional[int] = None,
+        ttl_seconds: float = 3600.0,
+    ) -> None:
+        self.ttl_seconds = float(ttl_seconds)
+        self._memory = LRUCache(max_bytes=memory_bytes, sizeof=lambda s: s.nbytes)
+        self._disk = DiskCache(disk_dir, max_bytes=disk_bytes, ttl_seconds=ttl_seconds) if disk_dir and disk_bytes else None
+        self._last_sweep = time.monotonic()
+
+    # -----------------------------
+    # Public API (blocking: call from a worker thread)
+    # -----------------------------
+    def put(self, data: bytes) -> StoredImage:
+        """Store an upload; raises ValueError if it is not a decodable image."""
+        handle = hashlib.sha256(data).hexdigest()
+        stored = self._memory.get(handle)
+        if stored is None:
+            stored = self._decode(handle, data)
+            self._memory.put(handle, stored)
+            if self._disk is not None:
+                try:
+                    self._disk.put(handle, data)
+                except OSError as e:
+                    logger.warning("Image store disk write failed: %s", e)
+        stored.last_used = time.monotonic()
+        self._maybe_sweep()
+        return stored
+
+    def get(self, handle: str) -> Optional[StoredImage]:
+        """Return the stored image or None if the handle is unknown or expired."""
+        if not _HANDLE.match(handle or ""):
+            return None
+        now = time.monotonic()
+        stored = self._memory.get(handle)
+        if stored is not None and now - stored.last_used > self.ttl_seconds:
+            self._memory.pop(handle)
+            stored = None
+        if stored is not None:
+            _LOOKUPS.inc(tier="memory")
+            if self._disk is not None:
+                self._disk.touch(handle)  # keep the disk copy's TTL in step
+        else:
+            data = self._disk.get(handle) if self._disk is not None else None
+            if data is None:
+                _LOOKUPS.inc(tier="miss")
+                return None
+            _LOOKUPS.inc(tier="disk")
+            stored = self._decode(handle, data)
+            self._memory.put(handle, stored)
+        stored.last_used = now
+        return stored
+
+    def delete(self, handle: str) -> bool:
+        if not _HANDLE.match(handle or ""):
+            return False
+        removed = self._memory.pop(handle) is not None
+        if self._disk is not None:
+            removed = self._disk.delete(handle) or removed
+        return removed
+
+    def sweep_expired(self) -> int:
+        now = time.monotonic()
+        removed = 0
+        for handle in self._memory.keys():
+            stored = self._memory.peek(handle)
+            if stored is not None and now - stored.last_used > self.ttl_seconds:
+                self._memory.pop(handle)
+                removed += 1
+        if self._disk is not None:
+            removed += self._disk.sweep_expired()
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ttl_seconds": self.ttl_seconds,
+            "memory": self._memory.stats(),
+            "disk": self._disk.stats() if self._disk is not None else None,
+        }
+
+    # -----------------------------
+    # Internal
+    # -----------------------------
+    @staticmethod
+    def _decode(handle: str, data: bytes) -> StoredImage:
+        try:
+            img = Image.open(io.BytesIO(data))
+            fmt = img.format
+            img.load()
+        except Exception as e:
+            raise ValueError(f"Invalid image: {e}")
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        return StoredImage(handle=handle, data=data, image=img, format=fmt)
+
+    def _maybe_sweep(self) -> None:
+        # Expiry is otherwise lazy; sweep at most once a minute, piggybacking on uploads
+        if time.monotonic() - self._last_sweep >= 60.0:
+            self._last_sweep = time.monotonic()
+            self.sweep_expired()
+
+
+_image_store_singleton: Optional[ImageStore] = None
+
+def get_image_store() -> ImageStore:
+    global _image_store_singleton
+    if _image_store_singleton is None:
+        _image_store_singleton = ImageStore(
+            memory_bytes=settings.IMAGE_STORE_MB * 1024 * 1024,
+            disk_dir=os.path.join(settings.STORAGE_DIR, "images"),
+            disk_bytes=settings.IMAGE_STORE_DISK_MB * 1024 * 1024,
+            ttl_seconds=settings.IMAGE_STORE_TTL_SECONDS,
+        )
+    return _image_store_singleton
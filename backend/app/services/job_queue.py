@@ -0,0 +1,499 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import functools
+import logging
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ..core.metrics import metrics, record_stage
+
+logger = logging.getLogger(__name__)
+
+_QUEUE_DEPTH = metrics.gauge("retouch_job_queue_depth", "Retouch jobs waiting in the broker.")
+_JOBS_ACTIVE = metrics.gauge("retouch_jobs_running", "Retouch jobs currently executing.")
+_JOBS_FINISHED = metrics.counter("retouch_jobs_finished_total", "Finished retouch jobs.", ["status"])
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class RetouchJob:
+    id: str
+    params: Dict[str, Any]
+    status: str = JOB_QUEUED
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    result_meta: Dict[str, Any] = field(default_factory=dict)
+    attempts: int = 0
+
+    @property
+    def queue_wait_ms(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        return round((self.started_at - self.submitted_at) * 1000.0, 1)
+
+    @property
+    def compute_ms(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return round((self.finished_at - self.started_at) * 1000.0, 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["queue_wait_ms"] = self.queue_wait_ms
+        data["compute_ms"] = self.compute_ms
+        return data
+
+
+# -----------------------------
+# Brokers (carry job ids only)
+# -----------------------------
+def _text(value: Any) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class InMemoryBroker:
+    """In-process broker for tests and single-node dev.
+
+    Nothing survives a restart, so the queue re-enqueues pending jobs from
+    the job store on startup (``durable`` is False).
+    """
+
+    durable = False
+    heartbeat_seconds = 0.0
+
+    def __init__(self) -> None:
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+
+    async def put(self, job_id: str) -> None:
+        await self._queue.put(job_id)
+
+    async def requeue(self, job_id: str) -> None:
+        await self._queue.put(job_id)
+
+    async def ack(self, job_id: str) -> None:
+        return None
+
+    async def heartbeat(self) -> None:
+        return None
+
+    async def reap(self) -> List[str]:
+        return []
+
+    async def get(self, timeout: float = 1.0) -> Optional[str]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def close(self) -> None:
+        return None
+
+
+class RedisBroker:
+    """
+    Redis list broker shared by every backend replica, delivering at least once.
+
+    - ``get`` atomically moves an id (BLMOVE) from the queue into this
+      consumer's processing list; ``ack`` drops it once the job is finished,
+      so a worker crash never loses the id.
+    - Every consumer keeps a heartbeat key alive. ``reap`` claims the
+      processing lists of consumers whose heartbeat expired (crashed or
+      restarted replicas) and hands their ids back for requeueing.
+    """
+
+    durable = True
+
+    def __init__(self, url: str, key: str = "retouch:jobs", heartbeat_ttl: float = 30.0) -> None:
+        import redis.asyncio as redis  # type: ignore
+
+        self._redis = redis.from_url(url)
+        self._key = key
+        self._consumer = uuid.uuid4().hex
+        self._processing = self._processing_key(self._consumer)
+        self._heartbeat_ttl = max(3, int(heartbeat_ttl))
+        self.heartbeat_seconds = self._heartbeat_ttl / 3.0
+
+    def _processing_key(self, consumer: str) -> str:
+        return f"{self._key}:processing:{consumer}"
+
+    def _alive_key(self, consumer: str) -> str:
+        return f"{self._key}:alive:{consumer}"
+
+    async def put(self, job_id: str) -> None:
+        await self._redis.lpush(self._key, job_id)
+
+    async def requeue(self, job_id: str) -> None:
+        # Recovered jobs go to the consuming end: they have waited longest
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(self._key, job_id)
+            pipe.lrem(self._processing, 0, job_id)
+            await pipe.execute()
+
+    async def get(self, timeout: float = 1.0) -> Optional[str]:
+        value = await self._redis.blmove(self._key, self._processing, max(1, int(timeout)), "RIGHT", "LEFT")
+        return None if value is None else _text(value)
+
+    async def ack(self, job_id: str) -> None:
+        await self._redis.lrem(self._processing, 0, job_id)
+
+    async def heartbeat(self) -> None:
+        await self._redis.set(self._alive_key(self._consumer), "1", ex=self._heartbeat_ttl)
+        await self._redis.sadd(f"{self._key}:consumers", self._consumer)
+
+    async def reap(self) -> List[str]:
+        """Move dead consumers' in-flight ids into this consumer's processing list and return them."""
+        orphans: List[str] = []
+        for consumer in map(_text, await self._redis.smembers(f"{self._key}:consumers")):
+            if consumer == self._consumer or await self._redis.exists(self._alive_key(consumer)):
+                continue
+            # One replica claims each dead consumer
+            if not await self._redis.set(f"{self._key}:reap:{consumer}", self._consumer, nx=True, ex=self._heartbeat_ttl):
+                continue
+            dead = self._processing_key(consumer)
+            while True:
+                value = await self._redis.lmove(dead, self._processing, "RIGHT", "LEFT")
+                if value is None:
+                    break
+                orphans.append(_text(value))
+            await self._redis.srem(f"{self._key}:consumers", consumer)
+        return orphans
+
+    async def depth(self) -> int:
+        return int(await self._redis.llen(self._key))
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+
+# -----------------------------
+# Storage
+# -----------------------------
+class JobStore:
+    """Job records and blobs under ``root/<job_id>/`` (shared storage volume)."""
+
+    def __init__(self, root: str) -> None:
+        self.root = Path(root)
+
+    def _dir(self, job_id: str) -> Path:
+        if not job_id.isalnum():
+            raise KeyError(f"Invalid job id: {job_id}")
+        return self.root / job_id
+
+    def save(self, job: RetouchJob) -> None:
+        path = self._dir(job.id)
+        path.mkdir(parents=True, exist_ok=True)
+        tmp = path / "job.json.tmp"
+        tmp.write_text(json.dumps(asdict(job)))
+        os.replace(tmp, path / "job.json")
+
+    def load(self, job_id: str) -> Optional[RetouchJob]:
+        try:
+            path = self._dir(job_id) / "job.json"
+        except KeyError:
+            return None
+        if not path.exists():
+            return None
+        return RetouchJob(**json.loads(path.read_text()))
+
+    def put_blob(self, job_id: str, name: str, data: Optional[bytes]) -> None:
+        if data is None:
+            return
+        path = self._dir(job_id)
+        path.mkdir(parents=True, exist_ok=True)
+        (path / name).write_bytes(data)
+
+    def get_blob(self, job_id: str, name: str) -> Optional[bytes]:
+        path = self._dir(job_id) / name
+        return path.read_bytes() if path.exists() else None
+
+    def blob_path(self, job_id: str, name: str) -> Path:
+        return self._dir(job_id) / name
+
+    def list_ids(self) -> List[str]:
+        if not self.root.is_dir():
+            return []
+        return [p.name for p in self.root.iterdir() if (p / "job.json").exists()]
+
+
+class PostgresJobRecorder:
+    """Mirrors job lifecycle and timings into the ``retouch_jobs`` table."""
+
+    def __init__(self, dsn: str) -> None:
+        self._dsn = dsn
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            import psycopg2  # type: ignore
+
+            self._conn = psycopg2.connect(self._dsn)
+            self._conn.autocommit = True
+        return self._conn
+
+    def record(self, job: RetouchJob) -> None:
+        try:
+            with self._connection().cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO retouch_jobs
+                        (job_id, prompt, operation, params, status, created_at, started_at,
+                         finished_at, queue_wait_ms, compute_ms, error)
+                    VALUES (%s, %s, %s, %s, %s, to_timestamp(%s), to_timestamp(%s),
+                            to_timestamp(%s), %s, %s, %s)
+                    ON CONFLICT (job_id) DO UPDATE SET
+                        status = EXCLUDED.status,
+                        started_at = EXCLUDED.started_at,
+                        finished_at = EXCLUDED.finished_at,
+                        queue_wait_ms = EXCLUDED.queue_wait_ms,
+                        compute_ms = EXCLUDED.compute_ms,
+                        error = EXCLUDED.error
+                    """,
+                    (
+                        job.id,
+                        job.params.get("prompt"),
+                        job.params.get("operation"),
+                        json.dumps(job.params),
+                        job.status,
+                        job.submitted_at,
+                        job.started_at,
+                        job.finished_at,
+                        job.queue_wait_ms,
+                        job.compute_ms,
+                        job.error,
+                    ),
+                )
+        except Exception as e:
+            # Persistence is best-effort; never fail the job because the DB is down
+            logger.warning("Could not record job %s: %s", job.id, e)
+            self._conn = None
+
+
+# -----------------------------
+# Queue
+# -----------------------------
+class JobQueue:
+    """
+    Asynchronous retouch job queue.
+
+    - Submissions are stored (inputs on the storage volume) and their ids
+      pushed to a broker; ``workers`` asyncio tasks pull and execute them.
+    - Lifecycle and queue-wait vs compute timings are kept on the job record
+      and optionally mirrored to Postgres.
+    - Jobs interrupted by a crash or restart are requeued (on startup, and by
+      the heartbeat loop for other replicas' jobs); after ``max_attempts``
+      interrupted runs a job is failed instead.
+    """
+
+    def __init__(
+        self,
+        processor: Callable[..., Awaitable[Dict[str, Any]]],
+        broker,
+        store: JobStore,
+        workers: int = 1,
+        recorder: Optional[PostgresJobRecorder] = None,
+        max_attempts: int = 3,
+    ) -> None:
+        self._processor = processor
+        self._broker = broker
+        self._store = store
+        self._workers = max(1, int(workers))
+        self._recorder = recorder
+        self._max_attempts = max(1, int(max_attempts))
+        self._tasks: List[asyncio.Task] = []
+        self._running = False
+        self._active = 0
+
+    # -----------------------------
+    # Public API
+    # -----------------------------
+    async def submit(
+        self,
+        params: Dict[str, Any],
+        image_bytes: Optional[bytes] = None,
+        mask_bytes: Optional[bytes] = None,
+    ) -> RetouchJob:
+        job = RetouchJob(id=uuid.uuid4().hex, params=dict(params))
+        await asyncio.to_thread(self._store.put_blob, job.id, "image", image_bytes)
+        await asyncio.to_thread(self._store.put_blob, job.id, "mask", mask_bytes)
+        await self._persist(job)
+        await self._broker.put(job.id)
+        return job
+
+    async def get(self, job_id: str) -> Optional[RetouchJob]:
+        return await asyncio.to_thread(self._store.load, job_id)
+
+    def result_path(self, job_id: str) -> Path:
+        return self._store.blob_path(job_id, "result.png")
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self._workers,
+            "running": self._running,
+            "queue_depth": await self._broker.depth(),
+        }
+
+    async def collect_metrics(self) -> None:
+        """Refresh the queue gauges (the broker depth is async, so scrapes call this first)."""
+        _QUEUE_DEPTH.set(await self._broker.depth())
+        _JOBS_ACTIVE.set(self._active)
+
+    async def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        await self._broker.heartbeat()  # before the first get, so our processing list is never reaped
+        await self._recover()
+        self._tasks = [asyncio.create_task(self._worker_loop()) for _ in range(self._workers)]
+        if self._broker.heartbeat_seconds:
+            self._tasks.append(asyncio.create_task(self._heartbeat_loop()))
+
+    async def stop(self) -> None:
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._broker.close()
+
+    async def join(self, timeout: float = 10.0) -> None:
+        """Wait until the broker is drained and no job is running (tests/shutdown)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if await self._broker.depth() == 0 and not self._active:
+                return
+            await asyncio.sleep(0.01)
+        raise TimeoutError("job queue did not drain")
+
+    # -----------------------------
+    # Internal
+    # -----------------------------
+    async def _worker_loop(self) -> None:
+        while self._running:
+            job_id = await self._broker.get(timeout=1.0)
+            if job_id is None:
+                continue
+            self._active += 1
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logger.exception("Job %s crashed: %s", job_id, e)
+            finally:
+                self._active -= 1
+            try:
+                await self._broker.ack(job_id)
+            except Exception as e:
+                logger.warning("Could not acknowledge job %s: %s", job_id, e)
+
+    async def _heartbeat_loop(self) -> None:
+        while self._running:
+            await asyncio.sleep(self._broker.heartbeat_seconds)
+            try:
+                await self._broker.heartbeat()
+                await self._reap()
+            except Exception as e:
+                logger.warning("Job queue heartbeat failed: %s", e)
+
+    async def _recover(self) -> None:
+        if not self._broker.durable:
+            # The broker lost everything: re-enqueue what the store still has pending
+            for job_id in await asyncio.to_thread(self._store.list_ids):
+                job = await self.get(job_id)
+                if job is not None and job.status in (JOB_QUEUED, JOB_RUNNING) and await self._reset(job):
+                    await self._broker.requeue(job_id)
+        await self._reap()
+
+    async def _reap(self) -> None:
+        for job_id in await self._broker.reap():
+            job = await self.get(job_id)
+            if job is not None and job.status in (JOB_QUEUED, JOB_RUNNING) and await self._reset(job):
+                logger.warning("Requeueing interrupted job %s (attempt %d)", job_id, job.attempts + 1)
+                await self._broker.requeue(job_id)
+            else:
+                await self._broker.ack(job_id)
+
+    async def _reset(self, job: RetouchJob) -> bool:
+        """Make an interrupted job runnable again; False if it has used up its attempts."""
+        if job.status == JOB_QUEUED:
+            return True
+        if job.attempts >= self._max_attempts:
+            job.status = JOB_FAILED
+            job.error = f"Interrupted {job.attempts} times (worker crash or restart)"
+            job.finished_at = time.time()
+            _JOBS_FINISHED.inc(status=job.status)
+            await self._persist(job)
+            return False
+        job.status = JOB_QUEUED
+        job.started_at = None
+        await self._persist(job)
+        return True
+
+    async def _run(self, job_id: str) -> None:
+        job = await self.get(job_id)
+        if job is None or job.status != JOB_QUEUED:
+            return
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        job.attempts += 1
+        record_stage("job_wait", job.started_at - job.submitted_at)
+        await self._persist(job)
+
+        image_bytes = await asyncio.to_thread(self._store.get_blob, job.id, "image")
+        mask_bytes = await asyncio.to_thread(self._store.get_blob, job.id, "mask")
+        params = dict(job.params)
+        prompt = params.pop("prompt", "")
+        try:
+            result = await self._processor(image_bytes, prompt, mask_bytes=mask_bytes, **params)
+            await asyncio.to_thread(self._store.put_blob, job.id, "result.png", result["image_png"])
+            job.result_meta = result.get("meta", {})
+            job.status = JOB_SUCCEEDED
+        except Exception as e:
+            job.error = str(e)
+            job.status = JOB_FAILED
+        job.finished_at = time.time()
+        _JOBS_FINISHED.inc(status=job.status)
+        await self._persist(job)
+
+    async def _persist(self, job: RetouchJob) -> None:
+        await asyncio.to_thread(self._store.save, job)
+        if self._recorder is not None:
+            await asyncio.to_thread(self._recorder.record, job)
+
+
+_job_queue_singleton: Optional[JobQueue] = None
+
+def get_job_queue() -> JobQueue:
+    global _job_queue_singleton
+    if _job_queue_singleton is None:
+        from ..core.config import settings
+        from .admission import BACKGROUND
+        from .ai_service import get_ai_service
+
+        broker = RedisBroker(settings.REDIS_URL) if settings.JOB_BROKER == "redis" else InMemoryBroker()
+        recorder = PostgresJobRecorder(settings.POSTGRES_DSN) if settings.JOB_PERSIST_POSTGRES else None
+        _job_queue_singleton = JobQueue(
+            # Queued jobs yield to interactive and synchronous requests
+            functools.partial(get_ai_service().process_image, lane=BACKGROUND),
+            broker,
+            JobStore(os.path.join(settings.STORAGE_DIR, "jobs")),
+            workers=settings.JOB_WORKERS,
+            recorder=recorder,
+        )
+    return _job_queue_singleton
@@ -3,28 +3,474 @@ Copyright (c) 2025 AI Retouch Studio Contributors
 SPDX-License-Identifier: Apache-2.0
 """
 
-from typing import List
-from PIL import Image, ImageEnhance
-import io
+import os
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from ..core.metrics import stage
+from .cache import LRUCache
+from .image_io import decode_image, run_codec
+from .png_stream import EncodedStrip, encode_strip, iter_png
+
+logger = logging.getLogger(__name__)
+
+LUT_EXTENSIONS = (".cube", ".3dl")
+
+
+@dataclass
+class LUT3D:
+    """A 3D colour lookup table.
+
+    ``table`` is float32 with shape (N, N, N, 3), indexed ``[r, g, b]`` over an
+    input domain of [0, 1]; output values are normalised to [0, 1].
+    """
+
+    name: str
+    table: np.ndarray
+    title: str = ""
+
+    @property
+    def size(self) -> int:
+        return int(self.table.shape[0])
+
+
+# -----------------------------
+# Table helpers
+# -----------------------------
+def identity_table(size: int) -> np.ndarray:
+    ramp = np.linspace(0.0, 1.0, size, dtype=np.float32)
+    r, g, b = np.meshgrid(ramp, ramp, ramp, indexing="ij")
+    return np.stack([r, g, b], axis=-1)
+
+
+def trilinear(table: np.ndarray, rgb: np.ndarray) -> np.ndarray:
+    """Vectorised trilinear lookup of ``rgb`` (..., 3) in [0, 1] through ``table``."""
+    n = table.shape[0]
+    x = np.clip(rgb, 0.0, 1.0).astype(np.float32) * (n - 1)
+    i0 = np.minimum(x.astype(np.intp), n - 2)
+    f = x - i0
+    r0, g0, b0 = i0[..., 0], i0[..., 1], i0[..., 2]
+    r1, g1, b1 = r0 + 1, g0 + 1, b0 + 1
+    fr, fg, fb = f[..., 0:1], f[..., 1:2], f[..., 2:3]
+
+    c00 = table[r0, g0, b0] * (1 - fr) + table[r1, g0, b0] * fr
+    c01 = table[r0, g0, b1] * (1 - fr) + table[r1, g0, b1] * fr
+    c10 = table[r0, g1, b0] * (1 - fr) + table[r1, g1, b0] * fr
+    c11 = table[r0, g1, b1] * (1 - fr) + table[r1, g1, b1] * fr
+    c0 = c00 * (1 - fg) + c10 * fg
+    c1 = c01 * (1 - fg) + c11 * fg
+    return (c0 * (1 - fb) + c1 * fb).astype(np.float32)
+
+
+def blend_table(table: np.ndarray, intensity: float) -> np.ndarray:
+    """Blend a table toward identity.
+
+    Trilinear interpolation is linear in the table values, so applying the
+    blended table equals blending the graded image with the original.
+    """
+    if intensity >= 1.0:
+        return table
+    ident = identity_table(table.shape[0])
+    return ident + np.float32(intensity) * (table - ident)
+
+
+def saturation_table(factor: float, size: int = 17) -> np.ndarray:
+    """Table equivalent of ``ImageEnhance.Color`` (blend against ITU-R 601 luma)."""
+    ident = identity_table(size)
+    luma = ident @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    out = luma[..., None] + np.float32(factor) * (ident - luma[..., None])
+    return np.clip(out, 0.0, 1.0).astype(np.float32)
+
+
+# -----------------------------
+# Parsers
+# -----------------------------
+def _data_lines(text: str) -> List[str]:
+    lines = []
+    for raw in text.splitlines():
+        line = raw.split("#", 1)[0].strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def parse_cube(text: str, name: str = "") -> LUT3D:
+    """Parse an Adobe/Resolve ``.cube`` 3D LUT (red index varies fastest)."""
+    size = None
+    title = ""
+    dmin = np.zeros(3, dtype=np.float32)
+    dmax = np.ones(3, dtype=np.float32)
+    values: List[str] = []
+    for line in _data_lines(text):
+        head = line.split(None, 1)[0].upper()
+        if head == "TITLE":
+            title = line[5:].strip().strip('"')
+        elif head == "LUT_3D_SIZE":
+            size = int(line.split()[1])
+        elif head == "LUT_1D_SIZE":
+            raise ValueError("1D .cube LUTs are not supported")
+        elif head == "DOMAIN_MIN":
+            dmin = np.array(line.split()[1:4], dtype=np.float32)
+        elif head == "DOMAIN_MAX":
+            dmax = np.array(line.split()[1:4], dtype=np.float32)
+        elif head == "LUT_3D_INPUT_RANGE":
+            lo, hi = (float(v) for v in line.split()[1:3])
+            dmin, dmax = np.full(3, lo, np.float32), np.full(3, hi, np.float32)
+        elif head[0].isalpha():
+            continue  # unknown keyword
+        else:
+            values.append(line)
+    if size is None:
+        raise ValueError("missing LUT_3D_SIZE")
+    data = np.array(" ".join(values).split(), dtype=np.float32)
+    if data.size != size ** 3 * 3:
+        raise ValueError(f"expected {size ** 3} entries, found {data.size // 3}")
+    # File order is b-major / r-fastest -> reindex as [r, g, b]
+    table = data.reshape(size, size, size, 3).transpose(2, 1, 0, 3)
+    table = np.ascontiguousarray(table)
+    if not (np.allclose(dmin, 0.0) and np.allclose(dmax, 1.0)):
+        # Resample onto a [0, 1] input grid so every table shares one domain
+        grid = (identity_table(size) - dmin) / np.maximum(dmax - dmin, 1e-6)
+        table = trilinear(table, grid)
+    return LUT3D(name=name, table=table, title=title)
+
+
+def parse_3dl(text: str, name: str = "") -> LUT3D:
+    """Parse an Autodesk/Lustre ``.3dl`` LUT (shaper line, then r-major / b-fastest integers)."""
+    lines = _data_lines(text)
+    shaper = None
+    out_bits = None
+    rows: List[str] = []
+    for line in lines:
+        parts = line.split()
+        if parts[0].lower() in ("3dmesh", "mesh", "lut8", "gamma"):
+            if parts[0].lower() == "mesh" and len(parts) >= 3:
+                out_bits = int(parts[2])
+            continue
+        if shaper is None and len(parts) > 3:
+            shaper = parts
+            continue
+        rows.append(line)
+    if shaper is None:
+        raise ValueError("missing .3dl shaper line")
+    size = len(shaper)
+    data = np.array(" ".join(rows).split(), dtype=np.float32)
+    if data.size != size ** 3 * 3:
+        raise ValueError(f"expected {size ** 3} entries, found {data.size // 3}")
+    if out_bits is not None:
+        max_val = float(2 ** out_bits - 1)
+    else:
+        max_val = float(2 ** int(np.ceil(np.log2(max(float(data.max()), 1.0) + 1))) - 1)
+    table = (data / max_val).reshape(size, size, size, 3)
+    return LUT3D(name=name, table=np.ascontiguousarray(table, dtype=np.float32))
+
+
+def load_lut_file(path: Union[str, Path]) -> LUT3D:
+    path = Path(path)
+    text = path.read_text(encoding="utf-8", errors="replace")
+    if path.suffix.lower() == ".3dl":
+        return parse_3dl(text, name=path.stem)
+    return parse_cube(text, name=path.stem)
+
 
 class LUTService:
-    """Example LUT service with simple operations as placeholders.
-    Replace with real .cube LUT loading and 3D interpolation as needed.
     """
+    3D LUT colour grading.
 
-    def __init__(self) -> None:
-        self._luts = {
-            "cinematic": 1.1,
-            "vibrant": 1.2,
-            "matte": 0.9,
-        }
+    - Loads ``.cube``/``.3dl`` files from ``LUT_DIR`` once, at construction.
+    - Keeps parsed tables as float32 arrays and precompiled Pillow
+      ``Color3DLUT`` filters (C-level trilinear interpolation, no Python
+      per-pixel work).
+    - ``intensity`` is baked into the table as a blend toward identity, so
+      partial strength still costs a single pass over the pixels.
+    - Ordered stacks of LUTs/intensities are baked into a single table,
+      cached by stack signature, so a chain costs one interpolation pass.
+    - Large documents can be processed in row strips across a thread pool and
+      streamed out as PNG, with in-flight strips bounded by a memory budget.
+    """
+
+    BUILTIN_LOOKS = {
+        "cinematic": 1.1,
+        "vibrant": 1.2,
+        "matte": 0.9,
+    }
+
+    def __init__(
+        self,
+        lut_dir: Optional[str] = None,
+        workers: Optional[int] = None,
+        memory_budget_bytes: Optional[int] = None,
+    ) -> None:
+        self.lut_dir = lut_dir if lut_dir is not None else os.getenv("LUT_DIR", "/app/models/luts")
+        self.workers = workers or int(os.getenv("LUT_WORKERS", "0")) or (os.cpu_count() or 2)
+        if memory_budget_bytes is None:
+            memory_budget_bytes = int(os.getenv("LUT_MEMORY_BUDGET_MB", "256")) * 1024 * 1024
+        self.memory_budget_bytes = memory_budget_bytes
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._luts: Dict[str, LUT3D] = {}
+        self._filters: Dict[str, ImageFilter.Color3DLUT] = {}
+        self._blended = LRUCache(max_entries=64)
+        self._stacks = LRUCache(max_entries=32)
+        for name, factor in self.BUILTIN_LOOKS.items():
+            self.register(LUT3D(name=name, table=saturation_table(factor)))
+        self.load_directory(self.lut_dir)
+
+    # -----------------------------
+    # Registry
+    # -----------------------------
+    def load_directory(self, lut_dir: Optional[str]) -> int:
+        """Load every LUT file in ``lut_dir``; unreadable files are logged and skipped."""
+        if not lut_dir or not os.path.isdir(lut_dir):
+            return 0
+        loaded = 0
+        for path in sorted(Path(lut_dir).iterdir()):
+            if path.suffix.lower() not in LUT_EXTENSIONS:
+                continue
+            try:
+                self.register(load_lut_file(path))
+                loaded += 1
+            except Exception as e:
+                logger.warning("Skipping LUT %s: %s", path, e)
+        return loaded
+
+    def register(self, lut: LUT3D) -> None:
+        self._luts[lut.name] = lut
+        self._filters[lut.name] = self._compile(lut.table)
+        self._blended.clear()
+        self._stacks.clear()
 
     def list_luts(self) -> List[str]:
         return list(self._luts.keys())
 
+    def get_lut(self, lut_name: str) -> LUT3D:
+        try:
+            return self._luts[lut_name]
+        except KeyError:
+            raise KeyError(f"Unknown LUT: {lut_name}")
+
+    # -----------------------------
+    # Application
+    # -----------------------------
+    def get_filter(self, lut_name: str, intensity: float = 1.0) -> Optional[ImageFilter.Color3DLUT]:
+        """Compiled filter for ``lut_name`` at ``intensity``; None means identity."""
+        lut = self.get_lut(lut_name)
+        intensity = min(max(float(intensity), 0.0), 1.0)
+        if intensity <= 0.0:
+            return None
+        if intensity >= 1.0:
+            return self._filters[lut_name]
+        key = (lut_name, round(intensity, 3))
+        flt = self._blended.get(key)
+        if flt is None:
+            with stage("lut_compile"):
+                flt = self._compile(blend_table(lut.table, key[1]))
+            self._blended.put(key, flt)
+        return flt
+
+    def compose(self, stack: Sequence[Tuple[str, float]], size: Optional[int] = None) -> LUT3D:
+        """Bake an ordered stack of (lut_name, intensity) into one table.
+
+        An identity grid is pushed through each LUT in turn, blending toward
+        its input by the step's intensity. The grid uses the largest table
+        size in the stack (capped at Pillow's maximum of 65).
+        """
+        steps = self._stack_signature(stack)
+        luts = [self.get_lut(name) for name, _ in steps]
+        size = size or min(max([lut.size for lut in luts] + [2]), 65)
+        table = identity_table(size)
+        for lut, (_, intensity) in zip(luts, steps):
+            if intensity <= 0.0:
+                continue
+            graded = trilinear(lut.table, table)
+            table = graded if intensity >= 1.0 else table + np.float32(intensity) * (graded - table)
+        name = " > ".join(f"{n}@{i:g}" for n, i in steps)
+        return LUT3D(name=name, table=table)
+
+    def get_stack_filter(self, stack: Sequence[Tuple[str, float]]) -> Optional[ImageFilter.Color3DLUT]:
+        """Compiled filter for a baked stack; a single entry reuses the per-LUT filters."""
+        steps = self._stack_signature(stack)
+        if len(steps) == 1:
+            return self.get_filter(*steps[0])
+        flt = self._stacks.get(steps)
+        if flt is None:
+            with stage("lut_compile"):
+                flt = self._compile(self.compose(steps).table) if steps else None
+            if flt is not None:
+                self._stacks.put(steps, flt)
+        return flt
+
+    def apply_stack(self, img: Image.Image, stack: Sequence[Tuple[str, float]]) -> Image.Image:
+        return self.apply_filter(img, self.get_stack_filter(stack))
+
+    def apply_lut(self, img: Image.Image, lut_name: str, intensity: float = 1.0) -> Image.Image:
+        return self.apply_filter(img, self.get_filter(lut_name, intensity))
+
+    def apply_filter(self, img: Image.Image, flt: Optional[ImageFilter.Color3DLUT]) -> Image.Image:
+        with stage("lut_apply"):
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            if flt is None:
+                return img.copy()
+            return img.filter(flt)
+
+    def apply_lut_array(self, rgb: np.ndarray, lut_name: str, intensity: float = 1.0) -> np.ndarray:
+        """Apply to a float RGB array in [0, 1] (e.g. high bit-depth data) with NumPy trilinear."""
+        intensity = min(max(float(intensity), 0.0), 1.0)
+        return trilinear(blend_table(self.get_lut(lut_name).table, intensity), rgb)
+
     async def apply_lut_bytes(self, image_bytes: bytes, lut_name: str, intensity: float = 1.0) -> Image.Image:
-        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        factor = self._luts.get(lut_name, 1.0) * max(0.0, float(intensity))
-        enhancer = ImageEnhance.Color(img)
-        img = enhancer.enhance(factor)
-        return img
+        with stage("decode"):
+            img = (await run_codec(decode_image, image_bytes, "RGB")).image
+        return await asyncio.to_thread(self.apply_lut, img, lut_name, intensity)
+
+    def render_previews(
+        self,
+        img: Image.Image,
+        lut_names: Sequence[str],
+        max_size: int = 256,
+        intensity: float = 1.0,
+    ) -> List[Image.Image]:
+        """Downsample ``img`` once, then grade the thumbnail with each LUT in parallel."""
+        filters = [self.get_filter(name, intensity) for name in lut_names]
+        thumb = self.make_thumbnail(img, max_size)
+        return list(self._pool().map(lambda flt: self.apply_filter(thumb, flt), filters))
+
+    @staticmethod
+    def make_thumbnail(img: Image.Image, max_size: int) -> Image.Image:
+        # JPEG draft mode lets the decoder downscale by 1/2..1/8 instead of decoding full size
+        img.draft("RGB", (max_size, max_size))
+        thumb = img.convert("RGB")
+        thumb.thumbnail((max_size, max_size), resample=Image.Resampling.BILINEAR, reducing_gap=2.0)
+        return thumb
+
+    @staticmethod
+    def build_atlas(
+        previews: Sequence[Image.Image],
+        names: Sequence[str],
+        columns: Optional[int] = None,
+        gap: int = 0,
+    ) -> Tuple[Image.Image, List[Dict[str, object]]]:
+        """Tile previews into one contact sheet; returns the atlas and per-LUT offsets."""
+        if not previews:
+            return Image.new("RGB", (1, 1)), []
+        cols = min(max(1, columns or int(np.ceil(np.sqrt(len(previews))))), len(previews))
+        rows = int(np.ceil(len(previews) / cols))
+        cell_w = max(p.width for p in previews)
+        cell_h = max(p.height for p in previews)
+        atlas = Image.new("RGB", (cols * cell_w + (cols - 1) * gap, rows * cell_h + (rows - 1) * gap))
+        layout: List[Dict[str, object]] = []
+        for idx, (preview, name) in enumerate(zip(previews, names)):
+            x = (idx % cols) * (cell_w + gap)
+            y = (idx // cols) * (cell_h + gap)
+            atlas.paste(preview, (x, y))
+            layout.append({"name": name, "x": x, "y": y, "width": preview.width, "height": preview.height})
+        return atlas, layout
+
+    def iter_apply_png(
+        self,
+        img: Image.Image,
+        lut_name: str,
+        intensity: float = 1.0,
+        compress_level: int = 6,
+    ) -> Iterator[bytes]:
+        """Apply a LUT strip-by-strip and yield the PNG-encoded result incrementally.
+
+        Strips are graded and deflated on the worker pool; at most
+        ``workers + 1`` strips are in flight, sized so their buffers stay within
+        ``memory_budget_bytes``. The decoded source image is the only full-size
+        copy held.
+        """
+        flt = self.get_filter(lut_name, intensity)  # raise KeyError before streaming
+        return self.iter_filter_png(img, flt, compress_level)
+
+    def iter_filter_png(
+        self,
+        img: Image.Image,
+        flt: Optional[ImageFilter.Color3DLUT],
+        compress_level: int = 6,
+    ) -> Iterator[bytes]:
+        """Tiled/streamed counterpart of ``apply_filter`` (see ``iter_apply_png``).
+
+        Blocking: loads and converts the full image before returning, so call
+        it from a worker thread. Raises ValueError for a bad ``compress_level``
+        here rather than midway through the stream.
+        """
+        if not 0 <= int(compress_level) <= 9:
+            raise ValueError(f"compress_level must be 0-9, got {compress_level}")
+        # Lazily opened uploads must be decoded before strips are cropped from
+        # several threads at once; PIL's incremental loader is not thread-safe
+        img.load()
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return self._iter_strips_png(img, flt, int(compress_level))
+
+    def strip_height(self, width: int, height: int) -> int:
+        # Per in-flight strip: crop + graded copy + filtered rows + deflated output
+        per_row = width * 3 * 4
+        in_flight = self.workers + 1
+        rows = self.memory_budget_bytes // max(per_row * in_flight, 1)
+        return int(min(max(rows, 8), height))
+
+    # -----------------------------
+    # Internal
+    # -----------------------------
+    def _stack_signature(self, stack: Sequence[Tuple[str, float]]) -> Tuple[Tuple[str, float], ...]:
+        steps = []
+        for name, intensity in stack:
+            self.get_lut(name)
+            steps.append((name, round(min(max(float(intensity), 0.0), 1.0), 3)))
+        return tuple(steps)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="lut")
+        return self._executor
+
+    def _iter_strips_png(
+        self,
+        img: Image.Image,
+        flt: Optional[ImageFilter.Color3DLUT],
+        compress_level: int,
+    ) -> Iterator[bytes]:
+        width, height = img.size
+        step = self.strip_height(width, height)
+        pool = self._pool()
+
+        def encoded() -> Iterator[EncodedStrip]:
+            window: deque = deque()
+            for top in range(0, height, step):
+                window.append(pool.submit(self._encode_strip, img, flt, top, min(top + step, height), compress_level))
+                if len(window) > self.workers:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+
+        return iter_png(width, height, "RGB", encoded())
+
+    @staticmethod
+    def _encode_strip(
+        img: Image.Image,
+        flt: Optional[ImageFilter.Color3DLUT],
+        top: int,
+        bottom: int,
+        compress_level: int,
+    ) -> EncodedStrip:
+        strip = img.crop((0, top, img.width, bottom))
+        if flt is not None:
+            strip = strip.filter(flt)
+        return encode_strip(np.asarray(strip), compress_level)
+
+    @staticmethod
+    def _compile(table: np.ndarray) -> ImageFilter.Color3DLUT:
+        size = table.shape[0]
+        # Pillow expects r-fastest ordering, i.e. [b, g, r]
+        flat = np.ascontiguousarray(np.clip(table, 0.0, 1.0).transpose(2, 1, 0, 3)).reshape(-1)
+        return ImageFilter.Color3DLUT(size, flat, channels=3)
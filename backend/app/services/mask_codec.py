@@ -0,0 +1,141 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+
+Compact transport encodings for binary masks.
+
+- ``png``: base64 8-bit PNG (0/255), the original API format.
+- ``rle``: COCO run-length encoding, ``{"size": [h, w], "counts": str}``
+  with the compressed counts string used by pycocotools (column-major runs,
+  starting with background), so ``pycocotools.mask.decode`` reads it directly.
+- ``bits``: base64 of ``np.packbits`` over the row-major mask (8 pixels per byte).
+
+Masks are usually a small object on a large canvas, so ``crop_to_bbox``
+lets callers send only the bounding box region plus its offset.
+"""
+
+import io
+import base64
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+MASK_FORMATS = ("png", "rle", "bits")
+
+
+def mask_bbox(mask: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """COCO-style ``(x, y, width, height)`` of the set pixels, or None for an empty mask."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)
+
+
+# -----------------------------
+# COCO RLE
+# -----------------------------
+def rle_counts(mask: np.ndarray) -> np.ndarray:
+    """Run lengths over the column-major mask, the first run being background (possibly 0)."""
+    flat = np.asarray(mask, dtype=bool).ravel(order="F")
+    if flat.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], change, [flat.size])))
+    return np.concatenate(([0], counts)) if flat[0] else counts
+
+
+def _counts_to_string(counts: np.ndarray) -> str:
+    # pycocotools rleToString: delta against the run two back, 5 bits per char
+    out: List[str] = []
+    for i, value in enumerate(counts.tolist()):
+        x = value - counts[i - 2] if i > 2 else value
+        x = int(x)
+        more = True
+        while more:
+            c = x & 0x1F
+            x >>= 5
+            more = (x != -1) if (c & 0x10) else (x != 0)
+            if more:
+                c |= 0x20
+            out.append(chr(c + 48))
+    return "".join(out)
+
+
+def _string_to_counts(s: str) -> List[int]:
+    counts: List[int] = []
+    p = 0
+    while p < len(s):
+        x = k = 0
+        more = True
+        while more:
+            c = ord(s[p]) - 48
+            x |= (c & 0x1F) << (5 * k)
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
+
+
+def encode_rle(mask: np.ndarray) -> Dict[str, Any]:
+    return {"size": [int(mask.shape[0]), int(mask.shape[1])], "counts": _counts_to_string(rle_counts(mask))}
+
+
+def decode_rle(rle: Dict[str, Any]) -> np.ndarray:
+    h, w = rle["size"]
+    counts = rle["counts"]
+    counts = _string_to_counts(counts) if isinstance(counts, str) else list(counts)
+    values = np.arange(len(counts)) % 2 == 1
+    flat = np.repeat(values, counts)
+    return flat.reshape((w, h)).T.copy() if flat.size else np.zeros((h, w), dtype=bool)
+
+
+# -----------------------------
+# Bit-packed / PNG
+# -----------------------------
+def pack_bits(mask: np.ndarray) -> str:
+    return base64.b64encode(np.packbits(np.asarray(mask, dtype=bool), axis=None).tobytes()).decode("ascii")
+
+
+def unpack_bits(data: str, shape: Tuple[int, int]) -> np.ndarray:
+    bits = np.unpackbits(np.frombuffer(base64.b64decode(data), dtype=np.uint8), count=shape[0] * shape[1])
+    return bits.reshape(shape).astype(bool)
+
+
+def encode_png(mask: np.ndarray) -> str:
+    buf = io.BytesIO()
+    Image.fromarray((np.asarray(mask, dtype=bool) * 255).astype(np.uint8)).save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+def encode_mask(mask: np.ndarray, fmt: str = "png", crop_to_bbox: bool = False) -> Dict[str, Any]:
+    """
+    ``{"format", "size": [h, w], "bbox": [x, y, w, h] | None, "mask"}``;
+    with ``crop_to_bbox`` the encoded mask covers only ``bbox`` (empty for an empty mask).
+    """
+    if fmt not in MASK_FORMATS:
+        raise ValueError(f"Unsupported mask format {fmt!r}; choose from {', '.join(MASK_FORMATS)}")
+    bbox = mask_bbox(mask)
+    region = mask
+    if crop_to_bbox:
+        x, y, w, h = bbox or (0, 0, 0, 0)
+        region = mask[y:y + h, x:x + w]
+    if fmt == "rle":
+        data: Any = encode_rle(region)
+    elif fmt == "bits":
+        data = pack_bits(region)
+    else:
+        data = encode_png(region) if region.size else ""
+    return {
+        "format": fmt,
+        "size": [int(mask.shape[0]), int(mask.shape[1])],
+        "bbox": list(bbox) if bbox else None,
+        "cropped": bool(crop_to_bbox),
+        "mask": data,
+    }
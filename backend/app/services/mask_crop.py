@@ -0,0 +1,125 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+
+Crop-to-mask helpers for inpainting.
+
+Only the padded bounding box of the mask is sent through diffusion, resized
+to the model's native resolution, and the result is feather-blended back into
+the untouched original. Cost then scales with mask area, not document size.
+"""
+
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image, ImageFilter
+
+Box = Tuple[int, int, int, int]
+
+
+@dataclass
+class CropPlan:
+    box: Box  # region of the original image (left, top, right, bottom)
+    work_size: Tuple[int, int]  # size the region is diffused at
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.box[2] - self.box[0], self.box[3] - self.box[1]
+
+
+def _grow(lo: int, hi: int, target: int, limit: int) -> Tuple[int, int]:
+    """Widen [lo, hi) symmetrically to ``target`` pixels, shifted to stay inside [0, limit)."""
+    extra = target - (hi - lo)
+    if extra <= 0:
+        return lo, hi
+    lo -= extra // 2
+    hi += extra - extra // 2
+    if lo < 0:
+        hi, lo = hi - lo, 0
+    if hi > limit:
+        lo, hi = max(0, lo - (hi - limit)), limit
+    return lo, hi
+
+
+def fit_mask(mask: Image.Image, size: Tuple[int, int], tolerance: float = 0.01) -> Image.Image:
+    """
+    Bring ``mask`` to the image ``size``: crop boxes are planned in mask
+    coordinates and applied to the image, so the two must agree. A mask
+    exported at another resolution is rescaled; a different aspect ratio
+    (beyond ``tolerance``) is rejected with ValueError.
+    """
+    if mask.size == tuple(size):
+        return mask
+    (mw, mh), (w, h) = mask.size, size
+    if abs(mw / float(mh) - w / float(h)) > tolerance * (w / float(h)):
+        raise ValueError(f"mask size {mw}x{mh} does not match image size {w}x{h}")
+    return mask.resize((w, h), Image.Resampling.BILINEAR)
+
+
+def plan_mask_crop(
+    mask: Image.Image,
+    padding: int = 32,
+    native: int = 512,
+    multiple: int = 8,
+) -> Optional[CropPlan]:
+    """
+    Plan the region to diffuse for ``mask`` (white = repaint).
+
+    The bounding box is padded for context and grown to at least ``native``
+    pixels per side where the image allows (small regions gain context at no
+    extra cost). The work size keeps the aspect ratio with the long side at
+    ``native``, rounded to ``multiple``. Returns None for an empty mask.
+    """
+    bbox = mask.convert("L").getbbox()
+    if bbox is None:
+        return None
+    width, height = mask.size
+    left, top, right, bottom = bbox
+    left, top = max(0, left - padding), max(0, top - padding)
+    right, bottom = min(width, right + padding), min(height, bottom + padding)
+    left, right = _grow(left, right, min(native, width), width)
+    top, bottom = _grow(top, bottom, min(native, height), height)
+
+    work = native_work_size((right - left, bottom - top), native, multiple)
+    return CropPlan(box=(left, top, right, bottom), work_size=work)
+
+
+def native_work_size(size: Tuple[int, int], native: int = 512, multiple: int = 8) -> Tuple[int, int]:
+    """``size`` scaled so its long side is ``native``, each side rounded to ``multiple``."""
+    width, height = size
+    scale = native / float(max(width, height))
+    return (
+        max(multiple, int(round(width * scale / multiple)) * multiple),
+        max(multiple, int(round(height * scale / multiple)) * multiple),
+    )
+
+
+def crop_for_inpaint(image: Image.Image, mask: Image.Image, plan: CropPlan) -> Tuple[Image.Image, Image.Image]:
+    """Cut the planned region out of image and mask, resized to the work size."""
+    img = image.crop(plan.box).resize(plan.work_size, Image.Resampling.LANCZOS)
+    msk = mask.convert("L").crop(plan.box).resize(plan.work_size, Image.Resampling.BILINEAR)
+    return img, msk
+
+
+def feather(mask: Image.Image, radius: int) -> Image.Image:
+    """Grow the mask by ``radius`` and soften its edge, so the seam falls outside the repaint."""
+    mask = mask.convert("L")
+    if radius <= 0:
+        return mask
+    return mask.filter(ImageFilter.MaxFilter(2 * radius + 1)).filter(ImageFilter.GaussianBlur(radius / 2.0))
+
+
+def paste_inpainted(
+    original: Image.Image,
+    mask: Image.Image,
+    generated: Image.Image,
+    plan: CropPlan,
+    feather_radius: int = 8,
+) -> Image.Image:
+    """Blend the diffused region back into a copy of ``original`` through the feathered mask."""
+    region = generated.convert(original.mode).resize(plan.size, Image.Resampling.LANCZOS)
+    alpha = feather(mask.crop(plan.box), feather_radius)
+    base = original.crop(plan.box)
+    out = original.copy()
+    out.paste(Image.composite(region, base, alpha), plan.box[:2])
+    return out
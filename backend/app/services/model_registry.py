@@ -0,0 +1,269 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+"""
+
+import gc
+import os
+import sys
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from ..core.metrics import MODEL_LOAD_SECONDS, metrics, record_stage
+
+logger = logging.getLogger(__name__)
+
+_MODEL_RESIDENT = metrics.gauge("retouch_model_resident_bytes", "Parameter memory of each resident model.", ["model"])
+_MODEL_EVICTIONS = metrics.counter("retouch_model_evictions_total", "Models evicted by the registry.", ["model"])
+
+
+def module_bytes(module: Any) -> int:
+    """Parameter + buffer bytes of a torch module (0 for tokenizers, schedulers, None)."""
+    if module is None or not hasattr(module, "parameters"):
+        return 0
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        total += tensor.element_size() * tensor.nelement()
+    return total
+
+
+@dataclass
+class ModelEntry:
+    name: str
+    loader: Callable[[], Any]
+    unloader: Optional[Callable[[Any], None]] = None
+    estimate_bytes: int = 0
+    sizeof: Optional[Callable[[Any], int]] = None
+    value: Any = None
+    bytes: int = 0
+    in_use: int = 0
+    last_used: float = 0.0
+    load_seconds: Optional[float] = None
+    loads: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def resident(self) -> bool:
+        return self.value is not None
+
+
+class ModelRegistry:
+    """
+    Tracks loaded models against a memory budget.
+
+    - Models are registered with a loader (and optional unloader/size probe)
+      and loaded on first ``get``/``use``.
+    - Before a load, least-recently-used models that are not in use are
+      evicted until the estimated footprint fits ``budget_bytes``.
+    - Models idle for longer than ``idle_seconds`` are evicted by a
+      background sweeper; they reload transparently on next use.
+    """
+
+    def __init__(self, budget_bytes: Optional[int] = None, idle_seconds: Optional[float] = None) -> None:
+        self.budget_bytes = budget_bytes or None
+        self.idle_seconds = idle_seconds or None
+        self._entries: Dict[str, ModelEntry] = {}
+        self._lock = threading.RLock()
+        self._sweeper: Optional[threading.Thread] = None
+        self.evictions = 0
+
+    # -----------------------------
+    # Public API
+    # -----------------------------
+    def register(
+        self,
+        name: str,
+        loader: Callable[[], Any],
+        unloader: Optional[Callable[[Any], None]] = None,
+        estimate_bytes: int = 0,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ) -> None:
+        with self._lock:
+            if name in self._entries:
+                return
+            self._entries[name] = ModelEntry(
+                name=name,
+                loader=loader,
+                unloader=unloader,
+                estimate_bytes=int(estimate_bytes),
+                sizeof=sizeof,
+            )
+
+    def get(self, name: str) -> Any:
+        """Return the loaded model, loading (and evicting others) if needed."""
+        entry = self._entry(name)
+        with entry.lock:
+            if entry.value is None:
+                self._make_room(entry)
+                start = time.perf_counter()
+                value = entry.loader()
+                elapsed = time.perf_counter() - start
+                entry.load_seconds = round(elapsed, 3)
+                MODEL_LOAD_SECONDS.observe(elapsed, model=name)
+                record_stage("model_load", elapsed)
+                entry.loads += 1
+                entry.bytes = int(entry.sizeof(value)) if entry.sizeof else entry.estimate_bytes
+                entry.value = value
+            entry.last_used = time.monotonic()
+            value = entry.value
+        self._start_sweeper()
+        return value
+
+    @contextmanager
+    def use(self, *names: str) -> Iterator[List[Any]]:
+        """Load and pin models for the duration of the block (pinned models are never evicted)."""
+        pinned: List[ModelEntry] = []
+        try:
+            values = []
+            for name in names:
+                entry = self._entry(name)
+                with self._lock:
+                    entry.in_use += 1
+                pinned.append(entry)
+                values.append(self.get(name))
+            yield values
+        finally:
+            with self._lock:
+                for entry in pinned:
+                    entry.in_use -= 1
+                    entry.last_used = time.monotonic()
+
+    def is_resident(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return bool(entry and entry.resident)
+
+    def evict(self, name: str) -> bool:
+        entry = self._entry(name)
+        with self._lock:
+            if entry.value is None or entry.in_use:
+                return False
+            value, entry.value = entry.value, None
+            entry.bytes = 0
+            self.evictions += 1
+        _MODEL_EVICTIONS.inc(model=name)
+        if entry.unloader is not None:
+            try:
+                entry.unloader(value)
+            except Exception as e:
+                logger.warning("Unloader for %s failed: %s", name, e)
+        del value
+        self._release_memory()
+        logger.info("Evicted model %s", name)
+        return True
+
+    def sweep_idle(self) -> List[str]:
+        if not self.idle_seconds:
+            return []
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [e.name for e in self._entries.values() if e.resident and not e.in_use and e.last_used < cutoff]
+        return [name for name in idle if self.evict(name)]
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(e.bytes for e in self._entries.values() if e.resident)
+
+    def resident(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "name": e.name,
+                    "bytes": e.bytes,
+                    "in_use": e.in_use,
+                    "idle_seconds": round(now - e.last_used, 1),
+                    "load_seconds": e.load_seconds,
+                    "loads": e.loads,
+                }
+                for e in self._entries.values()
+                if e.resident
+            ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "budget_bytes": self.budget_bytes,
+            "idle_seconds": self.idle_seconds,
+            "resident_bytes": self.resident_bytes,
+            "evictions": self.evictions,
+            "models": self.resident(),
+        }
+
+    # -----------------------------
+    # Internal
+    # -----------------------------
+    def _entry(self, name: str) -> ModelEntry:
+        try:
+            return self._entries[name]
+        except KeyError:
+            raise KeyError(f"Model not registered: {name}")
+
+    def _make_room(self, incoming: ModelEntry) -> None:
+        if not self.budget_bytes:
+            return
+        while True:
+            with self._lock:
+                if self.resident_bytes + incoming.estimate_bytes <= self.budget_bytes:
+                    return
+                candidates = [
+                    e for e in self._entries.values()
+                    if e.resident and not e.in_use and e is not incoming
+                ]
+                if not candidates:
+                    logger.warning(
+                        "Loading %s exceeds model memory budget (%d + %d > %d bytes); nothing evictable",
+                        incoming.name, self.resident_bytes, incoming.estimate_bytes, self.budget_bytes,
+                    )
+                    return
+                victim = min(candidates, key=lambda e: e.last_used)
+            self.evict(victim.name)
+
+    def _release_memory(self) -> None:
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None:
+            try:
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except Exception:
+                pass
+
+    def _start_sweeper(self) -> None:
+        if not self.idle_seconds or self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="model-idle-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self) -> None:
+        interval = max(1.0, min(60.0, self.idle_seconds / 4.0))
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep_idle()
+            except Exception as e:
+                logger.warning("Idle model sweep failed: %s", e)
+
+
+_model_registry_singleton: Optional[ModelRegistry] = None
+
+def get_model_registry() -> ModelRegistry:
+    global _model_registry_singleton
+    if _model_registry_singleton is None:
+        _model_registry_singleton = ModelRegistry(
+            budget_bytes=int(os.getenv("MODEL_MEMORY_BUDGET_MB", "0")) * 1024 * 1024,
+            idle_seconds=float(os.getenv("MODEL_IDLE_SECONDS", "0")),
+        )
+        metrics.add_collector(_collect_model_memory)
+    return _model_registry_singleton
+
+
+def _collect_model_memory() -> None:
+    registry = get_model_registry()
+    for name, entry in list(registry._entries.items()):
+        _MODEL_RESIDENT.set(entry.bytes if entry.resident else 0, model=name)
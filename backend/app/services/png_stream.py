@@ -0,0 +1,104 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+
+Incremental PNG encoding.
+
+Strips of rows are filtered and deflated independently (raw deflate ending in
+a sync flush), so they can be encoded on worker threads and streamed out in
+order without ever holding the whole encoded file. The per-strip Adler-32
+checksums are folded together with ``adler32_combine``.
+"""
+
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_COLOR_TYPES = {"L": (0, 1), "RGB": (2, 3), "RGBA": (6, 4)}
+_ADLER_BASE = 65521
+
+
+@dataclass
+class EncodedStrip:
+    deflated: bytes
+    adler: int
+    length: int  # uncompressed (filtered) byte count
+
+
+def adler32_combine(adler1: int, adler2: int, len2: int) -> int:
+    """Checksum of A+B from the checksums of A and B (port of zlib's adler32_combine)."""
+    rem = len2 % _ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % _ADLER_BASE
+    sum1 += (adler2 & 0xFFFF) + _ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xFFFF) + ((adler2 >> 16) & 0xFFFF) + _ADLER_BASE - rem
+    if sum1 >= _ADLER_BASE:
+        sum1 -= _ADLER_BASE
+    if sum1 >= _ADLER_BASE:
+        sum1 -= _ADLER_BASE
+    if sum2 >= (_ADLER_BASE << 1):
+        sum2 -= (_ADLER_BASE << 1)
+    if sum2 >= _ADLER_BASE:
+        sum2 -= _ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def _chunk(tag: bytes, data: bytes) -> bytes:
+    crc = zlib.crc32(data, zlib.crc32(tag))
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", crc & 0xFFFFFFFF)
+
+
+def filter_rows(rows: np.ndarray) -> bytes:
+    """Apply the PNG ``Sub`` filter to uint8 rows of shape (h, w, channels)."""
+    h, w = rows.shape[:2]
+    bpp = rows.shape[2] if rows.ndim == 3 else 1
+    flat = rows.reshape(h, w * bpp)
+    out = np.empty((h, w * bpp + 1), dtype=np.uint8)
+    out[:, 0] = 1  # filter type: Sub
+    out[:, 1:bpp + 1] = flat[:, :bpp]
+    np.subtract(flat[:, bpp:], flat[:, :-bpp], out=out[:, bpp + 1:])
+    return out.tobytes()
+
+
+def encode_strip(rows: np.ndarray, compress_level: int = 6) -> EncodedStrip:
+    """Filter and deflate one strip; safe to call from worker threads."""
+    filtered = filter_rows(rows)
+    comp = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+    deflated = comp.compress(filtered) + comp.flush(zlib.Z_SYNC_FLUSH)
+    return EncodedStrip(deflated=deflated, adler=zlib.adler32(filtered), length=len(filtered))
+
+
+def iter_png(width: int, height: int, mode: str, strips: Iterable[EncodedStrip]) -> Iterator[bytes]:
+    """Yield a complete PNG file from in-order encoded strips."""
+    if mode not in _COLOR_TYPES:
+        raise ValueError(f"Unsupported PNG mode: {mode}")
+    color_type, _ = _COLOR_TYPES[mode]
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    yield PNG_SIGNATURE + _chunk(b"IHDR", ihdr)
+
+    adler = 1
+    pending = b"\x78\x9c"  # zlib stream header
+    for strip in strips:
+        adler = adler32_combine(adler, strip.adler, strip.length)
+        yield _chunk(b"IDAT", pending + strip.deflated)
+        pending = b""
+    tail = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15).flush()
+    yield _chunk(b"IDAT", pending + tail + struct.pack(">I", adler))
+    yield _chunk(b"IEND", b"")
+
+
+def iter_png_image(img, compress_level: int = 6, strip_rows: int = 256) -> Iterator[bytes]:
+    """Stream a PIL image as PNG, encoding ``strip_rows`` rows at a time."""
+    if img.mode not in _COLOR_TYPES:
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    arr = np.asarray(img)
+
+    def strips() -> Iterator[EncodedStrip]:
+        for top in range(0, img.height, strip_rows):
+            yield encode_strip(arr[top:top + strip_rows], compress_level)
+
+    return iter_png(img.width, img.height, img.mode, strips())
@@ -0,0 +1,223 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+"""
+
+import time
+import asyncio
+import logging
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from ..core.config import settings
+from ..core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MODEL_PENDING = "pending"
+MODEL_LOADING = "loading"
+MODEL_READY = "ready"
+MODEL_FAILED = "failed"
+MODEL_EVICTED = "evicted"  # was ready; the registry has since unloaded it (next use reloads it)
+
+# Names a preload plan may contain: the diffusion pipeline kinds plus SAM
+PRELOADABLE = ("txt2img", "img2img", "inpaint", "sam")
+
+_COLD_START = metrics.gauge("retouch_model_cold_start_seconds", "Background preload time per model.", ["model"])
+_READY = metrics.gauge("retouch_model_ready", "1 while a planned model is loaded.", ["model"])
+
+
+@dataclass
+class ModelReadiness:
+    name: str
+    state: str = MODEL_PENDING
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    cold_start_seconds: Optional[float] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    next_retry_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class Preloader:
+    """
+    Background preloading of a plan of models, with per-model readiness.
+
+    - ``start`` schedules every loader in worker threads and returns at once,
+      so the server accepts connections (and liveness probes) while weights load.
+    - Loaders run concurrently, at most ``concurrency`` at a time (0 = all).
+    - Each model moves pending -> loading -> ready | failed; cold-start time
+      is recorded per model. The instance is ready once every model is.
+    - ``resident`` probes (e.g. ``ModelRegistry.is_resident``) keep readiness
+      honest after startup: a ready model the registry has unloaded reports
+      ``evicted`` until a request loads it again. Evicted models are not
+      reloaded here, so the budget and idle sweeper keep working.
+    - Failed loads are retried after ``retry_seconds``, doubling per
+      consecutive failure up to ``max_retry_seconds`` (0 = never).
+    """
+
+    def __init__(
+        self,
+        plan: Dict[str, Callable[[], None]],
+        concurrency: int = 0,
+        resident: Optional[Dict[str, Callable[[], bool]]] = None,
+        retry_seconds: float = 0.0,
+        max_retry_seconds: float = 300.0,
+    ) -> None:
+        self._plan = dict(plan)
+        self._concurrency = max(0, int(concurrency))
+        self._resident = dict(resident or {})
+        self._retry_seconds = max(0.0, float(retry_seconds))
+        self._max_retry_seconds = max(self._retry_seconds, float(max_retry_seconds))
+        self.models: Dict[str, ModelReadiness] = {name: ModelReadiness(name) for name in self._plan}
+        self._task: Optional[asyncio.Task] = None
+        self._first_pass: Optional[asyncio.Event] = None
+        self._started_at: Optional[float] = None
+
+    # -----------------------------
+    # Public API
+    # -----------------------------
+    def start(self) -> None:
+        if self._task is None:
+            self._started_at = time.time()
+            self._first_pass = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run_all())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every model has had its first load attempt (tests/CLI); returns readiness."""
+        if self._first_pass is not None:
+            await asyncio.wait_for(self._first_pass.wait(), timeout)
+        return self.ready
+
+    @property
+    def ready(self) -> bool:
+        return all(self.model_ready(name) for name in self.models)
+
+    def model_ready(self, name: str) -> bool:
+        """Raises KeyError for models outside the plan."""
+        model = self.models[name]
+        if model.state in (MODEL_READY, MODEL_EVICTED):
+            resident = self._is_resident(name)  # a request may have loaded it back already
+            if resident != (model.state == MODEL_READY):
+                model.state = MODEL_READY if resident else MODEL_EVICTED
+                _READY.set(int(resident), model=name)
+                if not resident:
+                    logger.warning("Preloaded model %s was evicted; readiness cleared", name)
+        return model.state == MODEL_READY
+
+    def status(self) -> Dict[str, Any]:
+        ready = self.ready  # refreshes evicted models first
+        finished = [m.finished_at for m in self.models.values() if m.finished_at is not None]
+        done = len(finished) == len(self.models)
+        return {
+            "ready": ready,
+            "started_at": self._started_at,
+            "total_seconds": round(max(finished) - self._started_at, 3) if done and finished and self._started_at else None,
+            "models": {name: m.to_dict() for name, m in self.models.items()},
+        }
+
+    # -----------------------------
+    # Internal
+    # -----------------------------
+    def _is_resident(self, name: str) -> bool:
+        probe = self._resident.get(name)
+        if probe is None:
+            return True
+        try:
+            return bool(probe())
+        except Exception:
+            return False
+
+    async def _run_all(self) -> None:
+        limit = asyncio.Semaphore(self._concurrency or max(1, len(self._plan)))
+        remaining = [len(self._plan)]
+
+        def attempted() -> None:
+            remaining[0] -= 1
+            if remaining[0] <= 0:
+                self._first_pass.set()
+
+        if not self._plan:
+            self._first_pass.set()
+        await asyncio.gather(*(self._keep(name, loader, limit, attempted) for name, loader in self._plan.items()))
+
+    async def _keep(self, name: str, loader: Callable[[], None], limit: asyncio.Semaphore, attempted: Callable[[], None]) -> None:
+        """Load ``name``, retrying failed loads with exponential back-off."""
+        model = self.models[name]
+        delay = self._retry_seconds
+        loaded = await self._run(name, loader, limit)
+        attempted()
+        while not loaded and self._retry_seconds:
+            model.next_retry_at = time.time() + delay
+            await asyncio.sleep(delay)
+            model.next_retry_at = None
+            delay = min(delay * 2, self._max_retry_seconds)
+            loaded = await self._run(name, loader, limit)
+
+    async def _run(self, name: str, loader: Callable[[], None], limit: asyncio.Semaphore) -> bool:
+        model = self.models[name]
+        async with limit:
+            model.state = MODEL_LOADING
+            model.started_at = time.time()
+            model.attempts += 1
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(loader)
+            except Exception as e:
+                model.state = MODEL_FAILED
+                model.error = str(e)
+                logger.error("Preloading %s failed (attempt %d): %s", name, model.attempts, e)
+            else:
+                model.state = MODEL_READY
+                model.error = None
+                model.cold_start_seconds = round(time.perf_counter() - start, 3)
+                _COLD_START.set(model.cold_start_seconds, model=name)
+                logger.info("Preloaded %s in %.1fs", name, model.cold_start_seconds)
+            finally:
+                model.finished_at = time.time()
+                _READY.set(1 if model.state == MODEL_READY else 0, model=name)
+        return model.state == MODEL_READY
+
+
+def parse_plan(spec: str) -> List[str]:
+    names = [n.strip() for n in (spec or "").split(",") if n.strip()]
+    unknown = [n for n in names if n not in PRELOADABLE]
+    if unknown:
+        raise ValueError(f"Unknown PRELOAD_MODELS entries {unknown}; choose from {', '.join(PRELOADABLE)}")
+    return list(dict.fromkeys(names))
+
+
+_preloader_singleton: Optional[Preloader] = None
+
+def get_preloader() -> Preloader:
+    global _preloader_singleton
+    if _preloader_singleton is None:
+        from .ai_service import get_ai_service
+        from .sam_service import get_sam_service
+
+        ai = get_ai_service()
+        plan: Dict[str, Callable[[], None]] = {}
+        resident: Dict[str, Callable[[], bool]] = {}
+        for name in parse_plan(settings.PRELOAD_MODELS):
+            if name == "sam":
+                sam = get_sam_service()
+                plan[name] = sam.ensure_loaded
+                resident[name] = sam.is_loaded
+            else:
+                plan[name] = lambda kind=name: ai.preload(kind)
+                resident[name] = lambda kind=name: ai.is_loaded(kind)
+        _preloader_singleton = Preloader(
+            plan,
+            concurrency=settings.PRELOAD_CONCURRENCY,
+            resident=resident,
+            retry_seconds=settings.PRELOAD_RETRY_SECONDS,
+            max_retry_seconds=settings.PRELOAD_RETRY_MAX_SECONDS,
+        )
+    return _preloader_singleton
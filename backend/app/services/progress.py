@@ -0,0 +1,156 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+
+Step progress and cheap intermediate previews for diffusion runs.
+
+Previews are a linear projection of the 4-channel SD latents to RGB (no VAE
+decode), so they cost well under a millisecond per step at latent resolution.
+Their cost is measured against the step time anyway, and the preview
+interval backs off if it ever exceeds ``budget`` of a step.
+"""
+
+import io
+import json
+import time
+import base64
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Approximate SD 1.x latent -> RGB projection (rows: latent channels, cols: R, G, B)
+LATENT_RGB_FACTORS = np.array([
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+], dtype=np.float32)
+
+_DONE = object()
+
+
+def latents_to_rgb(latents: Any, max_size: int = 256) -> Image.Image:
+    """Project one latent (4, h, w) — or a batch of one — to a preview image."""
+    if hasattr(latents, "detach"):
+        latents = latents.detach().float().cpu().numpy()
+    lat = np.asarray(latents, dtype=np.float32)
+    if lat.ndim == 4:
+        lat = lat[0]
+    rgb = np.tensordot(lat, LATENT_RGB_FACTORS, axes=([0], [0]))  # (h, w, 3), roughly [-1, 1]
+    rgb = np.clip((rgb + 1.0) * 127.5, 0, 255).astype(np.uint8)
+    img = Image.fromarray(rgb)
+    scale = max_size / float(max(img.size))
+    if scale > 1.0:
+        img = img.resize((round(img.width * scale), round(img.height * scale)), Image.Resampling.BILINEAR)
+    return img
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ProgressReporter:
+    """
+    Collects step callbacks from a worker thread and hands them to an asyncio
+    consumer as ``(event, data)`` pairs: ``progress`` every step, ``preview``
+    every ``preview_every`` steps (base64 JPEG), plus anything passed to ``emit``.
+    """
+
+    def __init__(
+        self,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        preview_every: int = 5,
+        preview_size: int = 256,
+        budget: float = 0.05,
+    ) -> None:
+        self._loop = loop or asyncio.get_running_loop()
+        self._queue: "asyncio.Queue[Any]" = asyncio.Queue()
+        self._lock = threading.Lock()
+        self.preview_every = max(0, int(preview_every))  # 0 disables previews
+        self.preview_size = int(preview_size)
+        self.budget = float(budget)
+        self._started = time.perf_counter()
+        self._last_step_at: Optional[float] = None
+        self.steps = 0
+        self.step_seconds = 0.0
+        self.previews = 0
+        self.preview_seconds = 0.0
+
+    # Called from the pipeline thread
+    def step(self, step: int, total: Optional[int], latents: Any = None) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            if self._last_step_at is not None:
+                self.steps += 1
+                self.step_seconds += now - self._last_step_at
+            self._last_step_at = now
+        self.emit("progress", {
+            "step": step,
+            "total": total,
+            "elapsed_ms": round((now - self._started) * 1000.0, 1),
+        })
+        if latents is None or not self._preview_due(step, total):
+            return
+        start = time.perf_counter()
+        img = latents_to_rgb(latents, self.preview_size)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=70)
+        cost = time.perf_counter() - start
+        with self._lock:
+            self.previews += 1
+            self.preview_seconds += cost
+            self._back_off()
+        self.emit("preview", {
+            "step": step,
+            "image_base64": base64.b64encode(buf.getvalue()).decode("ascii"),
+            "media_type": "image/jpeg",
+            "preview_ms": round(cost * 1000.0, 2),
+        })
+        # Don't bill preview time to the next step
+        with self._lock:
+            self._last_step_at = time.perf_counter()
+
+    def emit(self, event: str, data: Dict[str, Any]) -> None:
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (event, data))
+
+    def close(self) -> None:
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, _DONE)
+
+    async def events(self) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        while True:
+            item = await self._queue.get()
+            if item is _DONE:
+                return
+            yield item
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            step_ms = (self.step_seconds / self.steps * 1000.0) if self.steps else None
+            preview_ms = (self.preview_seconds / self.previews * 1000.0) if self.previews else None
+            run = self.step_seconds + self.preview_seconds
+            return {
+                "previews": self.previews,
+                "preview_every": self.preview_every,
+                "avg_step_ms": round(step_ms, 2) if step_ms is not None else None,
+                "avg_preview_ms": round(preview_ms, 3) if preview_ms is not None else None,
+                "preview_overhead_pct": round(100.0 * self.preview_seconds / run, 3) if run else 0.0,
+            }
+
+    # -----------------------------
+    # Internal
+    # -----------------------------
+    def _preview_due(self, step: int, total: Optional[int]) -> bool:
+        if not self.preview_every or (total is not None and step >= total):
+            return False  # the final image follows right after the last step
+        return step % self.preview_every == 0
+
+    def _back_off(self) -> None:
+        if not self.steps or not self.previews:
+            return
+        step_avg = self.step_seconds / self.steps
+        preview_avg = self.preview_seconds / self.previews
+        if preview_avg > self.budget * step_avg * self.preview_every:
+            self.preview_every *= 2
@@ -0,0 +1,139 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+"""
+
+import io
+import json
+import struct
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+from .cache import DiskCache, LRUCache
+from .image_io import encode_image, normalize_format
+from .image_store import ImageSource, source_digest
+
+logger = logging.getLogger(__name__)
+
+# Bump when anything that changes outputs for identical inputs changes
+_KEY_VERSION = 1
+
+
+def result_key(
+    image: Optional[ImageSource],
+    mask: Optional[ImageSource],
+    prompt: str,
+    params: Dict[str, Any],
+) -> str:
+    """Content address of a deterministic request: input bytes, prompt and every parameter."""
+    h = hashlib.sha256()
+    h.update(json.dumps({"v": _KEY_VERSION, "prompt": prompt, "params": params}, sort_keys=True).encode("utf-8"))
+    for src in (image, mask):
+        h.update(b"\x00" if src is None else source_digest(src))
+    return h.hexdigest()
+
+
+@dataclass
+class CachedResult:
+    """An encoded result as served: response bytes plus metadata and the tier it came from."""
+
+    data: bytes
+    media_type: str
+    meta: Dict[str, Any]
+    tier: str
+
+
+def output_encoding(fmt: str, quality: int = 90, compress_level: int = 6) -> str:
+    """Identifier of an output encoding; only the parameter the format uses is part of it."""
+    name = normalize_format(fmt)
+    return f"png:{int(compress_level)}" if name == "png" else f"{name}:{int(quality)}"
+
+
+class ResultCache:
+    """
+    Two-tier cache of finished retouch results.
+
+    - Memory tier: the encoded response bytes per (key, output encoding) in
+      an LRU bounded by bytes, so a hit needs no encode at all.
+    - Disk tier: one lossless PNG plus metadata per key on the storage
+      volume, bounded by size on disk. PNG hits are served as stored; other
+      encodings are re-encoded once and promoted into memory.
+    """
+
+    def __init__(
+        self,
+        memory_bytes: int,
+        disk_dir: Optional[str] = None,
+        disk_bytes: Optional[int] = None,
+    ) -> None:
+        self._memory = LRUCache(max_bytes=memory_bytes, sizeof=lambda entry: len(entry[0]))
+        self._disk = DiskCache(disk_dir, max_bytes=disk_bytes) if disk_dir and disk_bytes else None
+
+    def get(self, key: str, encoding: str) -> Optional[CachedResult]:
+        """Look up ``key`` in ``encoding`` (see ``output_encoding``). Blocking: call from a worker thread."""
+        hit = self._memory.get((key, encoding))
+        if hit is not None:
+            return CachedResult(hit[0], hit[1], dict(hit[2]), "memory")
+        if self._disk is None:
+            return None
+        blob = self._disk.get(key)
+        if blob is None:
+            return None
+        (meta_len,) = struct.unpack(">I", blob[:4])
+        meta = json.loads(blob[4:4 + meta_len].decode("utf-8"))
+        png = blob[4 + meta_len:]
+        fmt, _, level = encoding.partition(":")
+        if fmt == "png":
+            data, media_type = png, "image/png"
+        else:
+            img = Image.open(io.BytesIO(png))
+            data, media_type = encode_image(img, fmt, quality=int(level))
+        self._memory.put((key, encoding), (data, media_type, meta))
+        return CachedResult(data, media_type, dict(meta), "disk")
+
+    def put(
+        self,
+        key: str,
+        encoding: str,
+        data: bytes,
+        media_type: str,
+        meta: Dict[str, Any],
+        image: Optional[Image.Image] = None,
+    ) -> None:
+        """
+        Store an encoded result. The disk tier keeps one PNG per key: ``data``
+        itself for PNG output, else ``image`` encoded losslessly. Blocking.
+        """
+        self._memory.put((key, encoding), (data, media_type, dict(meta)))
+        if self._disk is None or key in self._disk:
+            return
+        if media_type == "image/png":
+            png = data
+        elif image is not None:
+            buf = io.BytesIO()
+            image.save(buf, format="PNG", compress_level=1)
+            png = buf.getvalue()
+        else:
+            return
+        meta_json = json.dumps(meta).encode("utf-8")
+        try:
+            self._disk.put(key, struct.pack(">I", len(meta_json)) + meta_json + png)
+        except OSError as e:
+            logger.warning("Result cache disk write failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self._memory.stats()
+        disk = self._disk.stats() if self._disk is not None else None
+        lookups = memory["hits"] + memory["misses"]
+        hits = memory["hits"] + (disk["hits"] if disk else 0)
+        return {
+            "lookups": lookups,
+            "hits": hits,
+            "hit_rate": (hits / lookups) if lookups else 0.0,
+            "memory": memory,
+            "disk": disk,
+        }
@@ -0,0 +1,338 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+"""
+
+import os
+import time
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..core.config import settings
+from ..core.metrics import record_stage, stage
+from .cache import LRUCache
+from .image_store import ImageSource, decode_source, source_digest
+from .model_registry import ModelRegistry, get_model_registry, module_bytes
+from .stub_models import StubSamPredictor, stub_models_enabled
+
+# Approximate fp32 parameter footprints, used until the checkpoint is loaded
+_SAM_ESTIMATE_MB = {"vit_b": 375, "vit_l": 1250, "vit_h": 2560}
+_SAM_INPUT_SIDE = 1024
+
+
+@dataclass
+class SAMEmbedding:
+    """Image-encoder output plus the size metadata SamPredictor needs to decode masks."""
+
+    features: Any  # torch.Tensor, shape (1, C, H, W)
+    original_size: Tuple[int, int]
+    input_size: Tuple[int, int]
+    encode_seconds: float = 0.0
+
+    @property
+    def nbytes(self) -> int:
+        try:
+            return int(self.features.element_size() * self.features.nelement())
+        except AttributeError:
+            return int(getattr(self.features, "nbytes", 0))
+
+
+@dataclass
+class SAMPrompt:
+    """One SAM prompt: foreground/background points (labels 1/0), a box (x1, y1, x2, y2), or both."""
+
+    points: Optional[Sequence[Sequence[float]]] = None
+    labels: Optional[Sequence[int]] = None
+    box: Optional[Sequence[float]] = None
+
+    def point_arrays(self) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        if not self.points:
+            return None, None
+        labels = self.labels if self.labels is not None and len(self.labels) == len(self.points) else [1] * len(self.points)
+        return np.array(self.points, dtype=np.float32), np.array(labels, dtype=np.int64)
+
+    def box_array(self) -> Optional[np.ndarray]:
+        return None if self.box is None else np.array(self.box, dtype=np.float32)
+
+
+class SAMService:
+    """
+    Segment Anything wrapper.
+
+    - Lazy loads the SAM checkpoint on first use, through the model registry
+      (so it counts against the memory budget and can be evicted when idle).
+    - Caches image embeddings by content hash so repeated prompts on the same
+      document only run the mask decoder, not the ViT image encoder.
+    - Serialises access to the (stateful) SamPredictor.
+    - Refinement sessions keep the best candidate's low-res logits from the
+      previous click and feed them back as ``mask_input``, so SAM refines the
+      current mask instead of starting over from the points alone.
+    """
+
+    def __init__(
+        self,
+        checkpoint: Optional[str] = None,
+        model_type: Optional[str] = None,
+        cache_bytes: Optional[int] = None,
+        registry: Optional[ModelRegistry] = None,
+    ) -> None:
+        self.checkpoint = checkpoint or os.getenv("SAM_MODEL_PATH", settings.SAM_MODEL_PATH)
+        self.model_type = model_type or os.getenv("SAM_MODEL_TYPE", settings.SAM_MODEL_TYPE)
+        if cache_bytes is None:
+            cache_bytes = settings.SAM_EMBEDDING_CACHE_MB * 1024 * 1024
+        self.device = "cpu"  # where the loaded predictor runs (admission control key); set by ensure_loaded
+        self._lock = threading.Lock()
+        self._embeddings = LRUCache(max_bytes=cache_bytes, sizeof=lambda e: e.nbytes)
+        self._sessions = LRUCache(max_entries=settings.SAM_MAX_SESSIONS)  # id -> (embedding key, 1x256x256 logits)
+        self._encoder_seconds_saved = 0.0
+        self._registry = registry or get_model_registry()
+        self._registry.register(
+            self.model_key,
+            loader=self._load_predictor,
+            estimate_bytes=_SAM_ESTIMATE_MB.get(self.model_type, 2560) * 1024 * 1024,
+            sizeof=lambda predictor: module_bytes(getattr(predictor, "model", None)),
+        )
+
+    @property
+    def model_key(self) -> str:
+        return f"sam:{self.model_type}"
+
+    # -----------------------------
+    # Public API
+    # -----------------------------
+    def ensure_loaded(self) -> str:
+        """Load (or reload after eviction) the predictor; returns the device it runs on."""
+        predictor = self._registry.get(self.model_key)
+        # SamPredictor.device is a torch.device; the stub predictor has none (CPU)
+        self.device = getattr(getattr(predictor, "device", None), "type", "cpu")
+        return self.device
+
+    def is_loaded(self) -> bool:
+        return self._registry.is_resident(self.model_key)
+
+    def segment_points(
+        self,
+        image: ImageSource,
+        points: Sequence[Sequence[float]],
+        labels: Sequence[int],
+        multimask_output: bool = True,
+        session_id: Optional[str] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Run SAM with point prompts. Returns (masks, scores, low-res logits)."""
+        return self.segment(image, SAMPrompt(points, labels), multimask_output, session_id)
+
+    def segment(
+        self,
+        image: ImageSource,
+        prompt: "SAMPrompt",
+        multimask_output: bool = True,
+        session_id: Optional[str] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Run SAM with one prompt (points and/or box). Returns (masks, scores, low-res logits).
+
+        With ``session_id``, the previous call's best logits for the same image
+        are passed as ``mask_input`` and this call's best logits replace them.
+        """
+        coords, labels = prompt.point_arrays()
+        extra: Dict[str, Any] = {} if prompt.box is None else {"box": prompt.box_array()}
+        with self._registry.use(self.model_key) as (predictor,), self._lock:
+            key = self._set_image(predictor, image)
+            previous = self._sessions.get(session_id) if session_id else None
+            if previous is not None and previous[0] == key:
+                extra["mask_input"] = previous[1]
+            with stage("sam_predict"):
+                masks, scores, logits = predictor.predict(
+                    point_coords=coords,
+                    point_labels=labels,
+                    multimask_output=bool(multimask_output),
+                    **extra,
+                )
+            if session_id:
+                best = int(np.argmax(scores))
+                self._sessions.put(session_id, (key, np.array(logits[best:best + 1], dtype=np.float32)))
+        return masks, scores, logits
+
+    def end_session(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id) is not None
+
+    def segment_batch(
+        self,
+        image: ImageSource,
+        prompts: Sequence["SAMPrompt"],
+        multimask_output: bool = False,
+    ) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Run many prompts against one image embedding: one encoder run, then the
+        mask decoder once per prompt shape as a single batched tensor pass.
+        Point groups are padded with label -1 (ignored by SAM's prompt encoder);
+        since boxes must be given for every row of a pass or none, prompts with
+        and without boxes go in separate passes. Returns (masks, scores, logits)
+        per prompt, in order.
+        """
+        groups: Dict[Tuple[bool, bool], List[int]] = {}
+        for i, prompt in enumerate(prompts):
+            groups.setdefault((bool(prompt.points), prompt.box is not None), []).append(i)
+        results: List[Any] = [None] * len(prompts)
+        with self._registry.use(self.model_key) as (predictor,), self._lock:
+            self._set_image(predictor, image)
+            with stage("sam_predict"):
+                for (has_points, has_box), rows in groups.items():
+                    coords = labels = boxes = None
+                    if has_points:
+                        width = max(len(prompts[i].points) for i in rows)
+                        coords = np.zeros((len(rows), width, 2), dtype=np.float32)
+                        labels = np.full((len(rows), width), -1, dtype=np.int64)
+                        for row, i in enumerate(rows):
+                            pts, lbs = prompts[i].point_arrays()
+                            coords[row, :len(pts)] = pts
+                            labels[row, :len(lbs)] = lbs
+                    if has_box:
+                        boxes = np.stack([prompts[i].box_array() for i in rows])
+                    masks, scores, logits = self._predict_batch(predictor, coords, labels, boxes, bool(multimask_output))
+                    for row, i in enumerate(rows):
+                        results[i] = (masks[row], scores[row], logits[row])
+        return results
+
+    def cache_stats(self) -> Dict[str, Any]:
+        stats = self._embeddings.stats()
+        stats["encoder_seconds_saved"] = round(self._encoder_seconds_saved, 4)
+        stats["sessions"] = self._sessions.stats()["entries"]
+        return stats
+
+    # -----------------------------
+    # Internal
+    # -----------------------------
+    def _load_predictor(self):
+        if stub_models_enabled():
+            return StubSamPredictor()
+        try:
+            from segment_anything import sam_model_registry, SamPredictor  # type: ignore
+            import torch
+
+            if not os.path.exists(self.checkpoint):
+                raise RuntimeError(f"SAM checkpoint not found at {self.checkpoint}")
+
+            sam = sam_model_registry[self.model_type](checkpoint=None)
+            sam.load_state_dict(self._load_state_dict(torch))
+            # Move to device if CUDA available
+            try:
+                if torch.cuda.is_available():
+                    sam.to("cuda")
+            except Exception:
+                pass
+            return SamPredictor(sam)
+        except Exception as e:
+            raise RuntimeError(f"Failed to load SAM: {e}")
+
+    def _load_state_dict(self, torch):
+        # Memory-map the checkpoint: tensors are paged in from the file as they
+        # are copied into the model instead of first being read into a buffer
+        try:
+            return torch.load(self.checkpoint, map_location="cpu", mmap=True, weights_only=True)
+        except (TypeError, RuntimeError):
+            # torch < 2.1, or a legacy (non-zip) checkpoint that cannot be mapped
+            with open(self.checkpoint, "rb") as f:
+                return torch.load(f, map_location="cpu")
+
+    @staticmethod
+    def _predict_batch(predictor, coords, labels, boxes, multimask_output: bool):
+        if hasattr(predictor, "predict_batch"):
+            return predictor.predict_batch(coords, labels, boxes, multimask_output=multimask_output)
+        import torch
+
+        # SamPredictor.predict_torch wants prompts already mapped to the encoder's input frame
+        size = predictor.original_size
+        kwargs: Dict[str, Any] = {"point_coords": None, "point_labels": None}
+        if coords is not None:
+            kwargs["point_coords"] = torch.as_tensor(
+                predictor.transform.apply_coords(coords, size), dtype=torch.float, device=predictor.device,
+            )
+            kwargs["point_labels"] = torch.as_tensor(labels, dtype=torch.int, device=predictor.device)
+        if boxes is not None:
+            kwargs["boxes"] = torch.as_tensor(
+                predictor.transform.apply_boxes(boxes, size), dtype=torch.float, device=predictor.device,
+            )
+        model = predictor.model
+        with torch.inference_mode():
+            # Same steps as predict_torch, but the decoder's low-res logits are upsampled
+            # to the upload size a few prompts at a time: all B x C full-size float masks
+            # at once can exceed device memory for a large image
+            points = (kwargs["point_coords"], kwargs["point_labels"]) if coords is not None else None
+            sparse, dense = model.prompt_encoder(points=points, boxes=kwargs.get("boxes"), masks=None)
+            logits, scores = model.mask_decoder(
+                image_embeddings=predictor.features,
+                image_pe=model.prompt_encoder.get_dense_pe(),
+                sparse_prompt_embeddings=sparse,
+                dense_prompt_embeddings=dense,
+                multimask_output=multimask_output,
+            )
+            batch, channels = logits.shape[:2]
+            height, width = predictor.original_size
+            side = predictor.transform.target_length
+            # postprocess_masks holds a side x side and a full-size float map per mask
+            per_prompt = channels * (side * side + height * width)
+            chunk = max(1, int(settings.SAM_UPSAMPLE_BUDGET_MP * 1_000_000) // per_prompt)
+            masks = np.empty((batch, channels, height, width), dtype=bool)
+            for start in range(0, batch, chunk):
+                upsampled = model.postprocess_masks(logits[start:start + chunk], predictor.input_size, predictor.original_size)
+                masks[start:start + chunk] = (upsampled > model.mask_threshold).cpu().numpy()
+                del upsampled
+        return masks, scores.float().cpu().numpy(), logits.float().cpu().numpy()
+
+    def _embedding_key(self, image: ImageSource) -> str:
+        return f"{self.model_type}:{source_digest(image).hex()}"
+
+    def _set_image(self, predictor, image: ImageSource) -> str:
+        """Point the predictor at ``image``, reusing a cached embedding if present. Returns its key."""
+        key = self._embedding_key(image)
+        cached: Optional[SAMEmbedding] = self._embeddings.get(key)
+        if cached is not None:
+            self._restore(predictor, cached)
+            self._encoder_seconds_saved += cached.encode_seconds
+            return key
+
+        # The encoder only sees the image resized to its input side (1024), so
+        # decode at that size; masks and point prompts stay in upload coordinates
+        side = getattr(getattr(predictor, "transform", None), "target_length", _SAM_INPUT_SIDE)
+        with stage("decode"):
+            decoded = decode_source(image, "RGB", max_side=side)
+            np_img = np.array(decoded.image)
+        start = time.perf_counter()
+        predictor.set_image(np_img)
+        elapsed = time.perf_counter() - start
+        if decoded.scale != 1.0:
+            width, height = decoded.original_size
+            predictor.original_size = (height, width)
+            predictor.orig_h, predictor.orig_w = height, width
+        record_stage("sam_encode", elapsed)
+        self._embeddings.put(key, SAMEmbedding(
+            features=predictor.features,
+            original_size=tuple(predictor.original_size),
+            input_size=tuple(predictor.input_size),
+            encode_seconds=elapsed,
+        ))
+        return key
+
+    @staticmethod
+    def _restore(p, emb: SAMEmbedding) -> None:
+        """Load cached encoder state into the predictor (mirrors SamPredictor.set_torch_image)."""
+        p.reset_image()
+        p.features = emb.features
+        p.original_size = emb.original_size
+        p.input_size = emb.input_size
+        p.orig_h, p.orig_w = emb.original_size
+        p.input_h, p.input_w = emb.input_size
+        p.is_image_set = True
+
+
+_sam_service_singleton: Optional[SAMService] = None
+
+def get_sam_service() -> SAMService:
+    global _sam_service_singleton
+    if _sam_service_singleton is None:
+        _sam_service_singleton = SAMService()
+    return _sam_service_singleton
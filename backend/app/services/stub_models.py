@@ -0,0 +1,159 @@
+"""
+Copyright (c) 2025 AI Retouch Studio Contributors
+SPDX-License-Identifier: Apache-2.0
+
+Cheap, deterministic stand-ins for the diffusion and SAM models.
+
+Selected with ``AI_STUB_MODELS=1`` so the API can be benchmarked and
+load-tested offline on CPU: everything around the models (decode, batching,
+caches, encoding, endpoints) runs for real, while "inference" costs only
+``AI_STUB_STEP_MS`` per denoising step (default 0).
+"""
+
+import os
+import time
+import hashlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from ..core.metrics import stage
+from .diffusion_processor import DiffusionProcessor, StepCallback
+
+
+def stub_models_enabled() -> bool:
+    return os.getenv("AI_STUB_MODELS", "").lower() in ("1", "true", "yes")
+
+
+def _prompt_color(prompt: str, seed: Optional[int]) -> Tuple[int, int, int]:
+    digest = hashlib.sha256(f"{prompt}:{seed}".encode("utf-8")).digest()
+    return digest[0], digest[1], digest[2]
+
+
+class StubDiffusionProcessor(DiffusionProcessor):
+    """
+    DiffusionProcessor whose pipelines are replaced by colour washes.
+
+    Batch methods keep the real signatures, so step callbacks and timings
+    reach callers exactly as with real pipelines.
+    """
+
+    def __init__(self, cfg, registry=None) -> None:
+        super().__init__(cfg, registry=registry)
+        self.step_seconds = float(os.getenv("AI_STUB_STEP_MS", "0")) / 1000.0
+
+    def preload(self, kind: str) -> None:
+        return None
+
+    def is_loaded(self, kind: str) -> bool:
+        return True
+
+    def generate_txt2img_batch(self, prompts: List[str], guidance_scale: float, steps: int, seeds: List[Optional[int]], callback: Optional[StepCallback] = None, timings: Optional[List[Dict[str, float]]] = None) -> List[Image.Image]:
+        size = (self._native_size(), self._native_size())
+        self._denoise(len(prompts), size, steps, callback, timings)
+        return [Image.new("RGB", size, _prompt_color(p, s)) for p, s in zip(prompts, seeds)]
+
+    def img2img_batch(self, prompts: List[str], init_images: List[Image.Image], strength: float, guidance_scale: float, steps: int, seeds: List[Optional[int]], callback: Optional[StepCallback] = None, timings: Optional[List[Dict[str, float]]] = None) -> List[Image.Image]:
+        self._denoise(len(prompts), init_images[0].size, int(steps * strength), callback, timings)
+        return [
+            Image.blend(img.convert("RGB"), Image.new("RGB", img.size, _prompt_color(p, s)), 0.5 * float(strength))
+            for p, img, s in zip(prompts, init_images, seeds)
+        ]
+
+    def inpaint_batch(self, prompts: List[str], init_images: List[Image.Image], mask_images: List[Image.Image], guidance_scale: float, steps: int, seeds: List[Optional[int]], callback: Optional[StepCallback] = None, timings: Optional[List[Dict[str, float]]] = None) -> List[Image.Image]:
+        self._denoise(len(prompts), init_images[0].size, steps, callback, timings)
+        return [
+            Image.composite(Image.new("RGB", img.size, _prompt_color(p, s)), img.convert("RGB"), mask.convert("L"))
+            for p, img, mask, s in zip(prompts, init_images, mask_images, seeds)
+        ]
+
+    def _native_size(self) -> int:
+        return int(os.getenv("SD_NATIVE_RESOLUTION", "512"))
+
+    def _denoise(self, n: int, size: Tuple[int, int], steps: int, callback: Optional[StepCallback], timings) -> None:
+        latents = np.zeros((n, 4, max(1, size[1] // 8), max(1, size[0] // 8)), dtype=np.float32)
+        with stage("denoise"):
+            for step in range(1, steps + 1):
+                if self.step_seconds:
+                    time.sleep(self.step_seconds)
+                if callback is not None:
+                    callback(step, steps, latents)
+        if timings is not None:
+            timings.extend({} for _ in range(n))
+
+
+class StubSamPredictor:
+    """
+    SamPredictor look-alike: ``set_image`` stores a small fake embedding and
+    ``predict`` returns discs of three sizes around the foreground points.
+    """
+
+    model = None
+
+    def __init__(self) -> None:
+        self.reset_image()
+
+    def reset_image(self) -> None:
+        self.features: Any = None
+        self.original_size: Optional[Tuple[int, int]] = None
+        self.input_size: Optional[Tuple[int, int]] = None
+        self.orig_h = self.orig_w = self.input_h = self.input_w = None
+        self.is_image_set = False
+
+    def set_image(self, image: np.ndarray) -> None:
+        h, w = image.shape[:2]
+        scale = 1024.0 / max(h, w)
+        self.features = np.zeros((1, 256, 64, 64), dtype=np.float32)
+        self.original_size = (h, w)
+        self.input_size = (int(h * scale + 0.5), int(w * scale + 0.5))
+        self.orig_h, self.orig_w = self.original_size
+        self.input_h, self.input_w = self.input_size
+        self.is_image_set = True
+
+    def predict(
+        self,
+        point_coords: Optional[np.ndarray] = None,
+        point_labels: Optional[np.ndarray] = None,
+        box: Optional[Sequence[float]] = None,
+        mask_input: Optional[np.ndarray] = None,
+        multimask_output: bool = True,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if not self.is_image_set:
+            raise RuntimeError("An image must be set with .set_image(...) before mask prediction.")
+        h, w = self.original_size
+        radii = (0.05, 0.1, 0.2) if multimask_output else (0.1,)
+        masks = []
+        for frac in radii:
+            r = frac * max(h, w)
+            canvas = Image.new("L", (w, h))
+            draw = ImageDraw.Draw(canvas)
+            coords = point_coords if point_coords is not None else np.zeros((0, 2))
+            labels = point_labels if point_labels is not None else np.ones(len(coords))
+            for (x, y), label in zip(coords, labels):
+                if label == 1:
+                    draw.ellipse((x - r, y - r, x + r, y + r), fill=255)
+            if box is not None:
+                draw.rectangle(tuple(float(v) for v in box), fill=255)
+            masks.append(np.asarray(canvas) > 0)
+        scores = np.linspace(0.9, 0.7, len(masks)).astype(np.float32)
+        logits = np.zeros((len(masks), 256, 256), dtype=np.float32)
+        return np.stack(masks), scores, logits
+
+    def predict_batch(
+        self,
+        point_coords: Optional[np.ndarray],
+        point_labels: Optional[np.ndarray],
+        boxes: Optional[np.ndarray],
+        multimask_output: bool = True,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Numpy counterpart of ``SamPredictor.predict_torch``: B padded prompts (label -1 = padding)."""
+        n = len(boxes) if boxes is not None else len(point_coords)
+        rows = []
+        for i in range(n):
+            coords = labels = None
+            if point_coords is not None:
+                keep = point_labels[i] != -1
+                coords, labels = point_coords[i][keep], point_labels[i][keep]
+            rows.append(self.predict(coords, labels, None if boxes is None else boxes[i], multimask_output=multimask_output))
+        return tuple(np.stack(parts) for parts in zip(*rows))
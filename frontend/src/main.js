@@ -2,6 +2,52 @@ import { readActiveDocumentAsPNG, placeImageFromBytes } from './photoshop-bridge
 
 const BACKEND_URL = (window.BACKEND_URL || 'http://localhost:8000') + '/api/v1';
 
+// Upload-once document handles: the backend keeps each uploaded document
+// (keyed by its SHA-256) so repeated SAM clicks, retouch runs and LUT applies
+// send a 64-char id instead of the whole document.
+const knownImageIds = new Set();
+// Without WebCrypto (some UXP hosts lack crypto.subtle) ids come from the
+// upload response instead, remembered per buffer so a reused buffer skips it.
+const uploadedIds = new WeakMap();
+
+// SHA-256 of `bytes` as hex, or null when crypto.subtle is unavailable.
+async function sha256Hex(bytes) {
+  const subtle = globalThis.crypto && globalThis.crypto.subtle;
+  if (!subtle) return null;
+  const digest = await subtle.digest('SHA-256', bytes);
+  return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function uploadImage(bytes) {
+  const form = new FormData();
+  form.append('image', new Blob([bytes], { type: 'image/png' }), 'document.png');
+  const res = await fetch(`${BACKEND_URL}/images`, { method: 'POST', body: form });
+  if (!res.ok) throw new Error(`Image upload failed: ${res.status} - ${await res.text()}`);
+  const { image_id } = await res.json();
+  knownImageIds.add(image_id);
+  uploadedIds.set(bytes, image_id);
+  return image_id;
+}
+
+// POST `fields` plus `image_id` for `bytes`, uploading the document first if the
+// server has not seen it (or has expired it: 404 -> upload again and retry once).
+async function postWithImage(path, bytes, fields, init = {}) {
+  const send = (imageId) => {
+    const form = new FormData();
+    Object.entries(fields).forEach(([k, v]) => form.append(k, v));
+    form.append('image_id', imageId);
+    return fetch(`${BACKEND_URL}${path}`, { method: 'POST', body: form, ...init });
+  };
+  let imageId = (await sha256Hex(bytes)) ?? uploadedIds.get(bytes);
+  if (!imageId || !knownImageIds.has(imageId)) imageId = await uploadImage(bytes);
+  let res = await send(imageId);
+  if (res.status === 404) {
+    knownImageIds.delete(imageId);
+    res = await send(await uploadImage(bytes));
+  }
+  return res;
+}
+
 async function runRetouch() {
   const prompt = document.getElementById('prompt').value || '';
   const img = await readActiveDocumentAsPNG();
@@ -12,30 +58,25 @@ async function runRetouch() {
     return;
   }
 
-  const form = new FormData();
-  form.append('prompt', prompt);
-  form.append('operation', 'img2img');
-  form.append('image', new Blob([img], { type: 'image/png' }), 'document.png');
-
   output.textContent = 'Processing...';
   try {
-    const res = await fetch(`${BACKEND_URL}/retouch/process`, { method: 'POST', body: form });
+    // Ask for raw PNG bytes (no base64 round-trip); metadata arrives in X-Retouch-Meta
+    const res = await postWithImage('/retouch/process', img, { prompt, operation: 'img2img' }, {
+      headers: { Accept: 'image/png' },
+    });
     if (!res.ok) throw new Error(await res.text());
-    const data = await res.json();
-    if (data.image_base64) {
-      const imgEl = new Image();
-      imgEl.src = `data:image/png;base64,${data.image_base64}`;
-      output.innerHTML = '';
-      output.appendChild(imgEl);
-      // Place result back into Photoshop as a new layer
-      try {
-        const bytes = Uint8Array.from(atob(data.image_base64), c => c.charCodeAt(0));
-        await placeImageFromBytes(bytes, `AI Edit: ${prompt}`);
-      } catch (e) {
-        console.warn('Placement to Photoshop failed or unavailable:', e);
-      }
-    } else {
-      output.textContent = JSON.stringify(data, null, 2);
+    const bytes = new Uint8Array(await res.arrayBuffer());
+    const meta = JSON.parse(res.headers.get('X-Retouch-Meta') || '{}');
+    const imgEl = new Image();
+    imgEl.src = URL.createObjectURL(new Blob([bytes], { type: 'image/png' }));
+    imgEl.title = JSON.stringify(meta);
+    output.innerHTML = '';
+    output.appendChild(imgEl);
+    // Place result back into Photoshop as a new layer
+    try {
+      await placeImageFromBytes(bytes, `AI Edit: ${prompt}`);
+    } catch (e) {
+      console.warn('Placement to Photoshop failed or unavailable:', e);
     }
   } catch (e) {
     output.textContent = 'Error: ' + (e?.message || e);
@@ -52,6 +93,8 @@ window.addEventListener('DOMContentLoaded', () => {
 // -----------------------------
 let samPoints = [];
 let samLabels = [];
+// Refinement session: each Create Mask after more clicks refines the last mask
+let samSessionId = null;
 
 function setupSAMControls() {
   const tools = document.querySelector('.ai-tools');
@@ -127,23 +170,21 @@ async function createSAMMask() {
     const imageBytes = await readActiveDocumentAsPNG();
     if (!imageBytes) throw new Error('No active document in Photoshop');
 
-    const formData = new FormData();
-    const blob = new Blob([imageBytes], { type: 'image/png' });
-    formData.append('image', blob, 'document.png');
-    formData.append('points', JSON.stringify(samPoints));
-    formData.append('labels', JSON.stringify(samLabels));
-
-    const res = await fetch(`${BACKEND_URL}/segmentation/segment-from-points`, { method: 'POST', body: formData });
+    const res = await postWithImage('/segmentation/segment-from-points', imageBytes, {
+      points: JSON.stringify(samPoints),
+      labels: JSON.stringify(samLabels),
+      session_id: samSessionId || 'new',
+    });
     if (!res.ok) {
       const text = await res.text();
       throw new Error(`SAM request failed: ${res.status} - ${text}`);
     }
     const result = await res.json();
+    samSessionId = result.session_id || null;
 
     const maskBytes = Uint8Array.from(atob(result.mask), c => c.charCodeAt(0));
     await placeImageFromBytes(maskBytes, `SAM Mask (${samPoints.length} points)`);
-    updateSAMStatus(`✅ Mask created! Confidence: ${(result.score * 100).toFixed(1)}%`);
-    clearSAMPoints();
+    updateSAMStatus(`✅ Mask created! Confidence: ${(result.score * 100).toFixed(1)}% - add points to refine, or clear`);
   } catch (e) {
     console.error('SAM mask creation failed:', e);
     updateSAMStatus(`❌ Mask creation failed: ${e.message || e}`);
@@ -177,6 +218,7 @@ function updateSAMPointsList() {
 function clearSAMPoints() {
   samPoints = [];
   samLabels = [];
+  samSessionId = null;
   updateSAMStatus('Points cleared. Ready for new points.');
   updateSAMPointsList();
   updateSAMButtons(false);
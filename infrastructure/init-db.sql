@@ -5,3 +5,14 @@ CREATE TABLE IF NOT EXISTS retouch_jobs (
   prompt TEXT,
   status TEXT NOT NULL DEFAULT 'created'
 );
+
+-- Job queue lifecycle and timings (see backend/app/services/job_queue.py)
+ALTER TABLE retouch_jobs ADD COLUMN IF NOT EXISTS job_id TEXT UNIQUE;
+ALTER TABLE retouch_jobs ADD COLUMN IF NOT EXISTS operation TEXT;
+ALTER TABLE retouch_jobs ADD COLUMN IF NOT EXISTS params JSONB;
+ALTER TABLE retouch_jobs ADD COLUMN IF NOT EXISTS started_at TIMESTAMP;
+ALTER TABLE retouch_jobs ADD COLUMN IF NOT EXISTS finished_at TIMESTAMP;
+ALTER TABLE retouch_jobs ADD COLUMN IF NOT EXISTS queue_wait_ms DOUBLE PRECISION;
+ALTER TABLE retouch_jobs ADD COLUMN IF NOT EXISTS compute_ms DOUBLE PRECISION;
+ALTER TABLE retouch_jobs ADD COLUMN IF NOT EXISTS error TEXT;
+CREATE INDEX IF NOT EXISTS retouch_jobs_status_idx ON retouch_jobs (status);
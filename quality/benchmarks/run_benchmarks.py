@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the image hot paths (offline, CPU, stub models).
+
+Usage:
+    python quality/benchmarks/run_benchmarks.py [--output bench.json]
+        [--thresholds quality/benchmarks/thresholds.json] [--threshold-scale 1.0]
+        [--baseline previous.json --max-regression 0.25] [--filter lut] [--repeat 7]
+
+Each case reports min/median/p95 wall time (and ms per megapixel where the
+work scales with pixels). The run fails (exit code 1) if a metric exceeds its
+limit in the thresholds file (times ``--threshold-scale``), or regresses by
+more than ``--max-regression`` against a ``--baseline`` results file.
+"""
+
+import argparse
+import base64
+import functools
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT))
+
+# Stub models and throwaway storage must be configured before the app is imported
+os.environ.setdefault("AI_STUB_MODELS", "1")
+os.environ.setdefault("STORAGE_DIR", tempfile.mkdtemp(prefix="bench-storage-"))
+os.environ.setdefault("LUT_DIR", str(ROOT / "models" / "luts"))
+os.environ.setdefault("BATCH_WINDOW_MS", "0")
+
+import numpy as np  # noqa: E402
+from PIL import Image, ImageDraw  # noqa: E402
+
+# name -> setup(); setup returns (run, megapixels or None)
+CASES: Dict[str, Callable[[], Tuple[Callable[[], Any], Optional[float]]]] = {}
+
+
+def case(name: str):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+# -----------------------------
+# Fixtures
+# -----------------------------
+def photo(width: int, height: int, seed: int = 0) -> Image.Image:
+    """Smooth gradients plus grain: compresses like a real photo, unlike pure noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200.0
+    grain = rng.normal(0, 6, size=(height, width, 3))
+    return Image.fromarray(np.clip(base + grain + 20, 0, 255).astype(np.uint8))
+
+
+def encoded(img: Image.Image, fmt: str, **params) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **params)
+    return buf.getvalue()
+
+
+def ellipse_mask(size: Tuple[int, int], box: Tuple[int, int, int, int]) -> Image.Image:
+    mask = Image.new("L", size)
+    ImageDraw.Draw(mask).ellipse(box, fill=255)
+    return mask
+
+
+def mp(img: Image.Image) -> float:
+    return img.width * img.height / 1e6
+
+
+# -----------------------------
+# Cases
+# -----------------------------
+@case("decode_png_12mp")
+def _decode_png():
+    data = encoded(photo(4000, 3000), "PNG", compress_level=6)
+    return (lambda: Image.open(io.BytesIO(data)).convert("RGB")), 12.0
+
+
+@case("decode_jpeg_12mp")
+def _decode_jpeg():
+    data = encoded(photo(4000, 3000), "JPEG", quality=90)
+    return (lambda: Image.open(io.BytesIO(data)).convert("RGB")), 12.0
+
+
+@case("mask_crop_and_blend_12mp")
+def _mask_crop():
+    from backend.app.services.mask_crop import crop_for_inpaint, paste_inpainted, plan_mask_crop
+
+    img = photo(4000, 3000)
+    mask_png = encoded(ellipse_mask(img.size, (1800, 1200, 2000, 1400)), "PNG")
+
+    def run():
+        mask = Image.open(io.BytesIO(mask_png)).convert("L")
+        plan = plan_mask_crop(mask, padding=32, native=512)
+        crop, crop_mask = crop_for_inpaint(img, mask, plan)
+        return paste_inpainted(img, mask, crop, plan, feather_radius=8)
+
+    return run, None
+
+
+@case("lut_apply_4mp")
+def _lut_apply():
+    from backend.app.services.lut_service import LUTService
+
+    service = LUTService(lut_dir=None, workers=2)
+    img = photo(2400, 1600)
+    service.apply_lut(img, "cinematic", 0.8)  # compile + cache the filter outside the timed loop
+    return (lambda: service.apply_lut(img, "cinematic", 0.8)), mp(img)
+
+
+@case("lut_tiled_png_4mp")
+def _lut_tiled():
+    from backend.app.services.lut_service import LUTService
+
+    service = LUTService(lut_dir=None, workers=2)
+    img = photo(2400, 1600)
+    return (lambda: b"".join(service.iter_apply_png(img, "vibrant", 1.0, compress_level=1))), mp(img)
+
+
+@case("png_encode_4mp")
+def _png_encode():
+    from backend.app.services.image_io import encode_image
+
+    img = photo(2400, 1600)
+    return (lambda: encode_image(img, "png", compress_level=6)), mp(img)
+
+
+@case("png_stream_4mp")
+def _png_stream():
+    from backend.app.services.png_stream import iter_png_image
+
+    img = photo(2400, 1600)
+    return (lambda: b"".join(iter_png_image(img, compress_level=6))), mp(img)
+
+
+@case("webp_encode_4mp")
+def _webp_encode():
+    from backend.app.services.image_io import encode_image
+
+    img = photo(2400, 1600)
+    return (lambda: encode_image(img, "webp", quality=85)), mp(img)
+
+
+@case("base64_png_4mp")
+def _base64():
+    data = encoded(photo(2400, 1600), "PNG", compress_level=6)
+    return (lambda: base64.b64encode(data).decode("ascii")), 3.84
+
+
+@functools.lru_cache(maxsize=None)
+def _client():
+    """One app instance for all endpoint cases, started once."""
+    from fastapi.testclient import TestClient
+    from backend.app.main import app
+
+    client = TestClient(app)
+    client.__enter__()  # run startup (stub warmup, job queue)
+    return client
+
+
+@case("endpoint_retouch_json_512")
+def _endpoint_json():
+    client = _client()
+    data = encoded(photo(512, 512), "PNG")
+
+    def run():
+        r = client.post(
+            "/api/v1/retouch/process",
+            data={"prompt": "remove blemishes, natural skin", "steps": "20"},
+            files={"image": ("doc.png", data, "image/png")},
+        )
+        assert r.status_code == 200, r.text
+        return r
+
+    return run, None
+
+
+@case("endpoint_retouch_binary_512")
+def _endpoint_binary():
+    client = _client()
+    data = encoded(photo(512, 512), "PNG")
+
+    def run():
+        r = client.post(
+            "/api/v1/retouch/process",
+            data={"prompt": "remove blemishes, natural skin", "steps": "20"},
+            files={"image": ("doc.png", data, "image/png")},
+            headers={"Accept": "image/png"},
+        )
+        assert r.status_code == 200, r.text
+        return r
+
+    return run, None
+
+
+@case("endpoint_inpaint_crop_12mp")
+def _endpoint_inpaint():
+    client = _client()
+    img = photo(4000, 3000)
+    data = encoded(img, "JPEG", quality=90)
+    mask = encoded(ellipse_mask(img.size, (1800, 1200, 2000, 1400)), "PNG")
+
+    def run():
+        r = client.post(
+            "/api/v1/retouch/process",
+            data={"prompt": "remove blemish", "operation": "inpaint", "steps": "20", "response_format": "jpeg"},
+            files={"image": ("doc.jpg", data, "image/jpeg"), "mask": ("mask.png", mask, "image/png")},
+        )
+        assert r.status_code == 200, r.text
+        return r
+
+    return run, None
+
+
+@case("endpoint_sam_points_2mp")
+def _endpoint_sam():
+    client = _client()
+    data = encoded(photo(1920, 1080), "JPEG", quality=90)
+
+    def run():
+        r = client.post(
+            "/api/v1/segmentation/segment-from-points",
+            data={"points": "[[900, 500], [1000, 560]]", "labels": "[1, 1]"},
+            files={"image": ("doc.jpg", data, "image/jpeg")},
+        )
+        assert r.status_code == 200, r.text
+        return r
+
+    return run, None
+
+
+@case("endpoint_lut_apply_2mp")
+def _endpoint_lut():
+    client = _client()
+    data = encoded(photo(1920, 1080), "JPEG", quality=90)
+
+    def run():
+        r = client.post(
+            "/api/v1/luts/apply",
+            data={"lut_name": "cinematic", "intensity": "0.8", "compress_level": "1"},
+            files={"image": ("doc.jpg", data, "image/jpeg")},
+        )
+        assert r.status_code == 200, r.text
+        return r
+
+    return run, None
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+def measure(run: Callable[[], Any], repeat: int, warmup: int) -> List[float]:
+    for _ in range(warmup):
+        run()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples: List[float], megapixels: Optional[float]) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    median_ms = statistics.median(ordered) * 1000.0
+    result = {
+        "runs": len(ordered),
+        "min_ms": round(ordered[0] * 1000.0, 3),
+        "median_ms": round(median_ms, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000.0, 3),
+    }
+    if megapixels:
+        result["megapixels"] = megapixels
+        result["ms_per_mp"] = round(median_ms / megapixels, 3)
+    return result
+
+
+def check(
+    results: Dict[str, Dict[str, Any]],
+    thresholds: Dict[str, Dict[str, float]],
+    scale: float,
+    baseline: Optional[Dict[str, Dict[str, Any]]],
+    max_regression: float,
+) -> List[str]:
+    failures = []
+    for name, limits in thresholds.items():
+        if name not in results:
+            continue
+        for metric, limit in limits.items():
+            value = results[name].get(metric)
+            if value is not None and value > limit * scale:
+                failures.append(f"{name}.{metric} = {value:.2f} exceeds limit {limit * scale:.2f}")
+    for name, previous in (baseline or {}).items():
+        current = results.get(name)
+        if not current or "median_ms" not in previous:
+            continue
+        allowed = previous["median_ms"] * (1.0 + max_regression)
+        if current["median_ms"] > allowed:
+            failures.append(
+                f"{name}.median_ms = {current['median_ms']:.2f} regressed more than "
+                f"{max_regression:.0%} vs baseline {previous['median_ms']:.2f}"
+            )
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--thresholds", default=str(Path(__file__).with_name("thresholds.json")))
+    parser.add_argument("--threshold-scale", type=float, default=float(os.getenv("BENCH_THRESHOLD_SCALE", "1.0")))
+    parser.add_argument("--baseline", help="previous results JSON to compare median times against")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--warmup", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, setup in CASES.items():
+        if args.filter and args.filter not in name:
+            continue
+        run, megapixels = setup()
+        results[name] = summarize(measure(run, args.repeat, args.warmup), megapixels)
+        print(f"{name:32s} median {results[name]['median_ms']:9.2f} ms"
+              + (f"  ({results[name]['ms_per_mp']:.2f} ms/MP)" if megapixels else ""))
+
+    thresholds = json.loads(Path(args.thresholds).read_text()) if args.thresholds else {}
+    baseline = json.loads(Path(args.baseline).read_text())["results"] if args.baseline else None
+    failures = check(results, thresholds, args.threshold_scale, baseline, args.max_regression)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "threshold_scale": args.threshold_scale,
+        "results": results,
+        "failures": failures,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    print(f"Wrote {args.output} ({len(results)} cases, {len(failures)} failures)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Load generator for a running backend (real or ``AI_STUB_MODELS=1``).
+
+Replays a weighted mix of panel workloads (LUT apply, SAM clicks, img2img,
+inpaint) either closed-loop at a fixed concurrency or open-loop at a target
+arrival rate, then reports throughput, error rate and p50/p95/p99 latency per
+endpoint. Results are saved as JSON and can be compared against a previous run.
+
+Examples:
+    python quality/load/loadgen.py --concurrency 10 --duration 60
+    python quality/load/loadgen.py --rate 5 --concurrency 50 --duration 120 \\
+        --mix lut=4,sam=4,img2img=1,inpaint=1 --output load-build42.json --compare load-build41.json
+"""
+
+import argparse
+import io
+import json
+import math
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from PIL import Image, ImageDraw, ImageFilter
+
+
+@dataclass
+class Sample:
+    workload: str
+    latency: float  # seconds, from scheduled start (open loop) or send (closed loop)
+    ok: bool
+    status: int
+    error: str = ""
+
+
+@dataclass
+class Fixtures:
+    image_png: bytes
+    image_jpeg: bytes
+    size: Tuple[int, int]
+    masks: List[bytes] = field(default_factory=list)
+
+
+# -----------------------------
+# Workloads
+# -----------------------------
+def _make_fixtures(image_path: Optional[str], size: int) -> Fixtures:
+    if image_path:
+        img = Image.open(image_path).convert("RGB")
+    else:
+        rnd = random.Random(0)
+        img = Image.new("RGB", (size, size))
+        draw = ImageDraw.Draw(img)
+        for _ in range(60):
+            x, y, r = rnd.randrange(size), rnd.randrange(size), rnd.randrange(8, size // 4)
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rnd.randrange(256) for _ in range(3)))
+        img = img.filter(ImageFilter.GaussianBlur(2))
+    png, jpeg = io.BytesIO(), io.BytesIO()
+    img.save(png, format="PNG")
+    img.save(jpeg, format="JPEG", quality=90)
+    masks = []
+    rnd = random.Random(1)
+    for _ in range(8):
+        mask = Image.new("L", img.size)
+        x, y = rnd.randrange(img.width), rnd.randrange(img.height)
+        r = max(8, min(img.size) // 12)
+        ImageDraw.Draw(mask).ellipse((x - r, y - r, x + r, y + r), fill=255)
+        buf = io.BytesIO()
+        mask.save(buf, format="PNG")
+        masks.append(buf.getvalue())
+    return Fixtures(image_png=png.getvalue(), image_jpeg=jpeg.getvalue(), size=img.size, masks=masks)
+
+
+def _lut(session: requests.Session, base: str, fx: Fixtures, rnd: random.Random) -> requests.Response:
+    return session.post(
+        f"{base}/luts/apply",
+        data={"lut_name": rnd.choice(["cinematic", "vibrant", "matte"]), "intensity": "0.8"},
+        files={"image": ("doc.jpg", fx.image_jpeg, "image/jpeg")},
+    )
+
+
+def _sam(session: requests.Session, base: str, fx: Fixtures, rnd: random.Random) -> requests.Response:
+    w, h = fx.size
+    points = [[rnd.randrange(w), rnd.randrange(h)] for _ in range(rnd.randint(1, 3))]
+    return session.post(
+        f"{base}/segmentation/segment-from-points",
+        data={"points": json.dumps(points), "labels": json.dumps([1] * len(points))},
+        files={"image": ("doc.png", fx.image_png, "image/png")},
+    )
+
+
+def _img2img(session: requests.Session, base: str, fx: Fixtures, rnd: random.Random) -> requests.Response:
+    return session.post(
+        f"{base}/retouch/process",
+        data={"prompt": rnd.choice(["remove blemishes, natural skin", "soft light, even tone"]), "steps": "20"},
+        files={"image": ("doc.png", fx.image_png, "image/png")},
+        headers={"Accept": "image/png"},
+    )
+
+
+def _inpaint(session: requests.Session, base: str, fx: Fixtures, rnd: random.Random) -> requests.Response:
+    return session.post(
+        f"{base}/retouch/process",
+        data={"prompt": "remove blemish", "operation": "inpaint", "steps": "20"},
+        files={
+            "image": ("doc.png", fx.image_png, "image/png"),
+            "mask": ("mask.png", rnd.choice(fx.masks), "image/png"),
+        },
+        headers={"Accept": "image/png"},
+    )
+
+
+WORKLOADS: Dict[str, Callable[[requests.Session, str, Fixtures, random.Random], requests.Response]] = {
+    "lut": _lut,
+    "sam": _sam,
+    "img2img": _img2img,
+    "inpaint": _inpaint,
+}
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in WORKLOADS:
+            raise SystemExit(f"Unknown workload {name!r}; choose from {', '.join(WORKLOADS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+class LoadRun:
+    def __init__(self, base: str, fixtures: Fixtures, mix: Dict[str, float], timeout: float, seed: int = 0) -> None:
+        self.base = base.rstrip("/")
+        self.fixtures = fixtures
+        self.names = list(mix)
+        self.weights = [mix[n] for n in self.names]
+        self.timeout = timeout
+        self.samples: List[Sample] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._rnd = random.Random(seed)
+
+    def pick(self) -> str:
+        with self._lock:
+            return self._rnd.choices(self.names, self.weights)[0]
+
+    def fire(self, workload: str, scheduled: float) -> None:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.request = _with_timeout(session.request, self.timeout)
+            self._local.rnd = random.Random(threading.get_ident())
+        try:
+            resp = WORKLOADS[workload](session, self.base, self.fixtures, self._local.rnd)
+            _ = resp.content  # include body transfer
+            sample = Sample(workload, time.perf_counter() - scheduled, resp.ok, resp.status_code,
+                            "" if resp.ok else resp.text[:200])
+        except Exception as e:
+            sample = Sample(workload, time.perf_counter() - scheduled, False, 0, str(e)[:200])
+        with self._lock:
+            self.samples.append(sample)
+
+    def closed_loop(self, concurrency: int, duration: float, max_requests: Optional[int]) -> float:
+        """Each of ``concurrency`` users sends its next request as soon as the last one returns."""
+        deadline = time.perf_counter() + duration
+        issued = [0]
+
+        def user() -> None:
+            while time.perf_counter() < deadline:
+                with self._lock:
+                    if max_requests is not None and issued[0] >= max_requests:
+                        return
+                    issued[0] += 1
+                self.fire(self.pick(), time.perf_counter())
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=user, daemon=True) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - start
+
+    def open_loop(self, rate: float, concurrency: int, duration: float, max_requests: Optional[int]) -> float:
+        """
+        Poisson arrivals at ``rate``/s regardless of response times. Latency is
+        measured from the scheduled arrival, so time spent waiting for a free
+        client slot counts (no coordinated omission).
+        """
+        start = time.perf_counter()
+        next_at = start
+        count = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while next_at < start + duration and (max_requests is None or count < max_requests):
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.fire, self.pick(), next_at)
+                count += 1
+                next_at += self._rnd.expovariate(rate)
+        return time.perf_counter() - start
+
+
+def _with_timeout(request, timeout: float):
+    def wrapped(method, url, **kwargs):
+        kwargs.setdefault("timeout", timeout)
+        return request(method, url, **kwargs)
+    return wrapped
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples: List[Sample], elapsed: float) -> Dict[str, Dict[str, float]]:
+    groups: Dict[str, List[Sample]] = {"all": samples}
+    for s in sorted(samples, key=lambda s: s.workload):
+        groups.setdefault(s.workload, []).append(s)
+    report = {}
+    for name, group in groups.items():
+        ok = sorted(s.latency * 1000.0 for s in group if s.ok)
+        errors = [s for s in group if not s.ok]
+        report[name] = {
+            "requests": len(group),
+            "errors": len(errors),
+            "error_rate": round(len(errors) / len(group), 4) if group else 0.0,
+            "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+            "mean_ms": round(sum(ok) / len(ok), 2) if ok else None,
+            "p50_ms": round(percentile(ok, 50), 2) if ok else None,
+            "p95_ms": round(percentile(ok, 95), 2) if ok else None,
+            "p99_ms": round(percentile(ok, 99), 2) if ok else None,
+            "max_ms": round(ok[-1], 2) if ok else None,
+            "status_codes": _count(str(s.status) for s in group),
+        }
+    return report
+
+
+def _count(values) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for v in values:
+        counts[v] = counts.get(v, 0) + 1
+    return counts
+
+
+def print_report(report: Dict[str, Dict[str, float]], baseline: Optional[Dict[str, Dict[str, float]]]) -> None:
+    header = f"{'endpoint':10s} {'reqs':>6s} {'err%':>6s} {'rps':>8s} {'p50':>9s} {'p95':>9s} {'p99':>9s}"
+    print(header)
+    print("-" * len(header))
+    for name, r in report.items():
+        line = (f"{name:10s} {r['requests']:6d} {100 * r['error_rate']:6.2f} {r['throughput_rps']:8.2f} "
+                f"{_ms(r['p50_ms'])} {_ms(r['p95_ms'])} {_ms(r['p99_ms'])}")
+        prev = (baseline or {}).get(name)
+        if prev and prev.get("p95_ms") and r["p95_ms"]:
+            line += f"   p95 {100 * (r['p95_ms'] / prev['p95_ms'] - 1):+.1f}%"
+            if prev.get("throughput_rps"):
+                line += f", rps {100 * (r['throughput_rps'] / prev['throughput_rps'] - 1):+.1f}%"
+        print(line)
+
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value:9.1f}" if value is not None else f"{'-':>9s}"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Mixed-workload load generator for the retouch API")
+    parser.add_argument("--url", default="http://localhost:8000/api/v1")
+    parser.add_argument("--concurrency", type=int, default=10, help="users (closed loop) or max in-flight (open loop)")
+    parser.add_argument("--rate", type=float, default=0.0, help="arrivals per second; 0 = closed loop")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--requests", type=int, default=None, help="stop after this many requests")
+    parser.add_argument("--mix", default="lut=3,sam=3,img2img=2,inpaint=2")
+    parser.add_argument("--image", help="document to replay (default: generated)")
+    parser.add_argument("--size", type=int, default=768, help="generated document size (px)")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--label", default="", help="build/commit label stored in the results")
+    parser.add_argument("--output", default="load-results.json")
+    parser.add_argument("--compare", help="previous results JSON to diff against")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="exit 1 if exceeded")
+    args = parser.parse_args(argv)
+
+    try:
+        requests.get(args.url.rsplit("/api/", 1)[0] + "/", timeout=10).raise_for_status()
+    except Exception as e:
+        print(f"Backend not reachable at {args.url}: {e}")
+        return 2
+
+    run = LoadRun(args.url, _make_fixtures(args.image, args.size), parse_mix(args.mix), args.timeout)
+    mode = f"open loop {args.rate}/s" if args.rate > 0 else f"closed loop x{args.concurrency}"
+    print(f"Running {mode} for {args.duration:.0f}s against {args.url} (mix {args.mix})")
+    if args.rate > 0:
+        elapsed = run.open_loop(args.rate, args.concurrency, args.duration, args.requests)
+    else:
+        elapsed = run.closed_loop(args.concurrency, args.duration, args.requests)
+
+    report = summarize(run.samples, elapsed)
+    baseline = json.loads(Path(args.compare).read_text())["endpoints"] if args.compare else None
+    print_report(report, baseline)
+    Path(args.output).write_text(json.dumps({
+        "label": args.label,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "elapsed_s": round(elapsed, 3),
+        "endpoints": report,
+        "sample_errors": [s.error for s in run.samples if not s.ok][:20],
+    }, indent=2))
+    print(f"Wrote {args.output}")
+    if args.max_error_rate is not None and report["all"]["error_rate"] > args.max_error_rate:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
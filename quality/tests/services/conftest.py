@@ -0,0 +1,9 @@
+import pytest
+
+from backend.app.core.config import settings
+
+
+@pytest.fixture(autouse=True)
+def _isolated_storage(tmp_path, monkeypatch):
+    """Keep services that persist to STORAGE_DIR (job store, result cache) inside the test's tmp dir."""
+    monkeypatch.setattr(settings, "STORAGE_DIR", str(tmp_path / "storage"))
@@ -0,0 +1,122 @@
+import asyncio
+import io
+import time
+
+import pytest
+from PIL import Image
+
+from backend.app.services.admission import (
+    BACKGROUND,
+    BATCH,
+    INTERACTIVE,
+    AdmissionController,
+    AdmissionRejected,
+    parse_limits,
+)
+from backend.app.services.ai_service import AIService
+
+
+def test_parse_limits():
+    assert parse_limits("cuda=2, cpu=1,bad") == {"cuda": 2, "cpu": 1}
+
+
+def test_interactive_waiters_overtake_batch_and_background():
+    async def scenario():
+        ctl = AdmissionController(limits={"cuda": 1}, interactive_burst=0)
+        order = []
+        release = asyncio.Event()
+
+        async def work(lane, name, hold=None):
+            async with ctl.slot("cuda", lane):
+                order.append(name)
+                if hold is not None:
+                    await hold.wait()
+
+        first = asyncio.ensure_future(work(BATCH, "running", release))
+        await asyncio.sleep(0)
+        waiters = [
+            asyncio.ensure_future(work(BACKGROUND, "job")),
+            asyncio.ensure_future(work(BATCH, "diffusion")),
+            asyncio.ensure_future(work(INTERACTIVE, "click")),
+        ]
+        await asyncio.sleep(0)
+        assert ctl.stats()["devices"]["cuda"]["waiting"] == {INTERACTIVE: 1, BATCH: 1, BACKGROUND: 1}
+        release.set()
+        await asyncio.gather(first, *waiters)
+        return order
+
+    assert asyncio.run(scenario()) == ["running", "click", "diffusion", "job"]
+
+
+def test_interactive_burst_runs_beside_a_long_batch():
+    async def scenario():
+        ctl = AdmissionController(limits={"cuda": 1}, interactive_burst=1)
+        async with ctl.slot("cuda", BATCH):
+            await asyncio.wait_for(ctl.run("cuda", INTERACTIVE, lambda: "mask"), timeout=1.0)
+            return ctl.stats()["devices"]["cuda"]["active"]
+
+    assert asyncio.run(scenario())[BATCH] == 1
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        ctl = AdmissionController(limits={"cpu": 1}, interactive_burst=0)
+        async with ctl.slot("cpu", BATCH):
+            waiter = asyncio.ensure_future(ctl.run("cpu", BATCH, lambda: None))
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        await asyncio.wait_for(ctl.run("cpu", BATCH, lambda: None), timeout=1.0)
+        return ctl.stats()["devices"]["cpu"]
+
+    state = asyncio.run(scenario())
+    assert sum(state["active"].values()) == 0 and sum(state["waiting"].values()) == 0
+
+
+class SlowDiffusion:
+    device = "cpu"
+
+    def img2img_batch(self, prompts, init_images, strength, guidance_scale, steps, seeds, **_):
+        time.sleep(0.05)
+        return [img.copy() for img in init_images]
+
+
+def test_full_lane_rejects_with_retry_after():
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 32)).save(buf, format="PNG")
+
+    async def scenario():
+        ctl = AdmissionController(limits={"cpu": 1}, queue_limits={BATCH: 1})
+        svc = AIService(device_override="cpu", admission=ctl)
+        svc._diffusion, svc._loaded = SlowDiffusion(), True
+        svc._batcher.window = 0.0
+        results = await asyncio.gather(
+            svc.process_image(buf.getvalue(), "a", num_inference_steps=5),
+            svc.process_image(buf.getvalue(), "b", num_inference_steps=5),
+            svc.process_image(buf.getvalue(), "c", num_inference_steps=5, lane=BACKGROUND),
+            return_exceptions=True,
+        )
+        return results, ctl.stats()["devices"]["cpu"]["rejected"]
+
+    results, rejected = asyncio.run(scenario())
+    assert isinstance(results[1], AdmissionRejected) and results[1].retry_after >= 1
+    assert "image_bytes" in results[0] and "image_bytes" in results[2]  # background lane is unbounded
+    assert rejected == {INTERACTIVE: 0, BATCH: 1, BACKGROUND: 0}
+
+
+def test_hold_keeps_the_slot_until_the_stack_is_closed():
+    async def scenario():
+        ctl = AdmissionController(limits={"cpu": 1}, interactive_burst=0)
+        held = await ctl.hold("cpu", INTERACTIVE)
+        waiter = asyncio.ensure_future(ctl.run("cpu", BATCH, lambda: "graded"))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()  # the streamed body still owns the slot
+        await held.aclose()
+        await held.aclose()  # e.g. body finally + response background task
+        result = await asyncio.wait_for(waiter, timeout=1.0)
+        return result, ctl.stats()["devices"]["cpu"]
+
+    result, stats = asyncio.run(scenario())
+    assert result == "graded"
+    assert stats["active"][INTERACTIVE] == 0 and stats["requests"][INTERACTIVE] == 0
@@ -0,0 +1,84 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+
+from backend.app.services.ai_service import AIService
+from backend.app.services.batch_scheduler import BatchScheduler
+
+
+def test_compatible_requests_share_one_batch():
+    calls = []
+
+    def runner(key, items):
+        calls.append((key, list(items)))
+        if key == "bad":
+            raise RuntimeError("nope")
+        return [f"{key}:{item}" for item in items]
+
+    async def scenario():
+        sched = BatchScheduler(runner, window_ms=20, max_batch=3)
+        results = await asyncio.gather(
+            sched.submit("a", 1), sched.submit("a", 2), sched.submit("b", 3),
+            sched.submit("a", 4), sched.submit("a", 5),
+        )
+        with pytest.raises(RuntimeError):
+            await sched.submit("bad", 0)
+        return sched, results
+
+    sched, results = asyncio.run(scenario())
+    assert results == ["a:1", "a:2", "b:3", "a:4", "a:5"]
+    # max_batch=3 flushes a:[1,2,4] immediately, a:[5] and b:[3] on the window
+    assert sorted(len(items) for key, items in calls if key != "bad") == [1, 1, 3]
+    assert sched.stats()["items"] == 6
+
+
+def test_cancelled_batch_fails_its_callers():
+    async def scenario():
+        never = asyncio.Event()
+
+        async def executor(runner, key, items):
+            await never.wait()  # e.g. a batch still running at shutdown
+
+        sched = BatchScheduler(lambda key, items: items, window_ms=0, executor=executor)
+        callers = asyncio.gather(sched.submit("a", 1), sched.submit("a", 2), return_exceptions=True)
+        await asyncio.sleep(0.01)
+        tasks = set(sched._tasks)
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.wait_for(callers, timeout=1.0)
+        return len(tasks), results, sched._tasks
+
+    n, results, remaining = asyncio.run(scenario())
+    assert n == 2 and not remaining
+    assert all(isinstance(r, RuntimeError) and "cancelled" in str(r) for r in results)
+
+
+class FakeDiffusion:
+    def __init__(self):
+        self.batches = []
+
+    def img2img_batch(self, prompts, init_images, strength, guidance_scale, steps, seeds, **_):
+        self.batches.append(list(prompts))
+        return [img.copy() for img in init_images]
+
+
+def test_ai_service_batches_img2img_by_compatibility():
+    async def scenario():
+        svc = AIService(device_override="cpu")
+        svc._diffusion, svc._loaded = FakeDiffusion(), True
+        svc._batcher.window = 0.02
+        img = Image.new("RGB", (64, 64))
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        data = buf.getvalue()
+        await asyncio.gather(
+            svc.process_image(data, "a", num_inference_steps=5, seed=1),
+            svc.process_image(data, "b", num_inference_steps=5, seed=2),
+            svc.process_image(data, "c", num_inference_steps=6, seed=3),
+        )
+        return svc._diffusion.batches
+
+    batches = asyncio.run(scenario())
+    assert sorted(batches) == [["a", "b"], ["c"]]
@@ -0,0 +1,24 @@
+from backend.app.services.cache import LRUCache
+
+
+def test_lru_evicts_by_bytes():
+    cache = LRUCache(max_bytes=10)
+    cache.put("a", "A", size=4)
+    cache.put("b", "B", size=4)
+    assert cache.get("a") == "A"  # a is now most recent
+    cache.put("c", "C", size=4)
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_rejects_oversized_and_counts():
+    cache = LRUCache(max_bytes=8, max_entries=2)
+    assert cache.put("big", "x", size=9) is False
+    assert cache.get("big") is None
+    cache.put("a", 1, size=1)
+    cache.put("b", 2, size=1)
+    cache.put("c", 3, size=1)
+    assert len(cache) == 2
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["hits"] == 0
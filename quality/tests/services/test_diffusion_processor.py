@@ -0,0 +1,137 @@
+import pytest
+
+from backend.app.services.diffusion_processor import DiffusionConfig, DiffusionProcessor
+
+
+class FakeTensor:
+    def __init__(self, n):
+        self.n = n
+
+    def element_size(self):
+        return 4
+
+    def nelement(self):
+        return self.n
+
+
+class FakeModule:
+    def __init__(self, n):
+        self._params = [FakeTensor(n)]
+
+    def parameters(self):
+        return self._params
+
+    def buffers(self):
+        return []
+
+
+class FakePipe:
+    def __init__(self, **components):
+        self.components = components
+
+
+def _processor():
+    return DiffusionProcessor(DiffusionConfig("base", "base", "inpaint", device_override="cpu"))
+
+
+def test_memory_report_counts_shared_modules_once():
+    proc = _processor()
+    vae, text, unet, inpaint_unet = FakeModule(10), FakeModule(20), FakeModule(100), FakeModule(101)
+    proc._txt2img = FakePipe(vae=vae, text_encoder=text, unet=unet, tokenizer=object(), scheduler=None)
+    proc._img2img = FakePipe(vae=vae, text_encoder=text, unet=unet, tokenizer=object(), scheduler=None)
+    proc._inpaint = FakePipe(vae=vae, text_encoder=text, unet=inpaint_unet, tokenizer=object(), scheduler=None)
+
+    report = proc.memory_report()
+    assert report["pipelines"]["txt2img"]["resident_bytes"] == 4 * 130
+    assert report["pipelines"]["img2img"]["unique_bytes"] == 0
+    assert report["pipelines"]["inpaint"]["unique_bytes"] == 4 * 101
+    assert report["total_resident_bytes"] == 4 * (10 + 20 + 100 + 101)
+
+
+class EncodingPipe:
+    def __init__(self):
+        self.encoded = []
+
+    def encode_prompt(self, prompt, device, num_images_per_prompt, do_classifier_free_guidance):
+        import torch
+        self.encoded.append(prompt)
+        return torch.full((1, 77, 8), float(len(prompt))), None
+
+
+def test_prompt_embeddings_are_encoded_once_per_text_encoder():
+    torch = pytest.importorskip("torch")
+    proc = _processor()
+    pipe = EncodingPipe()
+    timings = []
+    kwargs = proc._encode_prompts(pipe, "txt2img", ["a", "bb", "a"], timings)
+    proc._encode_prompts(pipe, "img2img", ["bb"], timings)  # same base model -> same text encoder
+
+    assert pipe.encoded == ["a", "", "bb"]
+    assert kwargs["prompt_embeds"].shape == (3, 77, 8)
+    assert torch.equal(kwargs["negative_prompt_embeds"][1], torch.zeros(77, 8))
+    assert timings[0]["text_encode_saved_ms"] == 0.0
+    assert timings[2]["text_encode_ms"] == 0.0
+    assert proc.prompt_cache_stats()["hits"] == 5
+
+
+def test_image_digest_tracks_pixels_not_encoding():
+    from PIL import Image
+    from backend.app.services.diffusion_processor import image_digest
+
+    a = Image.new("RGB", (16, 8), "red")
+    assert image_digest(a) == image_digest(a.copy())
+    assert image_digest(a) != image_digest(Image.new("RGB", (8, 16), "red"))
+    assert image_digest(None) is None
+
+
+def test_init_latents_are_reused_for_an_unchanged_document():
+    torch = pytest.importorskip("torch")
+    from types import SimpleNamespace
+    from PIL import Image
+
+    encodes = []
+
+    class VAE:
+        dtype, device = torch.float32, "cpu"
+        config = SimpleNamespace(scaling_factor=0.5)
+
+        def encode(self, pixels):
+            encodes.append(pixels.shape)
+            latent = torch.ones(pixels.shape[0], 4, pixels.shape[2] // 8, pixels.shape[3] // 8)
+            return SimpleNamespace(latent_dist=SimpleNamespace(mode=lambda: latent))
+
+    processor = SimpleNamespace(preprocess=lambda img, height, width: torch.zeros(1, 3, height, width))
+    pipe = SimpleNamespace(vae=VAE(), image_processor=processor, mask_processor=processor)
+    proc = _processor()
+    img = Image.new("RGB", (70, 64))
+    timings = [{}, {}]
+    latents = proc._encode_images(pipe, "img2img", [img, img.copy()], None, timings)
+
+    assert latents.shape == (2, 4, 8, 8) and float(latents[0, 0, 0, 0]) == 0.5
+    assert encodes == [(1, 3, 64, 64)]
+    assert timings[1]["vae_encode_ms"] == 0.0
+    proc._encode_images(pipe, "inpaint", [img], [Image.new("L", (70, 64))], [{}])
+    assert len(encodes) == 2  # masked latents are keyed separately
+
+
+def test_inpaint_only_workload_never_loads_the_base_unet(monkeypatch):
+    from backend.app.services.model_registry import ModelRegistry
+
+    loaded = []
+    monkeypatch.setattr(
+        DiffusionProcessor, "_load_components",
+        lambda self, model_id, with_unet=True: loaded.append(("components", model_id, with_unet)) or {"vae": model_id},
+    )
+    monkeypatch.setattr(DiffusionProcessor, "_load_unet", lambda self, model_id: loaded.append(("unet", model_id)) or model_id)
+    registry = ModelRegistry()
+    proc = DiffusionProcessor(DiffusionConfig("base", "base", "inpaint", device_override="cpu"), registry=registry)
+
+    with registry.use(*proc._deps("inpaint")) as (components, unet):
+        assert components == {"vae": "base"} and unet == "inpaint"
+    assert loaded == [("components", "base", False), ("unet", "inpaint")]
+
+    # txt2img/img2img add only the base UNet on top of the shared components
+    assert proc._deps("txt2img") == proc._deps("img2img") == ["sd-shared:base", "sd-unet:base"]
+    with registry.use(*proc._deps("txt2img")):
+        pass
+    assert loaded[2:] == [("unet", "base")]
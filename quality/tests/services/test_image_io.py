@@ -0,0 +1,69 @@
+import asyncio
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from backend.app.core.metrics import end_request, stage, start_request
+from backend.app.services.image_io import decode_image, encode_image, negotiate_output, run_codec
+from backend.app.services.png_stream import iter_png_image
+
+
+def test_negotiate_output_keeps_json_default():
+    assert negotiate_output(None) == (False, "png")
+    assert negotiate_output("*/*") == (False, "png")
+    assert negotiate_output("application/json, image/png;q=0.5") == (False, "png")
+    assert negotiate_output("image/webp, application/json;q=0.5") == (True, "webp")
+    assert negotiate_output("image/*", image_format="jpg") == (True, "jpeg")
+    assert negotiate_output("image/png;q=0, application/json") == (False, "png")
+    assert negotiate_output("image/png;q=0") == (False, "png")
+    assert negotiate_output("application/json;q=0, image/webp;q=0.2") == (True, "webp")
+    assert negotiate_output("application/json", response_format="binary") == (True, "png")
+    assert negotiate_output(None, response_format="webp") == (True, "webp")
+    with pytest.raises(ValueError):
+        negotiate_output(None, response_format="gif")
+
+
+def test_encoders_round_trip():
+    rng = np.random.default_rng(0)
+    img = Image.fromarray(rng.integers(0, 256, (300, 70, 3), dtype=np.uint8))
+
+    streamed = b"".join(iter_png_image(img, compress_level=1, strip_rows=64))
+    assert np.array_equal(np.asarray(Image.open(io.BytesIO(streamed))), np.asarray(img))
+
+    data, media_type = encode_image(img, "jpeg", quality=50)
+    assert media_type == "image/jpeg"
+    assert Image.open(io.BytesIO(data)).format == "JPEG"
+
+
+def _jpeg(size):
+    buf = io.BytesIO()
+    Image.new("RGB", size, (200, 40, 40)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def test_decode_downscales_on_ingest_and_tracks_scale():
+    decoded = decode_image(_jpeg((4000, 3000)), max_side=1024)
+    assert decoded.image.size == (1024, 768) and decoded.image.mode == "RGB"
+    assert decoded.original_size == (4000, 3000)
+    assert decoded.scale == pytest.approx(1024 / 4000)
+
+    full = decode_image(_jpeg((640, 480)), mode="L", max_side=1024)
+    assert full.image.size == (640, 480) and full.image.mode == "L" and full.scale == 1.0
+
+
+def test_codec_work_runs_off_the_loop_and_keeps_request_stages():
+    def decode(data):
+        with stage("decode"):
+            return decode_image(data).image.size
+
+    async def scenario():
+        stages, token = start_request()
+        try:
+            size = await run_codec(decode, _jpeg((64, 32)))
+        finally:
+            end_request(token)
+        return size, [name for name, _ in stages]
+
+    assert asyncio.run(scenario()) == ((64, 32), ["decode"])
@@ -0,0 +1,51 @@
+import io
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from backend.app.services.image_store import ImageStore, decode_source, source_digest
+from backend.app.services.result_cache import result_key
+
+
+def _png(size=(40, 30), color="red", mode="RGB"):
+    buf = io.BytesIO()
+    Image.new(mode, size, color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_handle_is_content_addressed_and_decoded_once():
+    store = ImageStore(memory_bytes=1 << 20)
+    data = _png()
+    first = store.put(data)
+    assert store.put(data) is first
+    assert len(first.handle) == 64 and first.describe()["width"] == 40
+
+    src = store.get(first.handle)
+    assert decode_source(src).image is src.image  # no decode, no copy
+    small = decode_source(src, "L", max_side=20)
+    assert small.image.size == (20, 15) and small.original_size == (40, 30) and small.scale == 0.5
+    # Handles and raw uploads address the same cached results
+    assert result_key(src, None, "p", {}) == result_key(data, None, "p", {})
+    assert source_digest(src) == source_digest(data)
+
+    assert store.get("0" * 64) is None and store.get("../etc") is None
+    with pytest.raises(ValueError):
+        store.put(b"not an image")
+
+
+def test_disk_tier_promotes_and_entries_expire(tmp_path):
+    store = ImageStore(memory_bytes=1 << 20, disk_dir=str(tmp_path), disk_bytes=1 << 20, ttl_seconds=60)
+    handle = store.put(_png(color="blue")).handle
+
+    restarted = ImageStore(memory_bytes=1 << 20, disk_dir=str(tmp_path), disk_bytes=1 << 20, ttl_seconds=60)
+    assert restarted.get(handle).image.getpixel((0, 0)) == (0, 0, 255)
+    assert restarted.stats()["disk"]["hits"] == 1
+
+    # Unused for longer than the TTL: gone from both tiers
+    restarted.get(handle).last_used -= 120
+    path = next(p for p in tmp_path.glob("*/*"))
+    os.utime(path, (time.time() - 120, time.time() - 120))
+    assert restarted.sweep_expired() == 2
+    assert restarted.get(handle) is None and not path.exists()
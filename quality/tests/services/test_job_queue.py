@@ -0,0 +1,97 @@
+import asyncio
+
+from backend.app.services.job_queue import (
+    InMemoryBroker,
+    JobQueue,
+    JobStore,
+    JOB_FAILED,
+    JOB_SUCCEEDED,
+)
+
+
+async def _fake_process(image_bytes, prompt, *, mask_bytes=None, **params):
+    if prompt == "boom":
+        raise ValueError("pipeline exploded")
+    await asyncio.sleep(0.01)
+    return {"image_png": b"PNG:" + (image_bytes or b""), "meta": {"steps": params["num_inference_steps"]}}
+
+
+def test_jobs_run_and_record_timings(tmp_path):
+    async def scenario():
+        queue = JobQueue(_fake_process, InMemoryBroker(), JobStore(str(tmp_path)), workers=2)
+        await queue.start()
+        ok = await queue.submit({"prompt": "fix skin", "num_inference_steps": 5}, image_bytes=b"abc")
+        bad = await queue.submit({"prompt": "boom", "num_inference_steps": 5})
+        await queue.join()
+        done, failed = await queue.get(ok.id), await queue.get(bad.id)
+        await queue.stop()
+        return queue, done, failed
+
+    queue, done, failed = asyncio.run(scenario())
+    assert done.status == JOB_SUCCEEDED
+    assert done.result_meta == {"steps": 5}
+    assert queue.result_path(done.id).read_bytes() == b"PNG:abc"
+    assert done.queue_wait_ms is not None and done.compute_ms >= 10
+    assert failed.status == JOB_FAILED and "exploded" in failed.error
+
+
+def test_interrupted_jobs_are_requeued_on_restart(tmp_path):
+    from backend.app.services.job_queue import JOB_RUNNING, RetouchJob
+
+    store = JobStore(str(tmp_path))
+    # Left behind by a crashed process: one mid-run, one still queued, one out of attempts
+    crashed = RetouchJob(id="a1", params={"prompt": "p", "num_inference_steps": 2}, status=JOB_RUNNING, attempts=1)
+    queued = RetouchJob(id="b2", params={"prompt": "p", "num_inference_steps": 3})
+    doomed = RetouchJob(id="c3", params={"prompt": "p", "num_inference_steps": 4}, status=JOB_RUNNING, attempts=3)
+    for job in (crashed, queued, doomed):
+        store.save(job)
+    store.put_blob("a1", "image", b"x")
+
+    async def scenario():
+        queue = JobQueue(_fake_process, InMemoryBroker(), store, max_attempts=3)
+        await queue.start()
+        await queue.join()
+        jobs = [await queue.get(i) for i in ("a1", "b2", "c3")]
+        await queue.stop()
+        return jobs
+
+    a, b, c = asyncio.run(scenario())
+    assert a.status == JOB_SUCCEEDED and a.attempts == 2 and a.result_meta == {"steps": 2}
+    assert b.status == JOB_SUCCEEDED and b.attempts == 1
+    assert c.status == JOB_FAILED and "Interrupted" in c.error
+
+
+def test_reaped_jobs_from_dead_consumers_run_again(tmp_path):
+    from backend.app.services.job_queue import JOB_RUNNING, RetouchJob
+
+    class SharedBroker(InMemoryBroker):
+        """Stands in for Redis: one dead consumer left a job in its processing list."""
+
+        durable = True
+        heartbeat_seconds = 0.01
+
+        def __init__(self, orphans):
+            super().__init__()
+            self.orphans, self.acked = list(orphans), []
+
+        async def reap(self):
+            orphans, self.orphans = self.orphans, []
+            return orphans
+
+        async def ack(self, job_id):
+            self.acked.append(job_id)
+
+    store = JobStore(str(tmp_path))
+    store.save(RetouchJob(id="d4", params={"prompt": "p", "num_inference_steps": 1}, status=JOB_RUNNING, attempts=1))
+    broker = SharedBroker(["d4"])
+
+    async def scenario():
+        queue = JobQueue(_fake_process, broker, store)
+        await queue.start()
+        await queue.join()
+        job = await queue.get("d4")
+        await queue.stop()
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == JOB_SUCCEEDED and broker.acked == ["d4"]
@@ -5,3 +5,141 @@ def test_list_luts():
     svc = LUTService()
     luts = svc.list_luts()
     assert isinstance(luts, list) and len(luts) > 0
+
+
+def _cube_text(size, fn):
+    lines = ['TITLE "test"', f"LUT_3D_SIZE {size}"]
+    steps = [i / (size - 1) for i in range(size)]
+    for b in steps:
+        for g in steps:
+            for r in steps:
+                lines.append("%f %f %f" % fn(r, g, b))
+    return "\n".join(lines)
+
+
+def test_parse_cube_orders_red_fastest():
+    from backend.app.services.lut_service import parse_cube
+
+    lut = parse_cube(_cube_text(3, lambda r, g, b: (b, g, r)), name="swap")
+    assert lut.title == "test" and lut.size == 3
+    assert tuple(lut.table[2, 0, 0]) == (0.0, 0.0, 1.0)
+    assert tuple(lut.table[0, 0, 2]) == (1.0, 0.0, 0.0)
+
+
+def test_apply_cube_and_intensity_blend():
+    from PIL import Image
+    from backend.app.services.lut_service import LUTService, parse_cube
+
+    svc = LUTService(lut_dir="")
+    svc.register(parse_cube(_cube_text(9, lambda r, g, b: (1 - r, 1 - g, 1 - b)), name="invert"))
+    img = Image.new("RGB", (4, 4), (200, 100, 0))
+
+    assert svc.apply_lut(img, "invert").getpixel((0, 0)) == (55, 155, 255)
+    assert svc.apply_lut(img, "invert", intensity=0.0).getpixel((0, 0)) == (200, 100, 0)
+    half = svc.apply_lut(img, "invert", intensity=0.5).getpixel((0, 0))
+    assert all(abs(a - b) <= 1 for a, b in zip(half, (128, 128, 128)))
+
+
+def test_tiled_png_stream_matches_direct_apply():
+    import io
+    import zlib
+
+    import numpy as np
+    from PIL import Image
+    from backend.app.services.lut_service import LUTService
+    from backend.app.services.png_stream import adler32_combine
+
+    a, b = b"strip-one" * 50, b"strip-two" * 70
+    assert adler32_combine(zlib.adler32(a), zlib.adler32(b), len(b)) == zlib.adler32(a + b)
+
+    svc = LUTService(lut_dir="", workers=2, memory_budget_bytes=4096)
+    rng = np.random.default_rng(0)
+    img = Image.fromarray(rng.integers(0, 256, (97, 61, 3), dtype=np.uint8))
+    png = b"".join(svc.iter_apply_png(img, "vibrant", 0.6))
+
+    decoded = Image.open(io.BytesIO(png))
+    assert decoded.size == img.size
+    assert np.array_equal(np.asarray(decoded), np.asarray(svc.apply_lut(img, "vibrant", 0.6)))
+
+
+def test_compose_stack_bakes_single_table():
+    import numpy as np
+    from backend.app.services.lut_service import LUTService, parse_cube, identity_table
+
+    svc = LUTService(lut_dir="")
+    svc.register(parse_cube(_cube_text(9, lambda r, g, b: (1 - r, 1 - g, 1 - b)), name="invert"))
+
+    baked = svc.compose([("invert", 1.0), ("invert", 1.0)])
+    assert np.allclose(baked.table, identity_table(baked.size), atol=1e-5)
+
+    rgb = np.random.default_rng(1).random((16, 3), dtype=np.float32)
+    sequential = svc.apply_lut_array(svc.apply_lut_array(rgb, "vibrant"), "matte", 0.5)
+    stacked = svc.compose([("vibrant", 1.0), ("matte", 0.5)])
+    from backend.app.services.lut_service import trilinear
+    assert np.allclose(trilinear(stacked.table, rgb), sequential, atol=0.02)
+
+    assert svc.get_stack_filter([("vibrant", 1.0), ("matte", 0.5)]) is svc.get_stack_filter([("vibrant", 1), ("matte", 0.5)])
+
+
+def test_previews_share_one_thumbnail_and_atlas_offsets():
+    from PIL import Image
+    from backend.app.services.lut_service import LUTService
+
+    svc = LUTService(lut_dir="", workers=2)
+    img = Image.new("RGB", (800, 400), (90, 140, 200))
+    names = svc.list_luts()
+    previews = svc.render_previews(img, names, max_size=100)
+    assert [p.size for p in previews] == [(100, 50)] * len(names)
+
+    atlas, layout = svc.build_atlas(previews, names, columns=2)
+    assert atlas.size == (200, 50 * ((len(names) + 1) // 2))
+    assert layout[1] == {"name": names[1], "x": 100, "y": 0, "width": 100, "height": 50}
+    assert atlas.getpixel((150, 25)) == previews[1].getpixel((50, 25))
+    # column counts outside 1..len(previews) never size the atlas
+    assert svc.build_atlas(previews[:1], names[:1], columns=100000)[0].size == (100, 50)
+    assert svc.build_atlas(previews[:1], names[:1], columns=-2)[0].size == (100, 50)
+
+
+def test_tiled_stream_loads_lazy_jpeg_before_threads_crop():
+    import io
+
+    import numpy as np
+    import pytest
+    from PIL import Image
+    from backend.app.services.lut_service import LUTService
+
+    rng = np.random.default_rng(1)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (600, 900, 3), dtype=np.uint8)).save(buf, format="JPEG")
+    svc = LUTService(lut_dir="", workers=8, memory_budget_bytes=64 * 1024)
+
+    lazy = Image.open(io.BytesIO(buf.getvalue()))  # RGB, never loaded
+    png = b"".join(svc.iter_apply_png(lazy, "vibrant"))
+    expected = svc.apply_lut(Image.open(io.BytesIO(buf.getvalue())), "vibrant")
+    assert np.array_equal(np.asarray(Image.open(io.BytesIO(png))), np.asarray(expected))
+
+    with pytest.raises(ValueError):
+        svc.iter_apply_png(lazy, "vibrant", compress_level=12)
+
+
+def test_stream_releases_the_admission_slot_once_strips_are_graded():
+    import asyncio
+    import io
+    from PIL import Image
+    from backend.app.api.endpoints.luts import _graded_stream
+    from backend.app.services.admission import INTERACTIVE, AdmissionController
+
+    svc = LUTService(lut_dir="", workers=2, memory_budget_bytes=64 * 1024)
+    img = Image.new("RGB", (256, 256), (10, 200, 30))
+
+    async def scenario():
+        ctl = AdmissionController(limits={"cpu": 1}, interactive_burst=0)
+        held = await ctl.hold("cpu", INTERACTIVE)
+        stream = _graded_stream(svc.iter_filter_png(img, None, compress_level=1), held)
+        first = await stream.__anext__()  # the client reads one chunk, then stalls
+        await asyncio.wait_for(ctl.run("cpu", INTERACTIVE, lambda: None), timeout=2.0)
+        rest = [chunk async for chunk in stream]
+        return first + b"".join(rest)
+
+    data = asyncio.run(scenario())
+    assert Image.open(io.BytesIO(data)).getpixel((5, 250)) == (10, 200, 30)
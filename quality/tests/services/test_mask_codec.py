@@ -0,0 +1,43 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from backend.app.services.mask_codec import (
+    decode_rle,
+    encode_mask,
+    encode_rle,
+    mask_bbox,
+    rle_counts,
+    unpack_bits,
+)
+
+
+def _mask():
+    rng = np.random.default_rng(0)
+    mask = np.zeros((37, 53), dtype=bool)
+    mask[5:30, 10:41] = rng.random((25, 31)) > 0.3
+    return mask
+
+
+def test_rle_matches_coco_layout_and_round_trips():
+    assert encode_rle(np.ones((2, 2), dtype=bool)) == {"size": [2, 2], "counts": "04"}
+    assert rle_counts(np.array([[0, 1], [0, 1]], dtype=bool)).tolist() == [2, 2]  # column-major
+    assert rle_counts(np.array([[1, 0]], dtype=bool)).tolist() == [0, 1, 1]  # starts with background
+
+    mask = _mask()
+    rle = encode_rle(mask)
+    assert np.array_equal(decode_rle(rle), mask)
+    assert np.array_equal(decode_rle({"size": rle["size"], "counts": rle_counts(mask).tolist()}), mask)
+
+
+def test_cropped_bits_cover_only_the_bbox():
+    mask = _mask()
+    x, y, w, h = mask_bbox(mask)
+    out = encode_mask(mask, "bits", crop_to_bbox=True)
+    assert out["size"] == [37, 53] and out["bbox"] == [x, y, w, h]
+    assert np.array_equal(unpack_bits(out["mask"], (h, w)), mask[y:y + h, x:x + w])
+
+    empty = encode_mask(np.zeros((4, 4), dtype=bool), "rle", crop_to_bbox=True)
+    assert empty["bbox"] is None and empty["mask"] == {"size": [0, 0], "counts": ""}
+    with pytest.raises(ValueError):
+        encode_mask(mask, "jpeg")
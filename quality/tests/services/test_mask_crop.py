@@ -0,0 +1,103 @@
+import asyncio
+import io
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from backend.app.services.ai_service import AIService
+from backend.app.services.mask_crop import plan_mask_crop
+
+
+def _png(img):
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_plan_grows_small_regions_and_caps_work_size():
+    mask = Image.new("L", (3000, 2000))
+    ImageDraw.Draw(mask).rectangle((2950, 100, 2990, 140), fill=255)
+    plan = plan_mask_crop(mask, padding=16, native=512)
+    left, top, right, bottom = plan.box
+    assert (right - left, bottom - top) == (512, 512)
+    assert right == 3000 and left <= 2950 - 16
+    assert plan.work_size == (512, 512)
+
+    ImageDraw.Draw(mask).rectangle((0, 0, 1999, 999), fill=255)
+    plan = plan_mask_crop(mask, padding=0, native=512)
+    assert plan.work_size[0] == 512 and plan.work_size[1] % 8 == 0
+    assert plan_mask_crop(Image.new("L", (64, 64))) is None
+
+
+class RecordingDiffusion:
+    def __init__(self):
+        self.sizes = []
+
+    def inpaint_batch(self, prompts, init_images, mask_images, guidance_scale, steps, seeds, **_):
+        self.sizes.extend(img.size for img in init_images)
+        return [Image.new("RGB", img.size, (255, 0, 0)) for img in init_images]
+
+
+def test_inpaint_only_touches_the_masked_region():
+    original = Image.fromarray(np.random.default_rng(0).integers(0, 256, (1200, 1600, 3), dtype=np.uint8))
+    mask = Image.new("L", original.size)
+    ImageDraw.Draw(mask).ellipse((700, 500, 760, 560), fill=255)
+
+    async def scenario():
+        svc = AIService(device_override="cpu")
+        svc._diffusion, svc._loaded = RecordingDiffusion(), True
+        svc._batcher.window = 0.0
+        img, meta = await svc.generate(_png(original), "fix", operation="inpaint", mask_bytes=_png(mask), feather=4)
+        empty, _ = await svc.generate(_png(original), "fix", operation="inpaint", mask_bytes=_png(Image.new("L", original.size)))
+        return svc._diffusion.sizes, img, meta, empty
+
+    sizes, img, meta, empty = asyncio.run(scenario())
+    assert sizes == [(512, 512)]
+    out, src = np.asarray(img), np.asarray(original)
+    assert img.size == original.size
+    assert (out[530, 730] == [255, 0, 0]).all()
+    left, top, right, bottom = meta["crop_box"]
+    outside = np.ones(src.shape[:2], dtype=bool)
+    outside[top:bottom, left:right] = False
+    assert np.array_equal(out[outside], src[outside])
+    assert np.array_equal(out[:480], src[:480])  # feather stays near the mask
+    assert np.array_equal(np.asarray(empty), src)
+
+
+def test_mask_at_another_resolution_is_mapped_onto_the_image():
+    import pytest
+
+    original = Image.fromarray(np.random.default_rng(1).integers(0, 256, (600, 800, 3), dtype=np.uint8))
+    mask = Image.new("L", (1600, 1200))  # exported at 2x
+    ImageDraw.Draw(mask).ellipse((1400, 1000, 1460, 1060), fill=255)
+
+    async def scenario(mask_img):
+        svc = AIService(device_override="cpu")
+        svc._diffusion, svc._loaded = RecordingDiffusion(), True
+        svc._batcher.window = 0.0
+        return await svc.generate(_png(original), "fix", operation="inpaint", mask_bytes=_png(mask_img), feather=2)
+
+    img, meta = asyncio.run(scenario(mask))
+    left, top, right, bottom = meta["crop_box"]
+    assert right <= 800 and bottom <= 600 and left < 715 < right and top < 515 < bottom
+    assert (np.asarray(img)[515, 715] == [255, 0, 0]).all()
+
+    with pytest.raises(ValueError, match="does not match"):
+        asyncio.run(scenario(Image.new("L", (800, 800), 255)))
+
+
+def test_full_frame_inpaint_diffuses_at_native_resolution():
+    original = Image.new("RGB", (6000, 4000), "white")
+    mask = Image.new("L", original.size)
+    ImageDraw.Draw(mask).rectangle((100, 100, 900, 900), fill=255)
+
+    async def scenario():
+        svc = AIService(device_override="cpu")
+        svc._diffusion, svc._loaded = RecordingDiffusion(), True
+        svc._batcher.window = 0.0
+        img, meta = await svc.generate(_png(original), "fix", operation="inpaint", mask_bytes=_png(mask), crop_to_mask=False)
+        return svc._diffusion.sizes, img, meta
+
+    sizes, img, meta = asyncio.run(scenario())
+    assert sizes == [(512, 344)] and meta["work_size"] == [512, 344]
+    assert img.size == original.size
@@ -0,0 +1,68 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.core.metrics import (
+    MetricsRegistry,
+    ServerTimingMiddleware,
+    end_request,
+    server_timing,
+    stage,
+    start_request,
+)
+from backend.app.services.batch_scheduler import BatchScheduler
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    hist = registry.histogram("t_seconds", "Test.", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        hist.observe(value, stage='de"code')
+    text = registry.render()
+    assert 't_seconds_bucket{stage="de\\"code",le="0.1"} 1' in text
+    assert 't_seconds_bucket{stage="de\\"code",le="1"} 2' in text
+    assert 't_seconds_bucket{stage="de\\"code",le="+Inf"} 3' in text
+    assert 't_seconds_count{stage="de\\"code"} 3' in text
+    assert "# TYPE t_seconds histogram" in text
+
+
+def test_stages_follow_the_request_into_threads_but_not_shared_batches():
+    async def scenario():
+        batcher = BatchScheduler(lambda key, items: [_in_stage("shared", item) for item in items], window_ms=0)
+        stages, token = start_request()
+        try:
+            with stage("outer"):
+                await asyncio.to_thread(_in_stage, "threaded", None)
+                await batcher.submit("k", 1)
+        finally:
+            end_request(token)
+        return [name for name, _ in stages]
+
+    assert asyncio.run(scenario()) == ["threaded", "outer"]
+
+
+def _in_stage(name, value):
+    with stage(name):
+        return value
+
+
+def test_server_timing_sums_repeated_stages():
+    header = server_timing([("tile", 0.010), ("encode", 0.002), ("tile", 0.015)], total=0.030)
+    assert header == "tile;dur=25.0, encode;dur=2.0, total;dur=30.0"
+
+
+def test_middleware_adds_server_timing_header():
+    app = FastAPI()
+    app.add_middleware(ServerTimingMiddleware)
+
+    @app.get("/work")
+    async def work():
+        with stage("decode"):
+            pass
+        return {"ok": True}
+
+    response = TestClient(app).get("/work")
+    assert response.status_code == 200
+    assert response.headers["server-timing"].startswith("decode;dur=")
+    assert "total;dur=" in response.headers["server-timing"]
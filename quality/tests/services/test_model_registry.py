@@ -0,0 +1,42 @@
+import time
+
+from backend.app.services.model_registry import ModelRegistry
+
+
+def _register(registry, name, size, log):
+    registry.register(
+        name,
+        loader=lambda: log.append(("load", name)) or name.upper(),
+        unloader=lambda value: log.append(("unload", name)),
+        estimate_bytes=size,
+    )
+
+
+def test_lru_eviction_respects_budget_and_pins():
+    log = []
+    registry = ModelRegistry(budget_bytes=100)
+    for name in ("a", "b", "c"):
+        _register(registry, name, 40, log)
+
+    assert registry.get("a") == "A"
+    registry.get("b")
+    with registry.use("a"):
+        registry.get("c")  # needs room: b is LRU among unpinned models
+    assert ("unload", "b") in log and ("unload", "a") not in log
+    assert {m["name"] for m in registry.resident()} == {"a", "c"}
+
+    registry.get("b")  # reloads on demand, evicting the LRU model (a)
+    assert log.count(("load", "b")) == 2
+    assert registry.resident_bytes <= 100
+
+
+def test_idle_models_are_swept():
+    log = []
+    registry = ModelRegistry(idle_seconds=0.05)
+    registry._sweeper = object()  # drive sweeps by hand
+    _register(registry, "sam", 10, log)
+    registry.get("sam")
+    assert registry.sweep_idle() == []
+    time.sleep(0.06)
+    assert registry.sweep_idle() == ["sam"]
+    assert not registry.is_resident("sam")
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.app.services.preload import (
+    MODEL_EVICTED,
+    MODEL_FAILED,
+    MODEL_LOADING,
+    MODEL_PENDING,
+    MODEL_READY,
+    Preloader,
+    parse_plan,
+)
+
+
+def test_parse_plan_rejects_unknown_models():
+    assert parse_plan("img2img, sam,img2img") == ["img2img", "sam"]
+    with pytest.raises(ValueError):
+        parse_plan("img2img,controlnet")
+
+
+def test_models_load_concurrently_in_the_background():
+    both_running = threading.Barrier(2, timeout=2.0)
+
+    def loader():
+        both_running.wait()  # deadlocks unless the two loaders overlap
+        time.sleep(0.02)
+
+    async def scenario():
+        preloader = Preloader({"img2img": loader, "sam": loader})
+        preloader.start()
+        await asyncio.sleep(0)
+        states = {name: m.state for name, m in preloader.models.items()}
+        ready_before = preloader.ready
+        assert await preloader.wait(timeout=5.0)
+        return states, ready_before, preloader.status()
+
+    states, ready_before, status = asyncio.run(scenario())
+    assert not ready_before and set(states.values()) <= {MODEL_PENDING, MODEL_LOADING}
+    assert status["ready"] and status["total_seconds"] is not None
+    for model in status["models"].values():
+        assert model["state"] == MODEL_READY and model["cold_start_seconds"] >= 0.02
+
+
+def test_failed_model_keeps_instance_unready():
+    def broken():
+        raise RuntimeError("checkpoint missing")
+
+    async def scenario():
+        preloader = Preloader({"img2img": lambda: None, "sam": broken}, concurrency=1)
+        preloader.start()
+        return await preloader.wait(timeout=5.0), preloader
+
+    ready, preloader = asyncio.run(scenario())
+    assert not ready and preloader.model_ready("img2img")
+    assert preloader.models["sam"].state == MODEL_FAILED
+    assert "checkpoint missing" in preloader.models["sam"].error
+
+
+def test_failed_load_is_retried_with_back_off():
+    calls = []
+
+    def flaky():
+        calls.append(time.perf_counter())
+        if len(calls) < 3:
+            raise RuntimeError("weights still syncing")
+
+    async def scenario():
+        preloader = Preloader({"sam": flaky}, retry_seconds=0.02, max_retry_seconds=1.0)
+        preloader.start()
+        first = await preloader.wait(timeout=5.0)
+        for _ in range(100):
+            if preloader.ready:
+                break
+            await asyncio.sleep(0.01)
+        preloader.stop()
+        return first, preloader
+
+    first, preloader = asyncio.run(scenario())
+    assert not first and preloader.ready
+    assert preloader.models["sam"].attempts == 3 and preloader.models["sam"].error is None
+    assert calls[1] - calls[0] >= 0.02 and calls[2] - calls[1] >= 0.04  # delay doubles
+
+
+def test_eviction_clears_readiness_until_the_next_use():
+    resident = {"img2img": False}
+
+    def load():
+        resident["img2img"] = True
+
+    async def scenario():
+        preloader = Preloader({"img2img": load}, resident={"img2img": lambda: resident["img2img"]}, retry_seconds=0.01)
+        preloader.start()
+        assert await preloader.wait(timeout=5.0)
+        resident["img2img"] = False  # registry evicted it (budget or idle sweep)
+        evicted = (preloader.ready, preloader.models["img2img"].state)
+        await asyncio.sleep(0.1)
+        still_evicted = preloader.ready
+        resident["img2img"] = True  # a request loaded it again
+        return evicted, still_evicted, preloader
+
+    evicted, still_evicted, preloader = asyncio.run(scenario())
+    assert evicted == (False, MODEL_EVICTED) and not still_evicted
+    assert preloader.ready and preloader.models["img2img"].attempts == 1
+
+
+def test_plan_larger_than_the_budget_does_not_thrash():
+    from backend.app.services.model_registry import ModelRegistry
+
+    registry = ModelRegistry(budget_bytes=100)
+    for name in ("a", "b"):
+        registry.register(name, loader=lambda: object(), estimate_bytes=60)
+
+    async def scenario():
+        preloader = Preloader(
+            {name: (lambda n=name: registry.get(n)) for name in ("a", "b")},
+            concurrency=1,
+            resident={name: (lambda n=name: registry.is_resident(n)) for name in ("a", "b")},
+            retry_seconds=0.05,
+        )
+        preloader.start()
+        await preloader.wait(timeout=5.0)
+        await asyncio.sleep(0.3)
+        return preloader.status()
+
+    status = asyncio.run(scenario())
+    assert not status["ready"]
+    assert sorted(m["state"] for m in status["models"].values()) == [MODEL_EVICTED, MODEL_READY]
+    assert [m["attempts"] for m in status["models"].values()] == [1, 1]
+    assert registry.evictions == 1
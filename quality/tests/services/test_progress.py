@@ -0,0 +1,48 @@
+import asyncio
+import io
+
+import numpy as np
+from PIL import Image
+
+from backend.app.services.ai_service import AIService
+from backend.app.services.progress import ProgressReporter, latents_to_rgb
+
+
+def test_latent_projection_is_cheap_preview_sized():
+    img = latents_to_rgb(np.zeros((1, 4, 64, 48), dtype=np.float32), max_size=256)
+    assert img.size == (192, 256)
+    assert np.asarray(img)[0, 0].tolist() == [127, 127, 127]
+
+
+class SteppingDiffusion:
+    def img2img_batch(self, prompts, init_images, strength, guidance_scale, steps, seeds, callback=None, **_):
+        latents = np.random.default_rng(0).normal(size=(len(prompts), 4, 8, 8)).astype(np.float32)
+        for step in range(1, steps + 1):
+            callback(step, steps, latents)
+        return [img.copy() for img in init_images]
+
+
+def test_reporters_receive_steps_and_previews_per_batched_request():
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 64)).save(buf, format="PNG")
+
+    async def scenario():
+        svc = AIService(device_override="cpu")
+        svc._diffusion, svc._loaded = SteppingDiffusion(), True
+        svc._batcher.window = 0.02
+        reporters = [ProgressReporter(preview_every=4), ProgressReporter(preview_every=0)]
+
+        async def run(reporter):
+            try:
+                await svc.process_image(buf.getvalue(), "p", num_inference_steps=10, progress=reporter)
+            finally:
+                reporter.close()
+            return [event async for event in reporter.events()]
+
+        return await asyncio.gather(*(run(r) for r in reporters)), reporters
+
+    (first, second), reporters = asyncio.run(scenario())
+    assert [d["step"] for e, d in first if e == "progress"] == list(range(1, 11))
+    assert [d["step"] for e, d in first if e == "preview"] == [4, 8]
+    assert not [e for e, _ in second if e == "preview"]
+    assert reporters[0].stats()["previews"] == 2
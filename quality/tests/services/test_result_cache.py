@@ -0,0 +1,67 @@
+import asyncio
+import io
+import os
+
+from PIL import Image
+
+from backend.app.services.ai_service import AIService
+from backend.app.services.cache import DiskCache
+from backend.app.services.image_io import encode_image
+from backend.app.services.result_cache import ResultCache, output_encoding
+
+
+class CountingDiffusion:
+    def __init__(self):
+        self.calls = 0
+
+    def img2img_batch(self, prompts, init_images, strength, guidance_scale, steps, seeds, **_):
+        self.calls += 1
+        return [Image.new("RGB", img.size, ((seed or 0) % 256, 0, 0)) for img, seed in zip(init_images, seeds)]
+
+
+def test_seeded_requests_hit_cache_and_unseeded_do_not():
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 32), "white").save(buf, format="PNG")
+    data = buf.getvalue()
+
+    async def scenario():
+        svc = AIService(device_override="cpu")
+        svc._diffusion, svc._loaded = CountingDiffusion(), True
+        svc._batcher.window = 0.0
+        first = await svc.process_image(data, "p", seed=7)
+        await asyncio.sleep(0.05)  # let the background disk write land
+        second = await svc.process_image(data, "p", seed=7)
+        other = await svc.process_image(data, "p", seed=7, strength=0.5)
+        webp = await svc.process_image(data, "p", seed=7, output_format="webp")
+        await svc.process_image(data, "p")
+        await svc.process_image(data, "p")
+        return svc, first, second, other, webp
+
+    svc, first, second, other, webp = asyncio.run(scenario())
+    assert svc._diffusion.calls == 4
+    assert first["meta"]["cache"] == "miss" and second["meta"]["cache"] == "memory"
+    assert other["meta"]["cache"] == "miss"
+    assert second["image_bytes"] == first["image_bytes"]  # served as stored: no re-encode
+    assert Image.open(io.BytesIO(second["image_png"])).getpixel((0, 0)) == (7, 0, 0)
+    # Another encoding of a cached result comes from the disk tier's lossless copy
+    assert webp["meta"]["cache"] == "disk" and webp["media_type"] == "image/webp"
+    stats = svc.cache_stats()
+    assert stats["hits"] == 2 and stats["lookups"] == 4
+
+
+def test_disk_tier_survives_restart_and_evicts_by_size(tmp_path):
+    cache = ResultCache(memory_bytes=1024 * 1024, disk_dir=str(tmp_path), disk_bytes=10 * 1024 * 1024)
+    blue = Image.new("RGB", (16, 16), "blue")
+    jpeg, media_type = encode_image(blue, "jpeg")
+    cache.put("abc123", output_encoding("jpeg"), jpeg, media_type, {"seed": 1}, blue)
+
+    hit = ResultCache(memory_bytes=1024 * 1024, disk_dir=str(tmp_path), disk_bytes=1 << 20).get("abc123", "png:6")
+    assert hit.tier == "disk" and hit.meta == {"seed": 1} and hit.media_type == "image/png"
+    assert Image.open(io.BytesIO(hit.data)).getpixel((0, 0)) == (0, 0, 255)  # lossless copy, not the JPEG
+
+    disk = DiskCache(str(tmp_path / "blobs"), max_bytes=250)
+    for i, key in enumerate(["aa1", "aa2", "aa3"]):
+        disk.put(key, bytes(100))
+        os.utime(disk._path(key), (i, i))
+    assert disk.get("aa1") is None and disk.get("aa3") is not None
+    assert disk.total_bytes == 200 and disk.evictions == 1
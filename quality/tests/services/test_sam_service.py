@@ -0,0 +1,178 @@
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pydantic")
+from PIL import Image
+
+from backend.app.services.model_registry import ModelRegistry
+from backend.app.services.sam_service import SAMPrompt, SAMService
+
+
+class FakePredictor:
+    def __init__(self):
+        self.encoder_calls = 0
+        self.reset_image()
+
+    def reset_image(self):
+        self.is_image_set = False
+        self.features = None
+        self.original_size = None
+        self.input_size = None
+
+    def set_image(self, image):
+        self.encoder_calls += 1
+        self.encoded_shape = image.shape[:2]
+        self.features = np.zeros((1, 4, 8, 8), dtype=np.float32)
+        self.original_size = image.shape[:2]
+        self.input_size = (8, 8)
+        self.is_image_set = True
+
+    def predict(self, point_coords, point_labels, multimask_output):
+        assert self.is_image_set
+        h, w = self.original_size
+        return np.ones((3, h, w), dtype=bool), np.array([0.1, 0.9, 0.5]), np.zeros((3, 4, 4))
+
+
+def _png(color):
+    buf = io.BytesIO()
+    Image.new("RGB", (16, 12), color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_repeat_clicks_reuse_embedding():
+    predictor = FakePredictor()
+    registry = ModelRegistry()
+    registry.register("sam:vit_b", loader=lambda: predictor)
+    svc = SAMService(checkpoint="unused", model_type="vit_b", cache_bytes=1 << 20, registry=registry)
+    img = _png("red")
+
+    masks, scores, _ = svc.segment_points(img, [[1, 1]], [1])
+    svc.segment_points(img, [[2, 2]], [1])
+    svc.segment_points(_png("blue"), [[2, 2]], [1])
+
+    assert masks.shape == (3, 12, 16)
+    assert predictor.encoder_calls == 2
+    stats = svc.cache_stats()
+    assert stats["hits"] == 1 and stats["misses"] == 2
+
+
+def test_large_upload_is_decoded_at_encoder_size():
+    predictor = FakePredictor()
+    registry = ModelRegistry()
+    registry.register("sam:vit_b", loader=lambda: predictor)
+    svc = SAMService(checkpoint="unused", model_type="vit_b", cache_bytes=1 << 20, registry=registry)
+    buf = io.BytesIO()
+    Image.new("RGB", (3000, 2000), "green").save(buf, format="JPEG")
+
+    masks, _, _ = svc.segment_points(buf.getvalue(), [[1500, 1000]], [1])
+
+    assert predictor.encoded_shape == (683, 1024)
+    assert masks.shape == (3, 2000, 3000)  # masks come back at upload resolution
+
+
+class BatchPredictor(FakePredictor):
+    def __init__(self):
+        super().__init__()
+        self.passes = []
+
+    def predict_batch(self, point_coords, point_labels, boxes, multimask_output):
+        self.passes.append((point_coords, point_labels, boxes))
+        n = len(boxes) if boxes is not None else len(point_coords)
+        h, w = self.original_size
+        scores = np.arange(n, dtype=np.float32)[:, None]  # row id, to check result order
+        return np.ones((n, 1, h, w), dtype=bool), scores, np.zeros((n, 1, 4, 4))
+
+
+def test_batch_prompts_share_one_encoder_run_and_pad_points():
+    predictor = BatchPredictor()
+    registry = ModelRegistry()
+    registry.register("sam:vit_b", loader=lambda: predictor)
+    svc = SAMService(checkpoint="unused", model_type="vit_b", cache_bytes=1 << 20, registry=registry)
+
+    results = svc.segment_batch(_png("red"), [
+        SAMPrompt(points=[[1, 1]], labels=[1]),
+        SAMPrompt(box=[0, 0, 8, 8]),
+        SAMPrompt(points=[[2, 2], [3, 3], [4, 4]], labels=[1, 0, 1]),
+        SAMPrompt(box=[4, 4, 12, 10]),
+    ])
+
+    assert predictor.encoder_calls == 1
+    assert len(predictor.passes) == 2  # one decoder pass for point groups, one for boxes
+    coords, labels, boxes = predictor.passes[0]
+    assert coords.shape == (2, 3, 2) and boxes is None
+    assert labels.tolist() == [[1, -1, -1], [1, 0, 1]]
+    assert predictor.passes[1][2].tolist() == [[0, 0, 8, 8], [4, 4, 12, 10]]
+    assert [float(scores[0]) for _, scores, _ in results] == [0.0, 0.0, 1.0, 1.0]
+    assert results[1][0].shape == (1, 12, 16)
+
+
+class RefinePredictor(FakePredictor):
+    def __init__(self):
+        super().__init__()
+        self.mask_inputs = []
+
+    def predict(self, point_coords, point_labels, multimask_output, mask_input=None):
+        self.mask_inputs.append(mask_input)
+        masks, scores, _ = super().predict(point_coords, point_labels, multimask_output)
+        return masks, scores, np.arange(3 * 16, dtype=np.float32).reshape(3, 4, 4)
+
+
+def test_session_feeds_back_best_low_res_logits():
+    predictor = RefinePredictor()
+    registry = ModelRegistry()
+    registry.register("sam:vit_b", loader=lambda: predictor)
+    svc = SAMService(checkpoint="unused", model_type="vit_b", cache_bytes=1 << 20, registry=registry)
+    img = _png("red")
+
+    svc.segment_points(img, [[1, 1]], [1], session_id="s1")
+    svc.segment_points(img, [[1, 1], [5, 5]], [1, 0], session_id="s1")
+    svc.segment_points(_png("blue"), [[1, 1]], [1], session_id="s1")  # other image: start over
+    svc.segment_points(img, [[1, 1]], [1])
+
+    first, refined, other_image, no_session = predictor.mask_inputs
+    assert first is None and other_image is None and no_session is None
+    assert refined.shape == (1, 4, 4) and refined[0, 0, 0] == 16  # candidate 1 scored best
+    assert svc.cache_stats()["sessions"] == 1
+    assert svc.end_session("s1") and not svc.end_session("s1")
+
+
+def test_batched_decoder_upsamples_masks_in_pixel_budget_chunks(monkeypatch):
+    torch = pytest.importorskip("torch")
+    from types import SimpleNamespace
+    from backend.app.core.config import settings
+
+    upsampled = []
+
+    class PromptEncoder:
+        def __call__(self, points, boxes, masks):
+            return torch.zeros(len(boxes), 2, 8), None
+
+        def get_dense_pe(self):
+            return None
+
+    class Model:
+        mask_threshold = 0.0
+        prompt_encoder = PromptEncoder()
+
+        def mask_decoder(self, sparse_prompt_embeddings, multimask_output, **_):
+            n = sparse_prompt_embeddings.shape[0]
+            return torch.ones(n, 3, 4, 4), torch.ones(n, 3)
+
+        def postprocess_masks(self, logits, input_size, original_size):
+            upsampled.append(logits.shape[0])
+            return torch.ones(logits.shape[0], logits.shape[1], *original_size)
+
+    predictor = SimpleNamespace(
+        model=Model(), features=None, device="cpu", original_size=(20, 30), input_size=(16, 24),
+        transform=SimpleNamespace(target_length=32, apply_boxes=lambda boxes, size: boxes),
+    )
+    # room for two prompts' 3 x (32*32 + 20*30) float maps per chunk
+    monkeypatch.setattr(settings, "SAM_UPSAMPLE_BUDGET_MP", (2 * 3 * (32 * 32 + 20 * 30) + 1) / 1e6)
+    boxes = np.zeros((5, 4), dtype=np.float32)
+    masks, scores, logits = SAMService._predict_batch(predictor, None, None, boxes, True)
+
+    assert upsampled == [2, 2, 1]
+    assert masks.shape == (5, 3, 20, 30) and masks.all()
+    assert scores.shape == (5, 3) and logits.shape == (5, 3, 4, 4)
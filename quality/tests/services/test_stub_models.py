@@ -0,0 +1,38 @@
+import asyncio
+import io
+
+from PIL import Image, ImageDraw
+
+from backend.app.services.ai_service import AIService
+from backend.app.services.model_registry import ModelRegistry
+from backend.app.services.sam_service import SAMService
+
+
+def _png(img):
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_stub_models_serve_the_full_service_path(monkeypatch):
+    monkeypatch.setenv("AI_STUB_MODELS", "1")
+    doc = Image.new("RGB", (640, 480), "white")
+    mask = Image.new("L", doc.size)
+    ImageDraw.Draw(mask).rectangle((300, 200, 340, 240), fill=255)
+
+    async def scenario():
+        svc = AIService(device_override="cpu")
+        inpainted = await svc.process_image(_png(doc), "fix", operation="inpaint", mask_bytes=_png(mask))
+        txt = await svc.process_image(None, "a cat", operation="txt2img", num_inference_steps=3)
+        return svc, inpainted, txt
+
+    svc, inpainted, txt = asyncio.run(scenario())
+    assert type(svc._diffusion).__name__ == "StubDiffusionProcessor"
+    out = Image.open(io.BytesIO(inpainted["image_bytes"]))
+    assert out.size == doc.size and out.getpixel((0, 0)) == (255, 255, 255)
+    assert out.getpixel((320, 220)) != (255, 255, 255)
+    assert Image.open(io.BytesIO(txt["image_bytes"])).size == (512, 512)
+
+    sam = SAMService(checkpoint="/nonexistent", model_type="vit_b", registry=ModelRegistry())
+    masks, scores, _ = sam.segment_points(_png(doc), [[100, 100]], [1])
+    assert masks.shape == (3, 480, 640) and masks[1][100, 100] and not masks[1][0, 639]
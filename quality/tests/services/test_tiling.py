@@ -0,0 +1,67 @@
+import asyncio
+import io
+
+import numpy as np
+from PIL import Image
+
+from backend.app.services.ai_service import AIService
+from backend.app.services.tiling import blend_tile, plan_tiles
+
+
+def test_layout_covers_image_with_equal_tiles():
+    layout = plan_tiles((1300, 700), tile=512, overlap=64)
+    assert layout.tile_size == (512, 512)
+    assert layout.xs[0] == 0 and layout.xs[-1] == 1300 - 512
+    assert layout.ys == [0, 700 - 512]
+    assert all(b - a <= 512 - 64 for a, b in zip(layout.xs, layout.xs[1:]))
+    assert plan_tiles((300, 200), tile=512).tile_size == (300, 200)
+
+
+def test_seams_are_cross_faded():
+    layout = plan_tiles((192, 64), tile=128, overlap=64)
+    canvas = np.zeros((64, 192, 3), dtype=np.uint8)
+    for col, row, _ in layout.tiles():
+        blend_tile(canvas, np.full((64, 128, 3), 200 * col, dtype=np.uint8), layout, col, row)
+    line = canvas[32, :, 0].astype(int)
+    assert line[0] == 0 and line[-1] == 200
+    assert (np.diff(line) >= 0).all() and np.abs(np.diff(line)).max() <= 4
+
+
+class TileDiffusion:
+    def __init__(self):
+        self.batches = []
+
+    def img2img_batch(self, prompts, init_images, strength, guidance_scale, steps, seeds, **_):
+        self.batches.append((len(init_images), init_images[0].size, list(seeds)))
+        return [img.copy() for img in init_images]
+
+
+def test_tiled_img2img_batches_tiles_and_reassembles():
+    src = Image.fromarray(np.random.default_rng(1).integers(0, 256, (900, 1400, 3), dtype=np.uint8))
+    buf = io.BytesIO()
+    src.save(buf, format="PNG")
+
+    async def scenario():
+        svc = AIService(device_override="cpu")
+        svc._diffusion, svc._loaded = TileDiffusion(), True
+        svc._batcher.window, svc._batcher.max_batch = 0.01, 4
+        img, meta = await svc.generate(buf.getvalue(), "p", tiled=True, tile_size=512, tile_overlap=64, seed=10)
+        return svc._diffusion.batches, img, meta
+
+    batches, img, meta = asyncio.run(scenario())
+    assert meta["tiles"] == 6
+    assert [n for n, _, _ in batches] == [4, 2]
+    assert all(size == (512, 512) for _, size, _ in batches)
+    assert sorted(s for _, _, seeds in batches for s in seeds) == list(range(10, 16))
+    assert np.array_equal(np.asarray(img), np.asarray(src))
+
+
+def test_tile_parameters_out_of_range_are_rejected():
+    import pytest
+
+    svc = AIService(device_override="cpu")
+    assert svc.tiling() == (512, 64)
+    assert svc.tiling(256, 128) == (256, 128)
+    for tile, overlap in ((8, 0), (4096, 0), (512, 300), (512, -1)):
+        with pytest.raises(ValueError):
+            svc.tiling(tile, overlap)